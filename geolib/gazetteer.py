@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""In memory search index over the PlaceName table.
+
+A Gazetteer answers two kinds of query:
+
+  - search(text): names with a word beginning with each word of the
+    text, ignoring case, macrons and punctuation. "arth pass" finds
+    Arthur's Pass. Matches are found by bisection of a sorted list
+    of name words.
+
+  - nearest(longitude, latitude, k): the k places nearest a point,
+    searching outwards through a grid of cells.
+
+The index is built once per process by gazetteer(), and built again
+whenever the table's row count or latest update has changed since,
+as sheet indexes are (see geolib.index), so that a reload by
+loadplacenames reaches running web and worker processes. reset()
+drops it.
+"""
+from __future__ import unicode_literals
+
+import bisect
+import heapq
+import math
+import re
+import unicodedata
+
+import numpy
+
+from geolib.index import version
+from geolib.models import PlaceName
+
+CELL = 0.1     # Grid cell size, degrees.
+EARTH_RADIUS = 6371008.8
+
+
+def normalise(text):
+    """Lower case, strip diacritics, and reduce punctuation to spaces."""
+
+    text = unicodedata.normalize('NFKD', '%s' % text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"['’]", '', text.lower())
+
+    return ' '.join(re.split(r'\W+', text, flags=re.UNICODE)).strip()
+
+
+class Gazetteer(object):
+
+    def __init__(self, places, cell=CELL):
+        """Index an iterable of (identifier, name, longitude, latitude)."""
+
+        self.cell = cell
+        self.identifiers = []
+        self.names = []
+        self.keys = []
+        longitudes = []
+        latitudes = []
+        words = []
+        cells = {}
+
+        for (identifier, name, longitude, latitude) in places:
+            number = len(self.identifiers)
+            self.identifiers.append(identifier)
+            self.names.append(name)
+            self.keys.append(normalise(name))
+            longitudes.append(longitude)
+            latitudes.append(latitude)
+
+            for word in set(self.keys[-1].split()):
+                words.append((word, number))
+
+            cells.setdefault(self.cellkey(longitude, latitude), []).append(
+                number)
+
+        words.sort()
+        self.words = [word for (word, number) in words]
+        self.word_places = numpy.array(
+            [number for (word, number) in words], dtype=int)
+
+        self.longitudes = numpy.array(longitudes, dtype=float)
+        self.latitudes = numpy.array(latitudes, dtype=float)
+        self.cells = dict(
+            (key, numpy.array(numbers, dtype=int))
+            for (key, numbers) in cells.items()
+        )
+
+        if cells:
+            keys = numpy.array(list(cells))
+            self.bounds = tuple(int(n) for n in (
+                keys[:, 0].min(), keys[:, 1].min(),
+                keys[:, 0].max(), keys[:, 1].max()))
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    def cellkey(self, longitude, latitude):
+        return (
+            int(math.floor(longitude / self.cell)),
+            int(math.floor(latitude / self.cell)),
+        )
+
+    def prefixed(self, prefix):
+        """Return the set of place numbers with a word beginning prefix."""
+
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + '\uffff')
+
+        return set(self.word_places[start:end].tolist())
+
+    def search(self, text, limit=20, near=None):
+        """Return identifiers of places matching every word of text.
+
+        Names beginning with the text come first, then shorter names.
+        Given near, a (longitude, latitude) pair, the nearest matches
+        come first instead.
+        """
+
+        words = normalise(text).split()
+        if not words:
+            return []
+
+        numbers = None
+        for word in sorted(words, key=len, reverse=True):
+            matches = self.prefixed(word)
+            numbers = matches if numbers is None else numbers & matches
+            if not numbers:
+                return []
+
+        if near is not None:
+            numbers = numpy.array(sorted(numbers), dtype=int)
+            metres = self.distances(near[0], near[1], numbers)
+            return [
+                self.identifiers[number]
+                for number in numbers[numpy.argsort(metres)[:limit]]
+            ]
+
+        key = ' '.join(words)
+        ranked = heapq.nsmallest(limit, numbers, key=lambda number: (
+            not self.keys[number].startswith(key),
+            len(self.keys[number]),
+            self.keys[number],
+        ))
+
+        return [self.identifiers[number] for number in ranked]
+
+    def distances(self, longitude, latitude, numbers):
+        """Haversine distances in metres from a point to some places."""
+
+        phi1 = math.radians(latitude)
+        phi2 = numpy.radians(self.latitudes[numbers])
+        dlambda = numpy.radians(self.longitudes[numbers] - longitude)
+
+        a = (numpy.sin((phi2 - phi1) / 2) ** 2 +
+             math.cos(phi1) * numpy.cos(phi2) * numpy.sin(dlambda / 2) ** 2)
+
+        return 2 * EARTH_RADIUS * numpy.arcsin(
+            numpy.sqrt(numpy.clip(a, 0, 1)))
+
+    def ring(self, ci, cj, ring):
+        """Yield the keys of occupied cells in a square ring around a cell.
+
+        Only the part of the ring within the bounds of the index is
+        visited.
+        """
+
+        (imin, jmin, imax, jmax) = self.bounds
+        irange = range(max(ci - ring, imin), min(ci + ring, imax) + 1)
+        jrange = range(
+            max(cj - ring + 1, jmin), min(cj + ring - 1, jmax) + 1)
+
+        keys = []
+        for j in set((cj - ring, cj + ring)):
+            if jmin <= j <= jmax:
+                keys.extend((i, j) for i in irange)
+        for i in set((ci - ring, ci + ring)):
+            if imin <= i <= imax:
+                keys.extend((i, j) for j in jrange)
+
+        for key in keys:
+            if key in self.cells:
+                yield key
+
+    def nearest(self, longitude, latitude, k=10):
+        """Return [(identifier, metres)] for the k places nearest a point.
+
+        Rings of cells around the point are searched until k places
+        are found nearer than any unsearched cell could be.
+        """
+
+        if not len(self):
+            return []
+
+        (ci, cj) = self.cellkey(longitude, latitude)
+        (imin, jmin, imax, jmax) = self.bounds
+
+        # Start at the first ring which reaches an occupied cell.
+        ring = max(0, imin - ci, ci - imax, jmin - cj, cj - jmax)
+        last = max(ci - imin, imax - ci, cj - jmin, jmax - cj)
+
+        # Width of a cell at the most poleward latitude of the point
+        # or the places, the smallest distance across one ring.
+        poleward = max(
+            abs(latitude), abs(jmin * self.cell), abs((jmax + 1) * self.cell))
+        cell_metres = math.radians(self.cell) * EARTH_RADIUS * math.cos(
+            math.radians(min(poleward, 89)))
+
+        best = numpy.array([], dtype=int)
+        metres = numpy.array([], dtype=float)
+
+        while True:
+            cells = [self.cells[key] for key in self.ring(ci, cj, ring)]
+            if cells:
+                found = numpy.concatenate(cells)
+                best = numpy.concatenate((best, found))
+                metres = numpy.concatenate((
+                    metres, self.distances(longitude, latitude, found)))
+                order = numpy.argsort(metres)[:k]
+                (best, metres) = (best[order], metres[order])
+
+            if (ring >= last or
+                    (len(best) >= k and metres[-1] <= ring * cell_metres)):
+                return [
+                    (self.identifiers[number], float(distance))
+                    for (number, distance) in zip(best, metres)
+                ]
+
+            ring += 1
+
+
+_gazetteer = []
+
+
+def gazetteer():
+    """Return the Gazetteer of the PlaceName table, built once per version.
+    """
+
+    current = version(PlaceName)
+    if not _gazetteer or _gazetteer[0][0] != current:
+        _gazetteer[:] = [(current, Gazetteer(PlaceName.objects.values_list(
+            'identifier', 'name', 'longitude', 'latitude').iterator()))]
+
+    return _gazetteer[0][1]
+
+
+def reset():
+    """Forget the index, so it is rebuilt from the table."""
+
+    del _gazetteer[:]
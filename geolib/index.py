@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""In memory index of map sheets, for fast point-in-sheet lookup.
+
+A SheetIndex holds the polygons of a sheet table (Topo50 or Topo250)
+on a regular grid of cells, each listing the sheets whose extent
+overlaps it. Batches of points are grouped by cell with NumPy, tested
+against the extents of the candidate sheets, and only then against
+the prepared sheet polygons.
+
+Indexes are built once per process by sheet_index(), and built again
+whenever the table's row count or latest update has changed since, so
+that a reload by loadsheets reaches running web and job processes.
+reset() drops them all. Each call checks the version with a query,
+so callers using an index many times fetch it once and pass it on.
+
+QuerySet.update() does not set auto_now fields. A bulk update of a
+sheet table must set updated itself, or it is not seen by other
+processes; loadsheets saves changed sheets one by one instead.
+"""
+from __future__ import unicode_literals
+
+import math
+
+from django.contrib.gis.geos import Point
+from django.db.models import Count, Max
+
+import numpy
+
+CELL = 0.25    # Grid cell size, degrees.
+OFFSET = 4096  # Added to cell numbers, so that keys are positive.
+
+
+class SheetIndex(object):
+
+    def __init__(self, sheets, cell=CELL):
+        """Index an iterable of (identifier, polygon) pairs."""
+
+        self.cell = cell
+        self.identifiers = []
+        self.polygons = []
+        self.extents = []
+        self.grid = {}
+
+        for (identifier, geom) in sheets:
+            number = len(self.identifiers)
+            self.identifiers.append(identifier)
+            self.polygons.append(geom.prepared)
+            self.extents.append(geom.extent)
+
+            (xmin, ymin, xmax, ymax) = geom.extent
+            for i in range(self.cellnumber(xmin), self.cellnumber(xmax) + 1):
+                for j in range(
+                        self.cellnumber(ymin), self.cellnumber(ymax) + 1):
+                    self.grid.setdefault(self.key(i, j), []).append(number)
+
+        self.extents = numpy.array(self.extents, dtype=float).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    def cellnumber(self, value):
+        return int(math.floor(value / self.cell))
+
+    def key(self, i, j):
+        return (i + OFFSET) * 2 * OFFSET + (j + OFFSET)
+
+    def locate(self, longitudes, latitudes):
+        """Return an array of sheet numbers, or -1, for each point."""
+
+        longitudes = numpy.asarray(longitudes, dtype=float)
+        latitudes = numpy.asarray(latitudes, dtype=float)
+        result = numpy.full(len(longitudes), -1, dtype=int)
+        if not len(longitudes) or not self.grid:
+            return result
+
+        keys = self.key(
+            numpy.floor(longitudes / self.cell).astype(int),
+            numpy.floor(latitudes / self.cell).astype(int),
+        )
+        (cells, inverse) = numpy.unique(keys, return_inverse=True)
+        order = numpy.argsort(inverse, kind='mergesort')
+        bounds = numpy.searchsorted(
+            inverse[order], numpy.arange(len(cells) + 1))
+
+        for (n, cellkey) in enumerate(cells):
+            candidates = self.grid.get(int(cellkey))
+            if not candidates:
+                continue
+
+            members = order[bounds[n]:bounds[n + 1]]
+            for number in candidates:
+                (xmin, ymin, xmax, ymax) = self.extents[number]
+                x = longitudes[members]
+                y = latitudes[members]
+                inside = members[
+                    (result[members] == -1) &
+                    (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+                ]
+                polygon = self.polygons[number]
+                for p in inside:
+                    if polygon.covers(Point(longitudes[p], latitudes[p])):
+                        result[p] = number
+
+        return result
+
+    def sheets(self, longitudes, latitudes):
+        """Return the sheet identifier, or None, for each point."""
+
+        return [
+            self.identifiers[number] if number >= 0 else None
+            for number in self.locate(longitudes, latitudes)
+        ]
+
+    def sheet(self, longitude, latitude):
+        """Return the identifier of the sheet containing a point."""
+
+        return self.sheets([longitude], [latitude])[0]
+
+    def touching(self, longitudes, latitudes):
+        """Return a sorted list of the sheets containing any of the points.
+        """
+
+        numbers = numpy.unique(self.locate(longitudes, latitudes))
+
+        return sorted(
+            self.identifiers[number] for number in numbers if number >= 0)
+
+    def crossing(self, geom):
+        """Return a sorted list of the sheets a geometry intersects.
+
+        Sheets are chosen first by extent, and only those are tested
+        against the geometry itself.
+        """
+
+        if geom is None or geom.empty or not len(self):
+            return []
+
+        (xmin, ymin, xmax, ymax) = geom.extent
+        extents = self.extents
+        numbers = numpy.nonzero(
+            (extents[:, 0] <= xmax) & (extents[:, 2] >= xmin) &
+            (extents[:, 1] <= ymax) & (extents[:, 3] >= ymin)
+        )[0]
+
+        return sorted(
+            self.identifiers[number] for number in numbers
+            if self.polygons[number].intersects(geom))
+
+
+_indexes = {}
+
+
+def version(model):
+    """The row count and latest update of a sheet table.
+
+    Changes made with QuerySet.update() are only seen if they set the
+    updated field too.
+    """
+
+    totals = model.objects.aggregate(
+        count=Count('pk'), updated=Max('updated'))
+
+    return (totals['count'], totals['updated'])
+
+
+def sheet_index(model):
+    """Return the SheetIndex of a sheet model, built once per version.
+    """
+
+    current = version(model)
+    if model not in _indexes or _indexes[model][0] != current:
+        _indexes[model] = (current, SheetIndex(
+            model.objects.values_list('identifier', 'geom').iterator()))
+
+    return _indexes[model][1]
+
+
+def reset():
+    """Forget all indexes, so they are rebuilt from the tables."""
+
+    _indexes.clear()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import itertools
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from geolib.gazetteer import normalise, reset
+from geolib.models import PlaceName
+
+
+def text(value):
+    """Decode a utf-8 CSV value, as read by Python 2."""
+
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class Command(BaseCommand):
+    help = """Load place names from a local LINZ Gazetteer CSV extract.
+
+    Coordinates are expected in NZGD2000 latitude and longitude, which
+    are taken to be WGS84. Names are written in batches, each in its
+    own transaction, replacing any existing record with the same
+    identifier.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--identifier-field', default='name_id')
+        parser.add_argument('--name-field', default='name')
+        parser.add_argument('--type-field', default='feat_type')
+        parser.add_argument('--status-field', default='status')
+        parser.add_argument('--latitude-field', default='crd_latitude')
+        parser.add_argument('--longitude-field', default='crd_longitude')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        loaded = 0
+
+        with open(options['path']) as f:
+            rows = csv.DictReader(f)
+            while True:
+                batch = list(itertools.islice(rows, options['batch_size']))
+                if not batch:
+                    break
+
+                records = [
+                    self.record(row, options) for row in batch
+                    if row.get(options['latitude_field']) and
+                    row.get(options['longitude_field'])
+                ]
+
+                with transaction.atomic():
+                    PlaceName.objects.filter(identifier__in=[
+                        record.identifier for record in records
+                    ]).delete()
+                    PlaceName.objects.bulk_create(records)
+
+                loaded += len(records)
+                self.stdout.write('%d place names loaded' % loaded)
+
+        reset()
+
+    def record(self, row, options):
+        latitude = float(row[options['latitude_field']])
+        longitude = float(row[options['longitude_field']])
+        name = text(row[options['name_field']])
+
+        return PlaceName(
+            identifier=int(row[options['identifier_field']]),
+            name=name,
+            key=normalise(name)[:255],
+            feature_type=text(row.get(options['type_field'])),
+            status=text(row.get(options['status_field'])),
+            latitude=latitude,
+            longitude=longitude,
+            geom=Point(longitude, latitude, srid=4326),
+        )
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import itertools
+
+from django.contrib.gis.gdal import DataSource, OGRGeometry, SpatialReference
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from geolib.index import reset
+from geolib.models import Topo50, Topo250
+from trips.models import SRID
+
+MODELS = {
+    'topo50': Topo50,
+    'topo250': Topo250,
+}
+
+
+class Command(BaseCommand):
+    help = """Load map sheet polygons from a local LINZ extract.
+
+    Reads a shapefile, GeoJSON or other OGR readable file, or a CSV
+    file with a WKT geometry column. Geometries are reprojected to
+    WGS84, and the nzms_* extents computed in NZMG. Sheets are written
+    in batches, each in its own transaction. A sheet already loaded is
+    updated in place if it has changed, so that the tracks related to
+    it keep it, and sheets no longer in the file are removed once it
+    has all been read. An interrupted load may simply be run again.
+    """
+
+    FIELDS = (
+        'sheet_name', 'nzms_xmin', 'nzms_xmax', 'nzms_ymin', 'nzms_ymax')
+
+    def add_arguments(self, parser):
+        parser.add_argument('sheets', choices=sorted(MODELS))
+        parser.add_argument('path')
+        parser.add_argument(
+            '--srid', choices=sorted(SRID),
+            help='Coordinate system of the file, if it does not say.')
+        parser.add_argument('--identifier-field', default='sheet_code')
+        parser.add_argument('--name-field', default='sheet_name')
+        parser.add_argument(
+            '--geometry-field', default='WKT',
+            help='Column holding WKT geometry, for CSV files.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--skip-existing', action='store_true',
+            help='Leave sheets already loaded untouched.')
+
+    def handle(self, *args, **options):
+        model = MODELS[options['sheets']]
+        srs = None
+        if options['srid']:
+            srs = SpatialReference(SRID[options['srid']])
+
+        if options['path'].lower().endswith('.csv'):
+            features = self.read_csv(options, srs)
+        else:
+            features = self.read_ogr(options, srs)
+
+        seen = set()
+        (created, changed, skipped) = (0, 0, 0)
+        features = iter(features)
+
+        while True:
+            batch = list(itertools.islice(features, options['batch_size']))
+            if not batch:
+                break
+
+            records = [self.record(model, *feature) for feature in batch]
+            identifiers = [record.identifier for record in records]
+            seen.update(identifiers)
+
+            with transaction.atomic():
+                existing = model.objects.in_bulk(identifiers)
+                new = []
+                for record in records:
+                    if record.identifier not in existing:
+                        new.append(record)
+                    elif (options['skip_existing'] or
+                          not self.changed(existing[record.identifier],
+                                           record)):
+                        skipped += 1
+                    else:
+                        # Saved in place, so that auto_now sets updated,
+                        # and relations to the sheet are kept.
+                        record.save(force_update=True)
+                        changed += 1
+                model.objects.bulk_create(new)
+                created += len(new)
+
+            self.stdout.write('%d sheets loaded' % (created + changed))
+
+        removed = self.remove_missing(model, seen, options['batch_size'])
+
+        reset()
+        self.stdout.write(
+            'Loaded %d new and %d changed %s sheets, skipped %d, '
+            'removed %d.' % (
+                created, changed, options['sheets'], skipped, removed))
+
+    def changed(self, existing, record):
+        """Whether a loaded sheet differs from its record in the file."""
+
+        return (
+            any(getattr(existing, name) != getattr(record, name)
+                for name in self.FIELDS) or
+            not existing.geom.equals_exact(record.geom, 1e-9)
+        )
+
+    def remove_missing(self, model, seen, batch_size):
+        """Delete the sheets not in the file, returning how many."""
+
+        missing = sorted(set(
+            model.objects.values_list('identifier', flat=True)) - seen)
+
+        for start in range(0, len(missing), batch_size):
+            with transaction.atomic():
+                model.objects.filter(
+                    identifier__in=missing[start:start + batch_size]
+                ).delete()
+
+        return len(missing)
+
+    def read_ogr(self, options, srs):
+        """Yield (identifier, name, OGRGeometry) from an OGR data source."""
+
+        layer = DataSource(options['path'])[0]
+        for feature in layer:
+            geom = feature.geom
+            if srs is not None:
+                geom.srs = srs
+            yield (
+                feature.get(options['identifier_field']),
+                feature.get(options['name_field']),
+                geom,
+            )
+
+    def read_csv(self, options, srs):
+        """Yield (identifier, name, OGRGeometry) from a CSV file."""
+
+        if srs is None:
+            raise CommandError('CSV files need a --srid.')
+
+        with open(options['path']) as f:
+            for row in csv.DictReader(f):
+                yield (
+                    row[options['identifier_field']],
+                    row.get(options['name_field']),
+                    OGRGeometry(row[options['geometry_field']], srs),
+                )
+
+    def record(self, model, identifier, name, geom):
+        """Return an unsaved sheet record, reprojecting the geometry."""
+
+        if geom.srs is None:
+            raise CommandError(
+                'No coordinate system for %s; use --srid.' % identifier)
+
+        nzmg = geom.transform(SRID['NZMG'], clone=True)
+        wgs84 = geom.transform(SRID['WGS84'], clone=True)
+
+        if wgs84.geom_type.name.startswith('MultiPolygon'):
+            wgs84 = max(wgs84, key=lambda polygon: polygon.area)
+
+        (xmin, ymin, xmax, ymax) = nzmg.extent
+
+        return model(
+            identifier=identifier,
+            sheet_name=name,
+            geom=wgs84.geos,
+            nzms_xmin=int(round(xmin)),
+            nzms_xmax=int(round(xmax)),
+            nzms_ymin=int(round(ymin)),
+            nzms_ymax=int(round(ymax)),
+        )
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Topo250',
+            fields=[
+                ('identifier', models.CharField(max_length=4, primary_key=True, serialize=False)),
+                ('sheet_name', models.TextField(blank=True, null=True)),
+                ('geom', django.contrib.gis.db.models.fields.PolygonField(srid=4326)),
+                ('nzms_xmax', models.IntegerField()),
+                ('nzms_xmin', models.IntegerField()),
+                ('nzms_ymax', models.IntegerField()),
+                ('nzms_ymin', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Topo50',
+            fields=[
+                ('identifier', models.CharField(max_length=4, primary_key=True, serialize=False)),
+                ('sheet_name', models.TextField(blank=True, null=True)),
+                ('geom', django.contrib.gis.db.models.fields.PolygonField(srid=4326)),
+                ('nzms_xmax', models.IntegerField()),
+                ('nzms_xmin', models.IntegerField()),
+                ('nzms_ymax', models.IntegerField()),
+                ('nzms_ymin', models.IntegerField()),
+            ],
+        ),
+    ]
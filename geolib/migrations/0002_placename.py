@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geolib', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceName',
+            fields=[
+                ('identifier', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.TextField()),
+                ('key', models.CharField(db_index=True, max_length=255)),
+                ('feature_type', models.CharField(blank=True, max_length=255, null=True)),
+                ('status', models.CharField(blank=True, max_length=255, null=True)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('geom', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+            ],
+        ),
+    ]
@@ -17,6 +17,8 @@ class Topo250(models.Model):
     nzms_ymax = models.IntegerField()
     nzms_ymin = models.IntegerField()
 
+    updated = models.DateTimeField(auto_now=True)    # See geolib.index.
+
 
 class Topo50(models.Model):
     """Contains the Topo50 mapping grid without map sheet overlays.
@@ -31,3 +33,27 @@ class Topo50(models.Model):
     nzms_ymax = models.IntegerField()
     nzms_ymin = models.IntegerField()
 
+    updated = models.DateTimeField(auto_now=True)    # See geolib.index.
+
+
+class PlaceName(models.Model):
+    """A place name from the LINZ New Zealand Gazetteer.
+
+    The key field holds the name normalised for searching: lower
+    case, without macrons or punctuation.
+    """
+
+    identifier = models.IntegerField(primary_key=True)    # LINZ name_id
+    name = models.TextField()
+    key = models.CharField(max_length=255, db_index=True)
+    feature_type = models.CharField(max_length=255, blank=True, null=True)
+    status = models.CharField(max_length=255, blank=True, null=True)
+
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    geom = models.PointField(srid=4326)
+
+    updated = models.DateTimeField(auto_now=True)    # See geolib.gazetteer.
+
+    def __unicode__(self):
+        return self.name
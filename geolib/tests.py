@@ -1,6 +1,156 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+from django.contrib.gis.geos import GEOSGeometry, LineString, Point, Polygon
+from django.test import SimpleTestCase, TestCase
 
-# Create your tests here.
+from geolib.gazetteer import Gazetteer, gazetteer
+from geolib.index import SheetIndex, sheet_index
+from geolib.models import PlaceName, Topo50
+
+
+def square(xmin, ymin, size=0.5):
+    return Polygon.from_bbox((xmin, ymin, xmin + size, ymin + size))
+
+
+# Four sheets, two by two, with a gap of 0.5 degrees to the east.
+SHEETS = [
+    ('BX01', square(171.0, -43.0)),
+    ('BX02', square(171.5, -43.0)),
+    ('BY01', square(171.0, -43.5)),
+    ('BY02', square(171.5, -43.5)),
+    ('BX04', square(172.5, -43.0)),
+]
+
+
+class CrossingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = SheetIndex(SHEETS)
+
+    def test_within_one(self):
+        line = LineString((171.1, -42.9), (171.2, -42.8))
+        self.assertEqual(self.index.crossing(line), ['BX01'])
+
+    def test_across_several(self):
+        # The line's extent takes in BY01 too, but the line misses it.
+        line = LineString((171.1, -42.9), (171.9, -42.9), (171.9, -43.4))
+        self.assertEqual(
+            self.index.crossing(line), ['BX01', 'BX02', 'BY02'])
+
+    def test_gap(self):
+        line = LineString((172.1, -42.9), (172.4, -42.8))
+        self.assertEqual(self.index.crossing(line), [])
+
+    def test_across_gap(self):
+        line = LineString((171.9, -42.9), (172.6, -42.9))
+        self.assertEqual(self.index.crossing(line), ['BX02', 'BX04'])
+
+    def test_nothing(self):
+        self.assertEqual(self.index.crossing(None), [])
+        self.assertEqual(
+            self.index.crossing(GEOSGeometry('LINESTRING EMPTY')), [])
+        self.assertEqual(SheetIndex([]).crossing(
+            LineString((171.1, -42.9), (171.2, -42.8))), [])
+
+    def test_points(self):
+        self.assertEqual(
+            self.index.sheets([171.1, 171.6, 172.2], [-42.9, -43.4, -42.9]),
+            ['BX01', 'BY02', None])
+        self.assertEqual(
+            self.index.touching([171.1, 171.2, 171.6], [-42.9, -42.9, -43.4]),
+            ['BX01', 'BY02'])
+
+
+class SheetIndexTests(TestCase):
+
+    def add(self, identifier, geom):
+        Topo50.objects.create(
+            identifier=identifier, sheet_name=identifier, geom=geom,
+            nzms_xmin=0, nzms_xmax=0, nzms_ymin=0, nzms_ymax=0)
+
+    def test_rebuilt_when_table_changes(self):
+        self.add(*SHEETS[0])
+        index = sheet_index(Topo50)
+        self.assertEqual(len(index), 1)
+        self.assertIs(sheet_index(Topo50), index)
+
+        self.add(*SHEETS[1])
+        self.assertEqual(len(sheet_index(Topo50)), 2)
+
+        # Reloaded in place, as by loadsheets, with the same row count.
+        Topo50.objects.filter(identifier='BX02').delete()
+        self.add('BX02', SHEETS[4][1])
+        self.assertEqual(sheet_index(Topo50).sheet(172.6, -42.9), 'BX02')
+
+
+PLACES = [
+    (1, "Arthur's Pass", 171.56, -42.94),
+    (2, 'Arthur River', 167.0, -44.8),
+    (3, 'Mount Arthur', 172.68, -41.21),
+    (4, 'Ōtira', 171.56, -42.83),
+    (5, 'Bealey', 171.59, -43.02),
+]
+
+
+class GazetteerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.gazetteer = Gazetteer(PLACES)
+
+    def test_search(self):
+        self.assertEqual(self.gazetteer.search('arth pass'), [1])
+        self.assertEqual(self.gazetteer.search('OTIRA'), [4])
+        self.assertEqual(self.gazetteer.search('pass arthur'), [1])
+
+    def test_search_ranking(self):
+        # Names beginning with the text first, then shorter names.
+        self.assertEqual(self.gazetteer.search('arthur'), [2, 1, 3])
+        self.assertEqual(self.gazetteer.search('arthur', limit=1), [2])
+        self.assertEqual(
+            self.gazetteer.search('arthur', near=(172.6, -41.3)), [3, 1, 2])
+
+    def test_search_nothing(self):
+        self.assertEqual(self.gazetteer.search(''), [])
+        self.assertEqual(self.gazetteer.search(' - '), [])
+        self.assertEqual(self.gazetteer.search('arthur bealey'), [])
+        self.assertEqual(Gazetteer([]).search('arthur'), [])
+
+    def test_nearest(self):
+        nearest = self.gazetteer.nearest(171.57, -42.95, k=2)
+        self.assertEqual(
+            [identifier for (identifier, metres) in nearest], [1, 5])
+        self.assertAlmostEqual(nearest[0][1], 1378, delta=1)
+
+    def test_nearest_all(self):
+        # From beyond the grid, every place, in order of distance.
+        nearest = self.gazetteer.nearest(175.0, -37.0, k=10)
+        metres = [metres for (identifier, metres) in nearest]
+        self.assertEqual(
+            [identifier for (identifier, metres) in nearest],
+            [3, 4, 1, 5, 2])
+        self.assertEqual(metres, sorted(metres))
+        self.assertEqual(Gazetteer([]).nearest(175.0, -37.0), [])
+
+
+class GazetteerCacheTests(TestCase):
+
+    def add(self, identifier, name, longitude, latitude):
+        PlaceName.objects.create(
+            identifier=identifier, name=name, key=name.lower(),
+            longitude=longitude, latitude=latitude,
+            geom=Point(longitude, latitude, srid=4326))
+
+    def test_rebuilt_when_table_changes(self):
+        self.add(*PLACES[0])
+        index = gazetteer()
+        self.assertEqual(len(index), 1)
+        self.assertIs(gazetteer(), index)
+
+        self.add(*PLACES[4])
+        self.assertEqual(gazetteer().search('bealey'), [5])
+
+        # Reloaded in place, as by loadplacenames.
+        PlaceName.objects.filter(identifier=5).delete()
+        self.add(5, 'Bealey Spur', 171.59, -43.02)
+        self.assertEqual(gazetteer().search('spur'), [5])
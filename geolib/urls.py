@@ -0,0 +1,7 @@
+from django.conf.urls import url
+
+import views
+
+urlpatterns = [
+    url(r'^places$', views.places),
+]
@@ -1,6 +1,63 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.shortcuts import render
+from django.http import JsonResponse
 
-# Create your views here.
+from geolib.gazetteer import gazetteer
+from geolib.models import PlaceName
+
+
+def places(request):
+    """Search the gazetteer, returning places as JSON.
+
+    Parameters are q, text to search for; near, a latitude,longitude
+    pair; and limit. With q, places matching the text are returned,
+    nearest first if near is given. With near alone, the nearest
+    places are returned.
+    """
+
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return JsonResponse(
+            {'error': 'limit must be a positive integer.'}, status=400)
+
+    near = None
+    distances = {}
+
+    if request.GET.get('near'):
+        try:
+            (latitude, longitude) = [
+                float(value) for value in request.GET['near'].split(',')]
+        except ValueError:
+            return JsonResponse(
+                {'error': 'near must be latitude,longitude.'}, status=400)
+        near = (longitude, latitude)
+
+    index = gazetteer()
+
+    if request.GET.get('q'):
+        identifiers = index.search(request.GET['q'], limit=limit, near=near)
+    elif near:
+        nearest = index.nearest(longitude, latitude, k=limit)
+        identifiers = [identifier for (identifier, metres) in nearest]
+        distances = dict(nearest)
+    else:
+        identifiers = []
+
+    records = PlaceName.objects.in_bulk(identifiers)
+    result = []
+    for identifier in identifiers:
+        place = records[identifier]
+        result.append({
+            'identifier': place.identifier,
+            'name': place.name,
+            'feature_type': place.feature_type,
+            'latitude': place.latitude,
+            'longitude': place.longitude,
+            'metres': distances.get(identifier),
+        })
+
+    return JsonResponse({'places': result})
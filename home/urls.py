@@ -20,6 +20,7 @@ import views
 
 urlpatterns = [
     url(r'^trips/', include('trips.urls')),
+    url(r'^geolib/', include('geolib.urls')),
     url(r'^$', views.index, name='index'),
     url(r'^admin/', admin.site.urls),
 ]
@@ -2,16 +2,42 @@
 from __future__ import unicode_literals
 
 from django.contrib import admin
+from django.utils.html import format_html_join
 
 # Register your models here.
 from models import Template, Trip, Track, TrackSegment, TrackPoint, Waypoint
-from models import Route, RoutePoint
+from models import Route, RoutePoint, Job, Photo, Blob, TripFile
+
+
+class TrackSegmentAdmin(admin.ModelAdmin):
+    """Segments show their first points, however they are stored."""
+
+    POINTS_SHOWN = 100
+
+    exclude = ('coordinates', 'elevations', 'times')
+    readonly_fields = ('point_table',)
+
+    def point_table(self, segment):
+        points = segment.points()[:self.POINTS_SHOWN]
+        return format_html_join(
+            '\n', '<div>{} | {} {} | {} | {}</div>',
+            (
+                (point.ordinal, point.latitude, point.longitude,
+                 point.elevation, point.time)
+                for point in points
+            )
+        )
+
 
 admin.site.register(Template)
 admin.site.register(Trip)
 admin.site.register(Track)
-admin.site.register(TrackSegment)
+admin.site.register(TrackSegment, TrackSegmentAdmin)
 admin.site.register(TrackPoint)
 admin.site.register(Route)
 admin.site.register(RoutePoint)
 admin.site.register(Waypoint)
+admin.site.register(Job)
+admin.site.register(Photo)
+admin.site.register(Blob)
+admin.site.register(TripFile)
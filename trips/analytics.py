@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""Summary statistics for tracks and track segments.
+
+TrackStatistics accumulates running totals point by point, as points
+are injected. The array functions below work on whole segments at
+once with NumPy, for distance, speed, moving time, smoothed climb and
+gradient profiles. Both measure climb the same way, so that the gain
+stored for a track is the gain shown on its page.
+"""
+from __future__ import unicode_literals
+
+import collections
+import math
+
+import numpy
+
+import trips.packing as packing
+import trips.settings as settings
+
+EARTH_RADIUS = 6371008.8   # Mean radius, metres.
+
+GRADIENT_BINS = [-numpy.inf, -20, -10, -5, -2, 2, 5, 10, 20, numpy.inf]
+
+
+def haversine(longitude1, latitude1, longitude2, latitude2):
+    """Great circle distance in metres between two points in degrees."""
+
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(longitude2 - longitude1)
+
+    a = (math.sin(dphi / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2)
+
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class Climb(object):
+    """Gain and loss of a smoothed elevation profile, point by point.
+
+    The result is that of climb() on the same elevations, but only a
+    window of them is held at a time.
+    """
+
+    def __init__(self, window=None):
+        if window is None:
+            window = settings.ELEVATION_SMOOTHING
+
+        self.window = max(1, window)
+        self.half = self.window // 2
+        self.count = 0
+        self.head = []
+        self.recent = collections.deque(maxlen=self.window)
+        self.smoothed = None
+        self.gain = 0.0
+        self.loss = 0.0
+
+    def add(self, elevation):
+        """Add the next known elevation."""
+
+        if self.count < self.window:
+            self.head.append(elevation)
+        if self.count == 0:
+            # Pad the start with the first elevation, as smooth() does.
+            self.recent.extend([elevation] * self.half)
+        self.count += 1
+
+        self.recent.append(elevation)
+        if len(self.recent) == self.window:
+            (self.gain, self.loss, self.smoothed) = self.step(
+                self.gain, self.loss, self.smoothed,
+                sum(self.recent) / self.window)
+
+    @staticmethod
+    def step(gain, loss, last, value):
+        if last is not None:
+            if value > last:
+                gain += value - last
+            else:
+                loss += last - value
+        return (gain, loss, value)
+
+    def totals(self):
+        """Return (gain, loss) in metres of the elevations added so far."""
+
+        if self.count < self.window:
+            # Too few to smooth, as in smooth().
+            (gain, loss, last) = (0.0, 0.0, None)
+            for elevation in self.head:
+                (gain, loss, last) = self.step(gain, loss, last, elevation)
+            return (gain, loss)
+
+        # Pad the end with the last elevation, leaving self as it is.
+        (gain, loss, last) = (self.gain, self.loss, self.smoothed)
+        recent = collections.deque(self.recent, self.window)
+        for n in range(self.window - 1 - self.half):
+            recent.append(recent[-1])
+            (gain, loss, last) = self.step(
+                gain, loss, last, sum(recent) / self.window)
+
+        return (gain, loss)
+
+
+class TrackStatistics(object):
+    """Accumulate point count, length, extent, times and climb.
+
+    Feed points in order with add(), or combine the statistics of
+    consecutive segments with merge(). The fields() method returns a
+    dictionary of values for the statistics columns of Track and
+    TrackSegment. Moving time is totalled too, though not stored.
+    """
+
+    def __init__(self):
+        self.point_count = 0
+        self.length = 0.0
+        self.xmin = None
+        self.xmax = None
+        self.ymin = None
+        self.ymax = None
+        self.start_time = None
+        self.end_time = None
+        self.elevation_gain = 0.0
+        self.elevation_loss = 0.0
+        self.moving_time = 0.0
+
+        self.last = None
+        self.last_time = None
+        self.climb = Climb()
+
+    def add(self, longitude, latitude, elevation=None, time=None):
+        """Add the next point of a segment."""
+
+        self.point_count += 1
+
+        step = None
+        if self.last is not None:
+            step = haversine(
+                self.last[0], self.last[1], longitude, latitude)
+            self.length += step
+        self.last = (longitude, latitude)
+
+        self.extend(longitude, longitude, latitude, latitude)
+
+        if elevation is not None:
+            self.climb.add(elevation)
+
+        # Moving time as in segment_stats(), over timed steps.
+        if step is not None and None not in (time, self.last_time):
+            interval = (time - self.last_time).total_seconds()
+            if interval > 0 and step / interval >= settings.STOPPED_SPEED:
+                self.moving_time += interval
+        self.last_time = time
+
+        if time is not None:
+            if self.start_time is None or time < self.start_time:
+                self.start_time = time
+            if self.end_time is None or time > self.end_time:
+                self.end_time = time
+
+    def extend(self, xmin, xmax, ymin, ymax):
+        """Grow the bounding box to include the given extent."""
+
+        if xmin is None:
+            return
+        self.xmin = xmin if self.xmin is None else min(self.xmin, xmin)
+        self.xmax = xmax if self.xmax is None else max(self.xmax, xmax)
+        self.ymin = ymin if self.ymin is None else min(self.ymin, ymin)
+        self.ymax = ymax if self.ymax is None else max(self.ymax, ymax)
+
+    def merge(self, other):
+        """Add the statistics of another segment, or a fields() dict."""
+
+        if isinstance(other, TrackStatistics):
+            self.moving_time += other.moving_time
+            other = other.fields()
+
+        self.point_count += other['point_count'] or 0
+        self.length += other['length'] or 0.0
+        self.elevation_gain += other['elevation_gain'] or 0.0
+        self.elevation_loss += other['elevation_loss'] or 0.0
+
+        self.extend(other['xmin'], other['xmax'], other['ymin'], other['ymax'])
+
+        for time in (other['start_time'], other['end_time']):
+            if time is not None:
+                if self.start_time is None or time < self.start_time:
+                    self.start_time = time
+                if self.end_time is None or time > self.end_time:
+                    self.end_time = time
+
+    def fields(self):
+        (gain, loss) = self.climb.totals()
+
+        return {
+            'point_count': self.point_count,
+            'length': self.length,
+            'xmin': self.xmin,
+            'xmax': self.xmax,
+            'ymin': self.ymin,
+            'ymax': self.ymax,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'elevation_gain': self.elevation_gain + gain,
+            'elevation_loss': self.elevation_loss + loss,
+        }
+
+
+def point_arrays(points):
+    """Return longitude, latitude, elevation and time arrays for points.
+
+    Accepts any iterable of objects with longitude, latitude,
+    elevation and time attributes: gpxpy points, TrackPoint records,
+    or PackedPoint objects. Missing elevations and times are NaN, and
+    times are in seconds since the epoch.
+    """
+
+    longitudes = []
+    latitudes = []
+    elevations = []
+    times = []
+
+    for point in points:
+        longitudes.append(point.longitude)
+        latitudes.append(point.latitude)
+        elevations.append(
+            numpy.nan if point.elevation is None else point.elevation)
+        times.append(
+            numpy.nan if point.time is None
+            else packing.to_microseconds(point.time) / 1e6)
+
+    return (
+        numpy.array(longitudes, dtype=float),
+        numpy.array(latitudes, dtype=float),
+        numpy.array(elevations, dtype=float),
+        numpy.array(times, dtype=float),
+    )
+
+
+def segment_arrays(segment):
+    """Return point_arrays() for a TrackSegment, in either storage mode."""
+
+    if segment.storage == 'packed':
+        packed = segment.packed_points()
+        times = packed.time.astype(float) / 1e6
+        times[packed.time == packing.NO_TIME] = numpy.nan
+        return (
+            packed.longitude, packed.latitude, packed.elevation, times)
+
+    rows = segment.points().order_by('ordinal').values_list(
+        'longitude', 'latitude', 'elevation', 'time')
+    columns = list(zip(*rows.iterator())) or [(), (), (), ()]
+
+    return (
+        numpy.array(columns[0], dtype=float),
+        numpy.array(columns[1], dtype=float),
+        numpy.array(
+            [numpy.nan if e is None else e for e in columns[2]],
+            dtype=float),
+        numpy.array(
+            [numpy.nan if t is None else packing.to_microseconds(t) / 1e6
+             for t in columns[3]],
+            dtype=float),
+    )
+
+
+def distances(longitudes, latitudes):
+    """Haversine distances in metres between consecutive points."""
+
+    phi = numpy.radians(latitudes)
+    lam = numpy.radians(longitudes)
+    dphi = numpy.diff(phi)
+    dlam = numpy.diff(lam)
+
+    a = (numpy.sin(dphi / 2) ** 2 +
+         numpy.cos(phi[:-1]) * numpy.cos(phi[1:]) * numpy.sin(dlam / 2) ** 2)
+
+    return 2 * EARTH_RADIUS * numpy.arcsin(
+        numpy.sqrt(numpy.clip(a, 0, 1)))
+
+
+def speeds(steps, times):
+    """Speed in metres per second over each step; NaN where untimed."""
+
+    intervals = numpy.diff(times)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        result = steps / intervals
+    result[~(intervals > 0)] = numpy.nan
+
+    return result
+
+
+def smooth(elevations, window=None):
+    """Centred moving average of the known elevations."""
+
+    if window is None:
+        window = settings.ELEVATION_SMOOTHING
+
+    known = elevations[~numpy.isnan(elevations)]
+    if len(known) < window or window < 2:
+        return known
+
+    half = window // 2
+    padded = numpy.concatenate(
+        (numpy.repeat(known[0], half), known,
+         numpy.repeat(known[-1], window - 1 - half)))
+
+    return numpy.convolve(padded, numpy.ones(window) / window, 'valid')
+
+
+def profile(elevations, window=None):
+    """Smoothed elevation at every point, interpolated where missing."""
+
+    known = numpy.flatnonzero(~numpy.isnan(elevations))
+    if len(known) < 2:
+        return elevations
+
+    return numpy.interp(
+        numpy.arange(len(elevations)), known, smooth(elevations, window))
+
+
+def climb(elevations, window=None):
+    """Return (gain, loss) in metres of the smoothed elevation profile."""
+
+    changes = numpy.diff(smooth(elevations, window))
+
+    return (
+        float(changes[changes > 0].sum()),
+        abs(float(changes[changes < 0].sum())),
+    )
+
+
+def gradient_histogram(steps, elevations, bins=GRADIENT_BINS):
+    """Distance in metres travelled at each band of gradient (percent).
+
+    Steps without a known elevation at both ends are ignored.
+    """
+
+    rises = numpy.diff(elevations)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        gradients = 100 * rises / steps
+    known = ~numpy.isnan(gradients) & (steps > 0)
+
+    (counts, edges) = numpy.histogram(
+        gradients[known], bins=bins, weights=steps[known])
+
+    return counts
+
+
+def segment_stats(longitudes, latitudes, elevations, times):
+    """Summarise one segment's point arrays as a dictionary."""
+
+    steps = distances(longitudes, latitudes)
+    velocity = speeds(steps, times)
+    intervals = numpy.diff(times)
+    timed = ~numpy.isnan(velocity)
+    moving = timed & (velocity >= settings.STOPPED_SPEED)
+    (gain, loss) = climb(elevations)
+
+    return {
+        'points': len(longitudes),
+        'distance': float(steps.sum()),
+        'duration': float(intervals[timed].sum()),
+        'moving_time': float(intervals[moving].sum()),
+        'moving_distance': float(steps[moving].sum()),
+        'max_speed': float(velocity[timed].max()) if timed.any() else 0.0,
+        'elevation_gain': gain,
+        'elevation_loss': loss,
+        'gradients': gradient_histogram(steps, profile(elevations)),
+    }
+
+
+def combine(stats):
+    """Combine a list of segment_stats() into statistics for a track."""
+
+    result = {
+        'points': 0,
+        'distance': 0.0,
+        'duration': 0.0,
+        'moving_time': 0.0,
+        'moving_distance': 0.0,
+        'max_speed': 0.0,
+        'elevation_gain': 0.0,
+        'elevation_loss': 0.0,
+        'gradients': numpy.zeros(len(GRADIENT_BINS) - 1),
+    }
+
+    for segment in stats:
+        for key in result:
+            if key == 'max_speed':
+                result[key] = max(result[key], segment[key])
+            else:
+                result[key] = result[key] + segment[key]
+
+    result['stopped_time'] = result['duration'] - result['moving_time']
+    result['average_speed'] = (
+        result['distance'] / result['duration']
+        if result['duration'] else 0.0)
+    result['moving_speed'] = (
+        result['moving_distance'] / result['moving_time']
+        if result['moving_time'] else 0.0)
+    result['gradients'] = [
+        (GRADIENT_BINS[i], GRADIENT_BINS[i + 1], float(metres))
+        for (i, metres) in enumerate(result['gradients'])
+    ]
+
+    return result
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Content addressed storage for uploaded files.
+
+Each distinct file is stored once, under the SHA-1 digest of its
+content, in BLOB_DIR/ab/abcdef... A file uploaded to several trips,
+or several times, is only kept once. Blobs are never changed once
+written, so a digest is a strong identity for caches and HTTP ETags.
+
+Blobs are made read only, and linked into trip filespaces under
+their uploaded names.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+
+import trips.settings as settings
+
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def blob_dir():
+    return os.path.join(settings.STATICFILES_DIR, settings.BLOB_DIR)
+
+
+def blob_path(digest):
+    return os.path.join(blob_dir(), digest[:2], digest)
+
+
+def write(chunks):
+    """Store the content of an iterable of byte strings.
+
+    The content is hashed as it is written to a temporary file, which
+    is then moved into place, or discarded if the blob already exists.
+    Return (digest, size).
+    """
+
+    if not os.path.isdir(blob_dir()):
+        os.makedirs(blob_dir())
+
+    sha1 = hashlib.sha1()
+    size = 0
+
+    (handle, temporary) = tempfile.mkstemp(dir=blob_dir(), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            for chunk in chunks:
+                sha1.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+
+        digest = sha1.hexdigest()
+        filepath = blob_path(digest)
+
+        if os.path.exists(filepath):
+            os.remove(temporary)
+        else:
+            if not os.path.isdir(os.path.dirname(filepath)):
+                os.makedirs(os.path.dirname(filepath))
+            os.chmod(temporary, READ_ONLY)
+            os.rename(temporary, filepath)
+
+    except Exception:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+    return (digest, size)
+
+
+def write_file(filepath, size=64 * 1024):
+    """Store the content of the file at filepath. Return (digest, size).
+    """
+
+    with open(filepath, 'rb') as f:
+        return write(iter(lambda: f.read(size), b''))
+
+
+def digest_file(filepath, size=64 * 1024):
+    """Return the digest of the file at filepath, without storing it."""
+
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(size), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def link(digest, filepath, copy=False):
+    """Put a blob in place at filepath, replacing any file there.
+
+    The blob is hard linked where possible, and otherwise copied, as
+    it always is if copy is set, for files that are written in place.
+    """
+
+    if os.path.lexists(filepath):
+        os.remove(filepath)
+
+    if not copy:
+        try:
+            os.link(blob_path(digest), filepath)
+            return
+        except (AttributeError, OSError):
+            pass
+
+    shutil.copyfile(blob_path(digest), filepath)
+
+
+def remove(digest):
+    """Delete a blob from the store."""
+
+    filepath = blob_path(digest)
+    if os.path.exists(filepath):
+        os.remove(filepath)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Content fingerprints for gpx features."""
+from __future__ import unicode_literals
+
+import datetime
+import hashlib
+import itertools
+
+from django.utils import timezone
+
+
+def normalise(value):
+    """Render a value as text which is stable across parsers and the db.
+
+    Times are converted to naive UTC, and floats rounded to seven
+    decimal places, about a centimetre of latitude.
+    """
+
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value, timezone.utc)
+        return value.isoformat()
+    if isinstance(value, float):
+        return '%.7f' % value
+
+    return '%s' % value
+
+
+def fingerprint(*values):
+    """Return a hex digest identifying a feature by the given values."""
+
+    text = '\x1f'.join(normalise(value) for value in values)
+
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def waypoint_fingerprint(waypoint):
+    return fingerprint(waypoint.time, waypoint.latitude, waypoint.longitude)
+
+
+def feature_points(feature):
+    """The points of a route, or of each segment of a track in turn."""
+
+    if hasattr(feature, 'segments'):
+        return itertools.chain.from_iterable(
+            segment.points for segment in feature.segments)
+    return feature.points
+
+
+def points_fingerprint(points):
+    """Return (count, digest) of the positions and times of points."""
+
+    sha1 = hashlib.sha1()
+    count = 0
+    for (latitude, longitude, time) in points:
+        text = '%s\x1f%s\x1f%s\x1e' % (
+            normalise(latitude), normalise(longitude), normalise(time))
+        sha1.update(text.encode('utf-8'))
+        count += 1
+
+    return (count, sha1.hexdigest())
+
+
+def feature_fingerprint(feature):
+    """Fingerprint of a track or route, from its name, number and points.
+
+    Every point's position and time is hashed, in order, so that
+    features sharing a receiver's default name, such as ACTIVE LOG or
+    ROUTE 001, are told apart. The points are read once, so a
+    GPXStream feature must be read again to be injected.
+    """
+
+    (count, digest) = points_fingerprint(
+        (point.latitude, point.longitude, point.time)
+        for point in feature_points(feature))
+
+    return fingerprint(feature.name, feature.number, count, digest)
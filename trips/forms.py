@@ -23,4 +23,10 @@ class TripRecord(forms.ModelForm):
 class UploadFile(forms.Form):
     uploadFile = forms.FileField(required=False)
 
+
+class UploadPhotos(forms.Form):
+    uploadPhotos = forms.FileField(
+        required=False,
+        widget=forms.ClearableFileInput(attrs={'multiple': True}))
+
         
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Incremental GPX reader.
+
+GPXStream reads a GPX document with iterparse, yielding waypoints,
+routes, tracks, segments and points as they are read, and discarding
+each element once it has been consumed. Memory use stays flat however
+large the file is.
+
+The objects yielded carry the attribute names used by gpxpy, so that
+GPXFile can analyse and inject them as if they had come from
+gpxpy.parse(). Their points and segments are generators, and may be
+iterated only once.
+"""
+from __future__ import unicode_literals
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+from gpxpy.gpxfield import parse_time
+
+
+POINT_FIELDS = {
+    'ageofdgpsdata': ('age_of_dgps_data', float),
+    'cmt': ('comment', None),
+    'course': ('course', float),
+    'desc': ('description', None),
+    'dgpsid': ('dgps_id', int),
+    'ele': ('elevation', float),
+    'fix': ('type_of_gpx_fix', None),
+    'geoidheight': ('geoid_height', float),
+    'hdop': ('horizontal_dilution', float),
+    'magvar': ('magnetic_variation', float),
+    'name': ('name', None),
+    'pdop': ('position_dilution', float),
+    'sat': ('satellites', int),
+    'speed': ('speed', float),
+    'src': ('source', None),
+    'sym': ('symbol', None),
+    'time': ('time', parse_time),
+    'type': ('type', None),
+    'vdop': ('vertical_dilution', float),
+}
+
+FEATURE_FIELDS = {
+    'cmt': ('comment', None),
+    'desc': ('description', None),
+    'name': ('name', None),
+    'number': ('number', int),
+    'src': ('source', None),
+    'type': ('type', None),
+}
+
+
+def localname(tag):
+    """Strip any namespace from an element tag."""
+
+    return tag.rsplit('}', 1)[-1]
+
+
+class GPXStreamItem(object):
+    """Base class for objects read from a gpx stream."""
+
+    def __init__(self, element, fields):
+        self.link = None
+        self.link_text = None
+        self.link_type = None
+        self.extensions = None
+        for (attr, convert) in fields.values():
+            setattr(self, attr, None)
+
+        for child in element:
+            tag = localname(child.tag)
+
+            if tag in fields:
+                (attr, convert) = fields[tag]
+                value = child.text
+                if value is not None and convert is not None:
+                    try:
+                        value = convert(value.strip())
+                    except ValueError:
+                        value = None
+                setattr(self, attr, value)
+
+            elif tag == 'link':
+                self.link = child.get('href')
+                for part in child:
+                    if localname(part.tag) == 'text':
+                        self.link_text = part.text
+                    elif localname(part.tag) == 'type':
+                        self.link_type = part.text
+
+            elif tag == 'url':
+                self.link = child.text
+
+            elif tag == 'urlname':
+                self.link_text = child.text
+
+
+class GPXStreamPoint(GPXStreamItem):
+    """A waypoint, route point or track point."""
+
+    def __init__(self, element):
+        super(GPXStreamPoint, self).__init__(element, POINT_FIELDS)
+        self.latitude = float(element.get('lat'))
+        self.longitude = float(element.get('lon'))
+
+
+class GPXStreamFeature(GPXStreamItem):
+    """A track or route, without its points."""
+
+    def __init__(self, element):
+        super(GPXStreamFeature, self).__init__(element, FEATURE_FIELDS)
+
+
+class GPXStreamSegment(object):
+    """A track segment. Points are attached by GPXStream."""
+
+    extensions = None
+
+
+class GPXStream(object):
+    """A gpxpy-like view of a gpx file, read incrementally.
+
+    Each access to the tracks, routes or waypoints attribute starts a
+    new pass over the file, which must therefore be seekable.
+    """
+
+    def __init__(self, gpxfile):
+        self.gpxfile = gpxfile
+        self.pending = None
+        self.events = iter(())
+
+    def read(self):
+        """Yield (kind, object) events from the start of the file.
+
+        Kinds are 'waypoint', 'route', 'routepoint', 'track',
+        'segment' and 'point'. A track or route is announced when its
+        first point or segment starts, by which time its metadata
+        elements have been read.
+        """
+
+        self.gpxfile.seek(0)
+        stack = []
+        announced = False
+
+        for (event, element) in ElementTree.iterparse(
+                self.gpxfile, events=('start', 'end')):
+
+            tag = localname(element.tag)
+
+            if event == 'start':
+                if tag in ('trk', 'rte'):
+                    announced = False
+                elif tag == 'trkseg':
+                    if not announced:
+                        announced = True
+                        yield ('track', GPXStreamFeature(stack[-1]))
+                    yield ('segment', GPXStreamSegment())
+                elif tag == 'rtept' and not announced:
+                    announced = True
+                    yield ('route', GPXStreamFeature(stack[-1]))
+
+                stack.append(element)
+                continue
+
+            stack.pop()
+
+            if tag == 'trkpt':
+                yield ('point', GPXStreamPoint(element))
+            elif tag == 'rtept':
+                yield ('routepoint', GPXStreamPoint(element))
+            elif tag == 'wpt':
+                yield ('waypoint', GPXStreamPoint(element))
+            elif tag == 'trk':
+                if not announced:
+                    yield ('track', GPXStreamFeature(element))
+            elif tag == 'rte':
+                if not announced:
+                    yield ('route', GPXStreamFeature(element))
+            elif tag != 'trkseg':
+                continue
+
+            # Discard consumed elements, so the tree does not grow.
+            element.clear()
+            if stack:
+                stack[-1].remove(element)
+
+    def start(self):
+        self.pending = None
+        self.events = self.read()
+
+    def next_event(self):
+        if self.pending:
+            event = self.pending
+            self.pending = None
+            return event
+        return next(self.events, (None, None))
+
+    def children(self, kind, parent_kinds):
+        """Yield consecutive events of kind, skipping unconsumed children.
+
+        Stop, pushing the event back, at the next event of one of
+        parent_kinds, or at the end of the file.
+        """
+
+        while True:
+            event = self.next_event()
+            if event[0] is None or event[0] in parent_kinds:
+                self.pending = event
+                return
+            if event[0] == kind:
+                yield event[1]
+
+    def __get_tracks__(self):
+        self.start()
+        for track in self.children('track', ()):
+            track.segments = self.segments()
+            yield track
+
+    def segments(self):
+        for segment in self.children('segment', ('track',)):
+            segment.points = self.children(
+                'point', ('track', 'segment'))
+            yield segment
+
+    def __get_routes__(self):
+        self.start()
+        for route in self.children('route', ()):
+            route.points = self.children('routepoint', ('route',))
+            yield route
+
+    def __get_waypoints__(self):
+        self.start()
+        return self.children('waypoint', ())
+
+    tracks = property(__get_tracks__)
+    routes = property(__get_routes__)
+    waypoints = property(__get_waypoints__)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Streaming GPX writer.
+
+trip_gpx() generates a GPX 1.1 document for a trip, as chunks of
+text, reading waypoints, points of interest, routes and tracks from
+the database with iterating querysets. Neither the document nor the
+query results are held in memory, so it may be handed straight to a
+StreamingHttpResponse.
+"""
+from __future__ import unicode_literals
+
+import datetime
+from xml.sax.saxutils import escape, quoteattr
+
+from django.utils import timezone
+
+import trips.models as models
+import trips.settings as settings
+
+HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx version="1.1" creator="nztrips" '
+    'xmlns="http://www.topografix.com/GPX/1/1">\n'
+)
+FOOTER = '</gpx>\n'
+
+POINT_FIELDS = ('latitude', 'longitude', 'elevation', 'time', 'name',
+                'comment', 'description', 'symbol')
+
+
+def element(tag, value):
+    if value is None or value == '':
+        return ''
+    return '<%s>%s</%s>' % (tag, escape('%s' % value), tag)
+
+
+def format_time(time):
+    if not isinstance(time, datetime.datetime):
+        return time
+    if timezone.is_aware(time):
+        time = timezone.make_naive(time, timezone.utc)
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def point(tag, latitude, longitude, elevation=None, time=None, name=None,
+          comment=None, description=None, symbol=None):
+    """Return a wpt, rtept or trkpt element."""
+
+    if latitude is None or longitude is None:
+        return ''
+
+    return ''.join((
+        '<%s lat=%s lon=%s>' % (
+            tag, quoteattr('%s' % latitude), quoteattr('%s' % longitude)),
+        element('ele', elevation),
+        element('time', format_time(time)),
+        element('name', name),
+        element('cmt', comment),
+        element('desc', description),
+        element('sym', symbol),
+        '</%s>\n' % tag,
+    ))
+
+
+def feature(track):
+    """Return the metadata elements of a track or route."""
+
+    return ''.join((
+        element('name', track.name),
+        element('cmt', track.comment),
+        element('desc', track.description),
+        element('src', track.source),
+        element('number', track.number),
+        '\n',
+    ))
+
+
+def buffered(pieces, size):
+    """Join small pieces of text into chunks of roughly size characters."""
+
+    chunk = []
+    length = 0
+    for piece in pieces:
+        chunk.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def trip_gpx(trip, size=None):
+    """Generate a gpx document of a trip's data, in chunks of text."""
+
+    return buffered(trip_pieces(trip), size or settings.EXPORT_CHUNK_SIZE)
+
+
+def trip_pieces(trip):
+    yield HEADER
+    yield '<metadata>%s</metadata>\n' % element('name', trip.name)
+
+    waypoints = models.Waypoint.objects.filter(
+        trip=trip).order_by('time', 'id').values_list(*POINT_FIELDS)
+    for values in waypoints.iterator():
+        yield point('wpt', *values)
+
+    pois = models.PointsOfInterest.objects.filter(
+        trips=trip).order_by('time', 'id').values_list(*POINT_FIELDS)
+    for values in pois.iterator():
+        yield point('wpt', *values)
+
+    for route in models.Route.objects.filter(trips=trip).order_by('id'):
+        yield '<rte>' + feature(route)
+        points = models.RoutePoint.objects.filter(
+            route=route).order_by('ordinal').values_list(*POINT_FIELDS)
+        for values in points.iterator():
+            yield point('rtept', *values)
+        yield '</rte>\n'
+
+    for track in models.Track.objects.filter(trip=trip).order_by('id'):
+        yield '<trk>' + feature(track)
+        for segment in track.segments().order_by('ordinal'):
+            yield '<trkseg>\n'
+            for values in segment_points(segment):
+                yield point('trkpt', *values)
+            yield '</trkseg>\n'
+        yield '</trk>\n'
+
+    yield FOOTER
+
+
+def segment_points(segment):
+    """Yield (latitude, longitude, elevation, time) for a segment."""
+
+    if segment.storage == 'packed':
+        for p in segment.packed_points():
+            yield (p.latitude, p.longitude, p.elevation, p.time)
+        return
+
+    points = models.TrackPoint.objects.filter(
+        segment=segment).order_by('ordinal').values_list(
+            'latitude', 'longitude', 'elevation', 'time')
+    for values in points.iterator():
+        yield values
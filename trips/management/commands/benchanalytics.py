@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import collections
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+import numpy
+
+import trips.analytics as analytics
+
+Point = collections.namedtuple(
+    'Point', ('longitude', 'latitude', 'elevation', 'time'))
+
+
+class Command(BaseCommand):
+    help = """Time vectorised track statistics against a per-point loop.
+
+    The vectorised side is GPXFile.analyse_tracks, reading a segment's
+    points into arrays. The loop is TrackStatistics, which injection
+    still uses, since it sees each point once as it is written.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        n = options['points']
+        ordinals = numpy.arange(n)
+        longitudes = 171.56 + ordinals * 0.00001
+        latitudes = -42.94 + ordinals * 0.00001
+        elevations = 740 + 20 * numpy.sin(ordinals / 100.0)
+        times = ordinals.astype(float)
+        times[ordinals % 50 < 10] = numpy.nan   # Some untimed stretches.
+
+        # Both sides take points as they are read from a file.
+        epoch = datetime.datetime(1970, 1, 1)
+        points = [
+            Point(float(longitudes[i]), float(latitudes[i]),
+                  float(elevations[i]),
+                  None if numpy.isnan(times[i])
+                  else epoch + datetime.timedelta(seconds=times[i]))
+            for i in range(n)
+        ]
+
+        # Both find distance, moving time and smoothed climb.
+        start = time.time()
+        stats = analytics.segment_stats(*analytics.point_arrays(points))
+        vectorised = {
+            'distance': stats['distance'],
+            'moving_time': stats['moving_time'],
+            'climb': (stats['elevation_gain'], stats['elevation_loss']),
+        }
+        vectorised_time = time.time() - start
+
+        start = time.time()
+        stats = analytics.TrackStatistics()
+        for point in points:
+            stats.add(*point)
+        fields = stats.fields()
+        loop = {
+            'distance': fields['length'],
+            'moving_time': stats.moving_time,
+            'climb': (fields['elevation_gain'], fields['elevation_loss']),
+        }
+        loop_time = time.time() - start
+
+        for (name, seconds, result) in (
+                ('vectorised', vectorised_time, vectorised),
+                ('loop', loop_time, loop),
+        ):
+            self.stdout.write(
+                '%-10s %8.3f s  %10.1f m  %8.0f s moving  +%.0f -%.0f m' % (
+                    name, seconds, result['distance'],
+                    result['moving_time'],
+                    result['climb'][0], result['climb'][1]))
+        self.stdout.write('speedup    %8.1f x' % (
+            loop_time / max(vectorised_time, 1e-9)))
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+import io
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import gpxpy.gpx
+
+import trips.models as models
+
+
+def synthetic_gpx(points, segments=1, name='synthetic'):
+    """Return a gpxpy object with one track of evenly spaced points.
+
+    Points walk north-east from Arthur's Pass at one second intervals.
+    """
+
+    gpx = gpxpy.gpx.GPX()
+    track = gpxpy.gpx.GPXTrack(name=name)
+    gpx.tracks.append(track)
+
+    start = datetime.datetime(2017, 10, 1, 8, 0, 0)
+    per_segment = points // segments
+    ordinal = 0
+
+    for s in range(segments):
+        segment = gpxpy.gpx.GPXTrackSegment()
+        track.segments.append(segment)
+        for p in range(per_segment):
+            segment.points.append(gpxpy.gpx.GPXTrackPoint(
+                latitude=-42.94 + ordinal * 0.00001,
+                longitude=171.56 + ordinal * 0.00001,
+                elevation=740 + (ordinal % 200),
+                time=start + datetime.timedelta(seconds=ordinal),
+            ))
+            ordinal += 1
+
+    return gpx
+
+
+def synthetic_routes(points, routes=1, name='synthetic'):
+    """Return a gpxpy object with routes of evenly spaced points.
+
+    Points walk north-east from Arthur's Pass, as for synthetic_gpx().
+    """
+
+    gpx = gpxpy.gpx.GPX()
+    per_route = points // routes
+    ordinal = 0
+
+    for r in range(routes):
+        route = gpxpy.gpx.GPXRoute(name='%s %d' % (name, r + 1))
+        gpx.routes.append(route)
+        for p in range(per_route):
+            route.points.append(gpxpy.gpx.GPXRoutePoint(
+                latitude=-42.94 + ordinal * 0.00001,
+                longitude=171.56 + ordinal * 0.00001,
+                elevation=740 + (ordinal % 200),
+            ))
+            ordinal += 1
+
+    return gpx
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time track or route injection on a synthetic gpx file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=100000)
+        parser.add_argument('--segments', type=int, default=10)
+        parser.add_argument(
+            '--routes', type=int, default=0,
+            help='Time this many routes, instead of one track.')
+        parser.add_argument(
+            '--naive', action='store_true',
+            help='Also time one save() per point, for comparison.')
+
+    def handle(self, *args, **options):
+        if options['routes']:
+            gpx = synthetic_routes(options['points'], options['routes'])
+            (batched, naive) = (self.batched_routes, self.naive_routes)
+        else:
+            gpx = synthetic_gpx(options['points'], options['segments'])
+            (batched, naive) = (self.batched, self.naive)
+        f = io.StringIO(gpx.to_xml())
+        f.name = 'synthetic.gpx'
+
+        elapsed = self.run(batched, gpx, f)
+        self.report('batched', options['points'], elapsed)
+
+        if options['naive']:
+            elapsed = self.run(naive, gpx, f)
+            self.report('naive', options['points'], elapsed)
+
+    def run(self, method, gpx, f):
+        """Time method inside a transaction which is then rolled back."""
+
+        start = time.time()
+        try:
+            with transaction.atomic():
+                trip = models.Trip(name='benchinject')
+                super(models.TripTemplate, trip).save()
+                method(gpx, f, trip)
+                elapsed = time.time() - start
+                raise Rollback()
+        except Rollback:
+            pass
+
+        return elapsed
+
+    def batched(self, gpx, f, trip):
+        gpxf = models.GPXFile(f, trip)
+        gpxf.inject_tracks(gpx, trip)
+
+    def naive(self, gpx, f, trip):
+        for track in gpx.tracks:
+            trackrc = models.Track(trip=trip, name=track.name)
+            trackrc.save()
+            for seg_ordinal, segment in enumerate(track.segments):
+                segrc = models.TrackSegment(
+                    track=trackrc, ordinal=seg_ordinal)
+                segrc.save()
+                for ordinal, point in enumerate(segment.points):
+                    models.TrackPoint(
+                        segment=segrc, ordinal=ordinal,
+                        latitude=point.latitude,
+                        longitude=point.longitude,
+                        elevation=point.elevation,
+                        time=point.time,
+                        geom=models.Point(
+                            point.longitude, point.latitude,
+                            srid=models.SRID['WGS84']),
+                    ).save(statistics=False)
+
+    def batched_routes(self, gpx, f, trip):
+        gpxf = models.GPXFile(f, trip)
+        gpxf.inject_routes(gpx, trip)
+
+    def naive_routes(self, gpx, f, trip):
+        for route in gpx.routes:
+            routerc = models.Route(name=route.name)
+            routerc.save()
+            routerc.trips.add(trip)
+            for ordinal, point in enumerate(route.points):
+                models.RoutePoint(
+                    route=routerc, ordinal=ordinal,
+                    latitude=point.latitude,
+                    longitude=point.longitude,
+                    elevation=point.elevation,
+                    geom=models.Point(
+                        point.longitude, point.latitude,
+                        srid=models.SRID['WGS84']),
+                ).save()
+
+    def report(self, label, points, elapsed):
+        self.stdout.write('%-8s %8d points %8.2f s %10.0f points/s' % (
+            label, points, elapsed, points / max(elapsed, 1e-9)))
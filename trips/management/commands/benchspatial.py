@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import numpy
+
+import trips.models as models
+import trips.settings as settings
+import trips.spatial as spatial
+from trips.analytics import haversine
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Time indexed bbox, radius and nearest queries against a '
+            'scan, over synthetic waypoints spread across New Zealand.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=20)
+        parser.add_argument('--radius', type=float, default=2000)
+        parser.add_argument('--k', type=int, default=10)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                trip = models.Trip(name='benchspatial')
+                super(models.TripTemplate, trip).save()
+                self.load(trip, options['points'])
+                self.bench(trip, options)
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def load(self, trip, count):
+        random = numpy.random.RandomState(0)
+        longitudes = random.uniform(166.5, 178.5, count)
+        latitudes = random.uniform(-47.3, -34.4, count)
+
+        start = time.time()
+        for batch in models.chunked(
+                zip(longitudes, latitudes), settings.INJECT_BATCH_SIZE):
+            models.Waypoint.objects.bulk_create([
+                models.Waypoint(
+                    trip=trip, longitude=x, latitude=y,
+                    geom=models.Point(x, y, srid=models.SRID['WGS84']))
+                for (x, y) in batch
+            ])
+        self.stdout.write('loaded %d waypoints in %.1f s' % (
+            count, time.time() - start))
+
+    def bench(self, trip, options):
+        random = numpy.random.RandomState(1)
+        queries = [
+            (random.uniform(168, 177), random.uniform(-46, -36))
+            for i in range(options['queries'])
+        ]
+        radius = options['radius']
+        k = options['k']
+        waypoints = models.Waypoint.objects.filter(trip=trip)
+
+        def bbox_indexed(x, y):
+            return len(spatial.in_bbox(
+                waypoints, spatial.radius_bbox(x, y, radius)))
+
+        def bbox_scan(x, y):
+            (west, south, east, north) = spatial.radius_bbox(x, y, radius)
+            return sum(
+                1 for (px, py) in waypoints.values_list(
+                    'longitude', 'latitude').iterator()
+                if west <= px <= east and south <= py <= north)
+
+        def radius_indexed(x, y):
+            return len(spatial.within(waypoints, x, y, radius))
+
+        def radius_scan(x, y):
+            return sum(
+                1 for (px, py) in waypoints.values_list(
+                    'longitude', 'latitude').iterator()
+                if haversine(x, y, px, py) <= radius)
+
+        def nearest_indexed(x, y):
+            return spatial.nearest(waypoints, x, y, k)[-1][0]
+
+        def nearest_scan(x, y):
+            return sorted(
+                haversine(x, y, px, py)
+                for (px, py) in waypoints.values_list(
+                    'longitude', 'latitude').iterator())[k - 1]
+
+        for (label, method, scans) in (
+                ('bbox', bbox_indexed, bbox_scan),
+                ('radius', radius_indexed, radius_scan),
+                ('nearest', nearest_indexed, nearest_scan),
+        ):
+            indexed = self.time(method, queries)
+            # Full scans are slow; time a few.
+            scanned = self.time(scans, queries[:3])
+            self.stdout.write(
+                '%-8s indexed %9.2f ms  scan %9.2f ms  %8.1f x' % (
+                    label, indexed * 1000, scanned * 1000,
+                    scanned / max(indexed, 1e-9)))
+
+    def time(self, method, queries):
+        """Mean seconds per query."""
+
+        start = time.time()
+        for (x, y) in queries:
+            method(x, y)
+        return (time.time() - start) / len(queries)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+import trips.models as models
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the simplified geometry levels of tracks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'tracks', nargs='*', type=int,
+            help='Track ids. All tracks if none are given.')
+
+    def handle(self, *args, **options):
+        tracks = models.Track.objects.all()
+        if options['tracks']:
+            tracks = tracks.filter(id__in=options['tracks'])
+
+        for track in tracks.iterator():
+            track.build_levels()
+            self.stdout.write('%s: %s' % (track, ', '.join(
+                '%d/%d' % (level.zoom, level.point_count)
+                for level in track.levels.all())))
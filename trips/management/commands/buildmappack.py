@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+import trips.mappack as mappack
+import trips.models as models
+
+
+class Command(BaseCommand):
+    help = ('Build the offline map pack of a trip: its features, places '
+            'and sheet grid within a corridor around its tracks and routes, '
+            'as a GeoPackage. Unchanged sheets are reused.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('trip', help='Trip identifier, or a prefix.')
+        parser.add_argument(
+            '--buffer', type=float, default=None,
+            help='Corridor metres; settings.MAPPACK_BUFFER by default.')
+        parser.add_argument('--processes', type=int, default=None)
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Build every sheet again, reusing nothing.')
+
+    def handle(self, *args, **options):
+        trips = models.Trip.objects.filter(id__startswith=options['trip'])
+        if trips.count() != 1:
+            raise CommandError('No single trip matches %s.' % options['trip'])
+        trip = trips[0]
+
+        start = time.time()
+        result = mappack.build(
+            trip, options['buffer'], options['processes'],
+            options['rebuild'])
+        if result is None:
+            raise CommandError('%s has no tracks or routes.' % trip)
+
+        (filepath, built, reused) = result
+        self.stdout.write(
+            '%s: %d sheets built, %d reused, in %.1f s' % (
+                filepath, built, reused, time.time() - start))
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from geolib.index import sheet_index
+from geolib.models import Topo50
+import trips.models as models
+
+
+class Command(BaseCommand):
+    help = 'Recompute the Topo50 sheets crossed by tracks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'tracks', nargs='*', type=int,
+            help='Track ids. All tracks if none are given.')
+
+    def handle(self, *args, **options):
+        tracks = models.Track.objects.all()
+        if options['tracks']:
+            tracks = tracks.filter(id__in=options['tracks'])
+
+        index = sheet_index(Topo50)
+        for track in tracks.iterator():
+            track.update_sheets(index)
+            self.stdout.write('%s: %s' % (track, ' '.join(
+                track.sheets.order_by('identifier').values_list(
+                    'identifier', flat=True))))
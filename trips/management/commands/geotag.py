@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+import trips.models as models
+import trips.photos as photos
+
+
+class Command(BaseCommand):
+    help = ("Locate a trip's photographs on its tracks, and write the "
+            "positions into their EXIF data.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('trip', help='Trip identifier.')
+        parser.add_argument(
+            '--offset', type=float, default=None,
+            help='Seconds to add to camera times.')
+        parser.add_argument(
+            '--sync', nargs=2, metavar=('FILENAME', 'TIME'),
+            help='A photo of the gps clock, and the UTC time it shows, '
+                 'from which to work out the offset.')
+        parser.add_argument('--max-gap', type=float, default=None)
+        parser.add_argument('--processes', type=int, default=None)
+        parser.add_argument(
+            '--no-write', action='store_true',
+            help='Locate the photos without changing the files.')
+
+    def handle(self, *args, **options):
+        trip = models.Trip.objects.filter(
+            id__startswith=options['trip']).first()
+        if trip is None:
+            raise CommandError('No trip %s' % options['trip'])
+
+        started = time.time()
+        added = models.Photo.scan(trip, options['processes'])
+        self.stdout.write('%d new photos' % len(added))
+
+        offset = options['offset']
+        if options['sync']:
+            (filename, text) = options['sync']
+            photo = models.Photo.objects.filter(
+                trip=trip, filename=filename).first()
+            gps_time = parse_datetime(text)
+            if photo is None or photo.camera_time is None:
+                raise CommandError('No camera time for %s' % filename)
+            if gps_time is None:
+                raise CommandError('Cannot read the time %s' % text)
+            if timezone.is_naive(gps_time):
+                gps_time = timezone.make_aware(gps_time, timezone.utc)
+            offset = photos.clock_offset(photo.camera_time, gps_time)
+            self.stdout.write('Camera clock offset %+.0f seconds' % offset)
+
+        located = models.Photo.locate(trip, offset, options['max_gap'])
+        total = models.Photo.objects.filter(trip=trip).count()
+        self.stdout.write('%d of %d photos located' % (located, total))
+
+        if not options['no_write']:
+            (tagged, failed) = models.Photo.geotag(
+                trip, options['processes'])
+            self.stdout.write('%d photos tagged, %d failed' % (
+                tagged, failed))
+
+        self.stdout.write('%.1f seconds' % (time.time() - started))
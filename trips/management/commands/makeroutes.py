@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import trips.models as models
+import trips.tiles as tiles
+
+
+class Command(BaseCommand):
+    help = ('Make a route of each track, simplified to a budget of points, '
+            'and add it to the track\'s trip.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('tracks', nargs='+', type=int, help='Track ids.')
+        parser.add_argument(
+            '--points', type=int, default=None,
+            help='Most route points; settings.ROUTE_POINT_LIMIT by default.')
+        parser.add_argument(
+            '--tolerance', type=float, default=None,
+            help='Metres within which points are left out.')
+
+    def handle(self, *args, **options):
+        tracks = models.Track.objects.filter(id__in=options['tracks'])
+
+        for track in tracks.select_related('trip'):
+            start = time.time()
+            route = track.convert_to_route(
+                options['points'], options['tolerance'])
+            if route is None:
+                self.stdout.write('%s: no points' % track)
+                continue
+            simplified = time.time() - start
+
+            with transaction.atomic():
+                route.save()
+                route.trips.add(track.trip)
+                points = route.points_from_line()
+            tiles.invalidate(track.trip)
+
+            self.stdout.write(
+                '%s: %d points to route %d of %d points, simplified in '
+                '%.1f ms, saved in %.1f ms' % (
+                    track, track.point_count, route.id, len(points),
+                    simplified * 1000,
+                    (time.time() - start - simplified) * 1000))
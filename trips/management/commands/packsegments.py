@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+import trips.models as models
+
+
+class Command(BaseCommand):
+    help = 'Move track points from TrackPoint rows into packed segments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'tracks', nargs='*', type=int,
+            help='Track ids. All tracks if none are given.')
+
+    def handle(self, *args, **options):
+        segments = models.TrackSegment.objects.filter(storage='rows')
+        if options['tracks']:
+            segments = segments.filter(track__in=options['tracks'])
+
+        for segment in segments.iterator():
+            segment.pack()
+            self.stdout.write('packed %s, %d points' % (
+                segment, segment.point_count))
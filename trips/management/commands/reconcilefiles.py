@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+
+from django.core.management.base import BaseCommand
+
+import trips.blobstore as blobstore
+import trips.models as models
+
+
+class Command(BaseCommand):
+    help = ('Bring trip file manifests up to date with changes made '
+            'directly in the filespace.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'trips', nargs='*',
+            help='Trip identifiers. All trips if none are given.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report differences without changing anything.')
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Drop manifest entries for files missing from the '
+                 'filespace, rather than restoring the files.')
+        parser.add_argument(
+            '--collect', action='store_true',
+            help='Delete blobs no longer listed in any manifest.')
+
+    def handle(self, *args, **options):
+        trips = models.Trip.objects.all()
+        if options['trips']:
+            trips = [
+                trip for trip in trips
+                if trip.identifier() in options['trips']
+            ]
+
+        for trip in trips:
+            self.reconcile(trip, options)
+
+        if options['collect']:
+            self.collect(options)
+
+    def reconcile(self, trip, options):
+        dry_run = options['dry_run']
+        filespace = trip.filespace()
+        present = set()
+        if os.path.isdir(filespace):
+            present = set(
+                filename for filename in os.listdir(filespace)
+                if os.path.isfile(os.path.join(filespace, filename))
+            )
+
+        records = trip.files.select_related('blob')
+        for tripfile in records:
+            tripfile.trip = trip
+            filepath = tripfile.path()
+
+            if tripfile.filename not in present:
+                if options['prune']:
+                    self.report(trip, tripfile.filename, 'removed')
+                    if not dry_run:
+                        tripfile.delete()
+                else:
+                    self.report(trip, tripfile.filename, 'restored')
+                    if not dry_run:
+                        tripfile.link()
+                continue
+
+            present.discard(tripfile.filename)
+            if tripfile.is_current():
+                continue
+
+            # Touched, or copied rather than linked: compare content.
+            if blobstore.digest_file(filepath) == tripfile.digest:
+                if not dry_run:
+                    tripfile.link()
+                continue
+
+            self.report(trip, tripfile.filename, 'changed')
+            if not dry_run:
+                models.TripFile.store_path(trip, tripfile.filename)
+
+        for filename in sorted(present):
+            self.report(trip, filename, 'added')
+            if not dry_run:
+                models.TripFile.store_path(trip, filename)
+
+    def collect(self, options):
+        unused = models.Blob.objects.filter(files__isnull=True)
+        for blob in unused:
+            self.stdout.write('%s unused' % blob.digest)
+            if not options['dry_run']:
+                blobstore.remove(blob.digest)
+                blob.delete()
+
+    def report(self, trip, filename, change):
+        self.stdout.write('%s: %s %s' % (trip, filename, change))
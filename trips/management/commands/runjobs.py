@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import multiprocessing
+import time
+
+from django import db
+from django.core.management.base import BaseCommand
+
+import trips.models as models
+import trips.settings as settings
+
+
+def run_job(job_id):
+    """Run one job in a worker process."""
+
+    try:
+        models.Job.objects.get(id=job_id).run()
+    finally:
+        db.connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run queued gpx injection jobs in a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=settings.JOB_PROCESSES)
+        parser.add_argument(
+            '--poll', type=float, default=2.0,
+            help='Seconds between checks of the queue.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit when the queue is empty.')
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+
+        # Workers must open their own database connections.
+        db.connections.close_all()
+        pool = multiprocessing.Pool(processes)
+        running = {}
+
+        try:
+            while True:
+                try:
+                    models.Job.heartbeat(list(running))
+                    models.Job.requeue_stale()
+                except db.OperationalError:
+                    # SpatiaLite is locked while a worker writes a track.
+                    time.sleep(options['poll'])
+                    continue
+
+                for (job_id, result) in list(running.items()):
+                    if result.ready():
+                        del running[job_id]
+                        job = models.Job.objects.get(id=job_id)
+                        self.stdout.write('%s %s' % (job, job.status))
+
+                free = processes - len(running)
+                if free > 0:
+                    for job in models.Job.claim(free):
+                        self.stdout.write('%s started' % job)
+                        running[job.id] = pool.apply_async(
+                            run_job, (job.id,))
+
+                if options['once'] and not running:
+                    break
+
+                time.sleep(options['poll'])
+
+        finally:
+            pool.close()
+            pool.join()
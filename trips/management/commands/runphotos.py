@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import multiprocessing
+import time
+
+from django import db
+from django.core.management.base import BaseCommand
+
+import trips.models as models
+import trips.settings as settings
+
+
+def process_photos(photo_ids):
+    """Ingest a batch of photos in a worker process."""
+
+    try:
+        models.Photo.process(photo_ids)
+    finally:
+        db.connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Ingest queued photos in a pool of worker processes: read '
+            'their EXIF data, make thumbnails, and locate them on tracks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=settings.PHOTO_PROCESSES)
+        parser.add_argument(
+            '--batch', type=int, default=settings.PHOTO_BATCH_SIZE,
+            help='Photos handed to a worker at a time.')
+        parser.add_argument(
+            '--poll', type=float, default=2.0,
+            help='Seconds between checks of the queue.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit when the queue is empty.')
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+
+        # Workers must open their own database connections.
+        db.connections.close_all()
+        pool = multiprocessing.Pool(processes)
+        running = []
+
+        try:
+            while True:
+                try:
+                    models.Photo.requeue_stale()
+                except db.OperationalError:
+                    # SpatiaLite is locked while a worker writes a batch.
+                    time.sleep(options['poll'])
+                    continue
+
+                finished = [batch for batch in running if batch[1].ready()]
+                for batch in finished:
+                    try:
+                        self.located(batch[0])
+                    except db.OperationalError:
+                        break    # Kept, to be located at the next poll.
+                    running.remove(batch)
+
+                # Keep a batch in hand for each worker.
+                try:
+                    while len(running) < processes * 2:
+                        photo_ids = models.Photo.claim(options['batch'])
+                        if not photo_ids:
+                            break
+                        running.append((photo_ids, pool.apply_async(
+                            process_photos, (photo_ids,))))
+                except db.OperationalError:
+                    pass    # Claimed at the next poll instead.
+
+                if options['once'] and not running:
+                    break
+
+                time.sleep(options['poll'])
+
+        finally:
+            pool.close()
+            pool.join()
+
+    def located(self, photo_ids):
+        """Locate the photos of trips with nothing left to ingest."""
+
+        trips = models.Trip.objects.filter(photos__id__in=photo_ids).distinct()
+        for trip in trips:
+            pending = models.Photo.objects.filter(
+                trip=trip, status__in=('queued', 'processing'))
+            if not pending.exists():
+                located = models.Photo.locate(trip)
+                self.stdout.write('%s: %d photos located' % (trip, located))
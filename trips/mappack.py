@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+"""Offline map packs of a trip's corridor, as GeoPackage files.
+
+A map pack holds what a phone or gps unit needs in the field: the
+trip's tracks and routes, its waypoints and points of interest, and
+the gazetteer places and Topo50 sheet grid within MAPPACK_BUFFER
+metres of its tracks and routes. This buffered area is the corridor,
+and is stored in the pack too.
+
+A pack is built one Topo50 sheet at a time, in a pool of worker
+processes. The part for a sheet holds the corridor's lines clipped to
+the sheet, and the points which lie in it. Each part is written to a
+GeoPackage of its own, named by the SHA-1 digest of its inputs, so a
+part whose sheet, corridor and features are unchanged is reused
+rather than rebuilt. The parts are then copied into one pack, which
+is itself named by the digest of its parts, under
+MAPPACK_DIR/<trip id>/. Points which lie in no sheet are left out.
+
+GeoPackages are written with the sqlite3 module, so no GDAL drivers
+are needed. Geometries are little endian WKB, with the GeoPackage
+header and no envelope.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+import tempfile
+
+from django.contrib.gis.geos import (
+    MultiLineString, MultiPolygon, Point, WKBWriter)
+from django.db import connections
+
+from geolib.index import sheet_index
+from geolib.models import PlaceName, Topo50
+from trips.analytics import EARTH_RADIUS
+import trips.photos as photos
+import trips.settings as settings
+import trips.spatial as spatial
+import trips.tiles as tiles
+
+FORMAT = 1  # Part of every digest; change it when the tables change.
+
+APPLICATION_ID = 0x47504B47  # 'GPKG'
+USER_VERSION = 10200         # GeoPackage 1.2
+
+WGS84 = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,'
+    '298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],'
+    'PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",'
+    '0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'
+)
+
+SPATIAL_REF_SYS = [
+    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', None),
+    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', None),
+    ('WGS 84 geodetic', 4326, 'EPSG', 4326, WGS84, None),
+]
+
+SCHEMA = '''
+CREATE TABLE gpkg_spatial_ref_sys (
+    srs_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL PRIMARY KEY,
+    organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL,
+    definition TEXT NOT NULL,
+    description TEXT
+);
+CREATE TABLE gpkg_contents (
+    table_name TEXT NOT NULL PRIMARY KEY,
+    data_type TEXT NOT NULL,
+    identifier TEXT UNIQUE,
+    description TEXT DEFAULT '',
+    last_change DATETIME NOT NULL
+        DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    min_x DOUBLE,
+    min_y DOUBLE,
+    max_x DOUBLE,
+    max_y DOUBLE,
+    srs_id INTEGER REFERENCES gpkg_spatial_ref_sys(srs_id)
+);
+CREATE TABLE gpkg_geometry_columns (
+    table_name TEXT NOT NULL REFERENCES gpkg_contents(table_name),
+    column_name TEXT NOT NULL,
+    geometry_type_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL REFERENCES gpkg_spatial_ref_sys(srs_id),
+    z TINYINT NOT NULL,
+    m TINYINT NOT NULL,
+    PRIMARY KEY (table_name, column_name)
+);
+'''
+
+# Feature tables: name, geometry type, and attribute columns. Every
+# table but the corridor also has the identifier of its sheet.
+TABLES = [
+    ('sheets', 'POLYGON', [
+        ('identifier', 'TEXT'), ('sheet_name', 'TEXT')]),
+    ('tracks', 'MULTILINESTRING', [
+        ('track_id', 'INTEGER'), ('name', 'TEXT'), ('sheet', 'TEXT')]),
+    ('routes', 'MULTILINESTRING', [
+        ('route_id', 'INTEGER'), ('name', 'TEXT'), ('sheet', 'TEXT')]),
+    ('waypoints', 'POINT', [
+        ('waypoint_id', 'INTEGER'), ('name', 'TEXT'), ('elevation', 'REAL'),
+        ('time', 'TEXT'), ('sheet', 'TEXT')]),
+    ('pois', 'POINT', [
+        ('poi_id', 'INTEGER'), ('name', 'TEXT'), ('gtype', 'TEXT'),
+        ('elevation', 'REAL'), ('sheet', 'TEXT')]),
+    ('places', 'POINT', [
+        ('place_id', 'INTEGER'), ('name', 'TEXT'),
+        ('feature_type', 'TEXT'), ('sheet', 'TEXT')]),
+    ('corridor', 'MULTIPOLYGON', []),
+]
+
+COLUMNS = dict(
+    (table, [column for (column, sqltype) in columns])
+    for (table, geometry_type, columns) in TABLES
+)
+
+
+def gpkg_geometry(geom):
+    """GeoPackage binary of a geometry: a header, then little endian WKB.
+    """
+
+    writer = WKBWriter()
+    writer.byteorder = 1
+    header = b'GP\x00\x01' + struct.pack('<i', geom.srid or 4326)
+
+    return sqlite3.Binary(header + bytes(writer.write(geom)))
+
+
+def create(filepath):
+    """Create an empty GeoPackage of the map pack tables, and open it."""
+
+    db = sqlite3.connect(filepath, isolation_level=None)
+    db.execute('PRAGMA application_id = %d' % APPLICATION_ID)
+    db.execute('PRAGMA user_version = %d' % USER_VERSION)
+    db.executescript(SCHEMA)
+    db.executemany(
+        'INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)',
+        SPATIAL_REF_SYS)
+
+    for (table, geometry_type, columns) in TABLES:
+        db.execute(
+            'CREATE TABLE %s (fid INTEGER PRIMARY KEY AUTOINCREMENT, %s'
+            'geom %s)' % (table, ''.join(
+                '%s %s, ' % column for column in columns), geometry_type))
+        db.execute(
+            'INSERT INTO gpkg_contents (table_name, data_type, identifier, '
+            'srs_id) VALUES (?, ?, ?, 4326)', (table, 'features', table))
+        db.execute(
+            'INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, 4326, 0, 0)',
+            (table, 'geom', geometry_type))
+
+    return db
+
+
+def insert(db, table, values, geom):
+    db.execute('INSERT INTO %s (%s) VALUES (%s)' % (
+        table, ', '.join(COLUMNS[table] + ['geom']),
+        ', '.join('?' * (len(values) + 1))),
+        tuple(values) + (gpkg_geometry(geom),))
+
+
+def multiline(geom):
+    if geom.geom_type == 'LineString':
+        return MultiLineString([geom], srid=geom.srid)
+    return geom
+
+
+def multipolygon(geom):
+    if geom.geom_type == 'Polygon':
+        return MultiPolygon([geom], srid=geom.srid)
+    return geom
+
+
+def overlaps(a, b):
+    """Whether two (xmin, ymin, xmax, ymax) extents overlap."""
+
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def trip_lines(trip, zoom=None):
+    """[(table, values, geometry)] of a trip's tracks and routes.
+
+    Tracks are taken at the stored level for zoom (see Track.geometry).
+    """
+
+    zoom = zoom or settings.MAPPACK_ZOOM
+    lines = []
+
+    for track in trip.track_set.order_by('id').defer('geom'):
+        geom = track.geometry(zoom)
+        if geom is not None and not geom.empty:
+            lines.append(('tracks', (track.id, track.name), geom))
+
+    for route in trip.route_set.order_by('id'):
+        geom = tiles.route_line(route)
+        if geom is not None:
+            lines.append(('routes', (route.id, route.name), geom))
+
+    return lines
+
+
+def corridor(lines, metres=None):
+    """The area within metres of any of the lines.
+
+    The buffer is worked out in degrees of longitude at the line
+    nearest the pole, so the corridor is, if anything, a little wide.
+    """
+
+    metres = metres or settings.MAPPACK_BUFFER
+    parts = []
+    for geom in lines:
+        parts.extend(multiline(geom))
+    together = MultiLineString(parts, srid=4326)
+
+    (xmin, ymin, xmax, ymax) = together.extent
+    poleward = min(89.0, max(abs(ymin), abs(ymax)))
+    degrees = math.degrees(metres / EARTH_RADIUS) / math.cos(
+        math.radians(poleward))
+
+    return together.buffer(degrees, quadsegs=4)
+
+
+def trip_points(trip, area):
+    """[(table, values, longitude, latitude)] of points in the corridor.
+    """
+
+    points = []
+
+    waypoints = trip.waypoint_set.filter(
+        longitude__isnull=False, latitude__isnull=False).order_by(
+            'id').values_list(
+                'id', 'name', 'elevation', 'time', 'longitude', 'latitude')
+    for (pk, name, elevation, time, longitude, latitude) in waypoints:
+        points.append((
+            'waypoints',
+            (pk, name, elevation, time.isoformat() if time else None),
+            longitude, latitude))
+
+    pois = trip.pois.filter(
+        longitude__isnull=False, latitude__isnull=False).order_by(
+            'id').values_list(
+                'id', 'name', 'gtype', 'elevation', 'longitude', 'latitude')
+    for (pk, name, gtype, elevation, longitude, latitude) in pois:
+        points.append(
+            ('pois', (pk, name, gtype, elevation), longitude, latitude))
+
+    places = spatial.prefilter(
+        PlaceName.objects.all(), area.extent).order_by(
+            'identifier').values_list(
+                'identifier', 'name', 'feature_type', 'longitude', 'latitude')
+    for (pk, name, feature_type, longitude, latitude) in places:
+        points.append(
+            ('places', (pk, name, feature_type), longitude, latitude))
+
+    prepared = area.prepared
+    return [
+        point for point in points
+        if prepared.covers(Point(point[2], point[3]))
+    ]
+
+
+def digest(*parts):
+    """SHA-1 hex digest of text, numbers, geometries and lists of them."""
+
+    sha1 = hashlib.sha1()
+
+    def update(value):
+        if isinstance(value, (list, tuple)):
+            sha1.update(b'(')
+            for item in value:
+                update(item)
+            sha1.update(b')')
+        elif hasattr(value, 'wkb'):
+            sha1.update(bytes(value.wkb))
+        else:
+            sha1.update(('%r\x1f' % (value,)).encode('utf-8'))
+
+    update((FORMAT,) + parts)
+    return sha1.hexdigest()
+
+
+def pack_dir(trip):
+    return os.path.join(
+        settings.STATICFILES_DIR, settings.MAPPACK_DIR, str(trip.id))
+
+
+def part_path(trip, part_digest):
+    return os.path.join(pack_dir(trip), 'part-%s.gpkg' % part_digest)
+
+
+def pack_path(trip, pack_digest):
+    return os.path.join(pack_dir(trip), 'pack-%s.gpkg' % pack_digest)
+
+
+def latest(trip):
+    """Path of the trip's most recently built map pack, or None."""
+
+    directory = pack_dir(trip)
+    if not os.path.isdir(directory):
+        return None
+
+    packs = [
+        os.path.join(directory, filename)
+        for filename in os.listdir(directory)
+        if filename.startswith('pack-') and filename.endswith('.gpkg')
+    ]
+    if not packs:
+        return None
+
+    return max(packs, key=os.path.getmtime)
+
+
+def sheet_tasks(trip, area, lines, points):
+    """Return a task for build_part() for each sheet the corridor crosses.
+    """
+
+    index = sheet_index(Topo50)
+    identifiers = index.crossing(area)
+    sheets = Topo50.objects.in_bulk(identifiers)
+    located = index.sheets(
+        [point[2] for point in points], [point[3] for point in points])
+
+    tasks = []
+    for identifier in identifiers:
+        sheet = sheets[identifier]
+        extent = sheet.geom.extent
+        task = (
+            identifier,
+            sheet.sheet_name,
+            sheet.geom,
+            area.intersection(sheet.geom),
+            [line for line in lines if overlaps(line[2].extent, extent)],
+            [point for (point, located_in) in zip(points, located)
+             if located_in == identifier],
+        )
+        tasks.append((part_path(trip, digest(*task)),) + task)
+
+    return tasks
+
+
+def build_part(task):
+    """Write the GeoPackage part of a map pack for one sheet.
+
+    The task is (filepath, identifier, sheet name, sheet geometry,
+    corridor in the sheet, lines, points), as from sheet_tasks().
+    Return (filepath, error or None).
+    """
+
+    (filepath, identifier, sheet_name, sheet_geom, area, lines,
+     points) = task
+
+    # SQLite takes an empty file as an empty database.
+    (handle, temporary) = tempfile.mkstemp(
+        dir=os.path.dirname(filepath), suffix='.tmp')
+    os.close(handle)
+
+    try:
+        db = create(temporary)
+        db.execute('BEGIN')
+        insert(db, 'sheets', (identifier, sheet_name), sheet_geom)
+
+        for (table, values, geom) in lines:
+            part = tiles.clipped(geom, area)
+            if part is not None:
+                insert(db, table, values + (identifier,), multiline(part))
+
+        for (table, values, longitude, latitude) in points:
+            insert(db, table, values + (identifier,),
+                   Point(longitude, latitude, srid=4326))
+
+        db.execute('COMMIT')
+        db.close()
+
+        # Write aside and rename, so a part is never seen half made.
+        os.rename(temporary, filepath)
+        return (filepath, None)
+
+    except Exception as e:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        return (filepath, '%s' % e)
+
+
+def assemble(filepath, area, parts):
+    """Copy the tables of the part files into one new GeoPackage."""
+
+    directory = os.path.dirname(filepath)
+    (handle, temporary) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(handle)
+
+    try:
+        db = create(temporary)
+        insert(db, 'corridor', (), multipolygon(area))
+
+        for part in parts:
+            db.execute('ATTACH DATABASE ? AS part', (part,))
+            db.execute('BEGIN')
+            for (table, columns) in COLUMNS.items():
+                if table == 'corridor':
+                    continue
+                names = ', '.join(columns + ['geom'])
+                db.execute('INSERT INTO main.%s (%s) SELECT %s FROM part.%s '
+                           'ORDER BY fid' % (table, names, names, table))
+            db.execute('COMMIT')
+            db.execute('DETACH DATABASE part')
+
+        db.execute('VACUUM')
+        db.close()
+        os.rename(temporary, filepath)
+
+    except Exception:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def build(trip, metres=None, processes=None, rebuild=False):
+    """Build a trip's map pack, reusing unchanged parts.
+
+    Return (filepath, parts built, parts reused), or None if the trip
+    has no tracks or routes. Parts and packs no longer current are
+    removed.
+    """
+
+    lines = trip_lines(trip)
+    if not lines:
+        return None
+
+    area = corridor([line[2] for line in lines], metres)
+    points = trip_points(trip, area)
+    tasks = sheet_tasks(trip, area, lines, points)
+
+    directory = pack_dir(trip)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    if rebuild:
+        for filename in os.listdir(directory):
+            os.remove(os.path.join(directory, filename))
+
+    pending = [task for task in tasks if not os.path.exists(task[0])]
+
+    # Workers must not share the parent's database connection.
+    connections.close_all()
+    errors = [
+        '%s: %s' % (os.path.basename(filepath), error)
+        for (filepath, error) in photos.pool_map(
+            build_part, pending,
+            processes or settings.MAPPACK_PROCESSES)
+        if error
+    ]
+    if errors:
+        raise RuntimeError(
+            'Map pack parts failed: %s' % '; '.join(sorted(errors)))
+
+    parts = [task[0] for task in tasks]
+    filepath = pack_path(trip, digest(
+        area, [os.path.basename(part) for part in parts]))
+    if not os.path.exists(filepath):
+        assemble(filepath, area, parts)
+
+    current = set(parts + [filepath])
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        if path not in current and not filename.endswith('.tmp'):
+            os.remove(path)
+
+    return (filepath, len(pending), len(tasks) - len(pending))
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GPXAnalysis',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.TextField(unique=True)),
+                ('mtime', models.FloatField()),
+                ('size', models.BigIntegerField()),
+                ('summary', models.BinaryField()),
+                ('accessed', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
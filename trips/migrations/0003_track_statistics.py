@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import math
+
+from django.db import migrations, models
+
+EARTH_RADIUS = 6371008.8
+
+
+# trips.analytics.TrackStatistics, as it was when this migration was
+# written: elevation gain and loss are those of the raw elevations.
+
+def haversine(longitude1, latitude1, longitude2, latitude2):
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(longitude2 - longitude1)
+
+    a = (math.sin(dphi / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2)
+
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class TrackStatistics(object):
+
+    def __init__(self):
+        self.point_count = 0
+        self.length = 0.0
+        self.xmin = None
+        self.xmax = None
+        self.ymin = None
+        self.ymax = None
+        self.start_time = None
+        self.end_time = None
+        self.elevation_gain = 0.0
+        self.elevation_loss = 0.0
+
+        self.last = None
+        self.last_elevation = None
+
+    def add(self, longitude, latitude, elevation=None, time=None):
+        self.point_count += 1
+
+        if self.last is not None:
+            self.length += haversine(
+                self.last[0], self.last[1], longitude, latitude)
+        self.last = (longitude, latitude)
+
+        self.extend(longitude, longitude, latitude, latitude)
+
+        if elevation is not None:
+            if self.last_elevation is not None:
+                climb = elevation - self.last_elevation
+                if climb > 0:
+                    self.elevation_gain += climb
+                else:
+                    self.elevation_loss -= climb
+            self.last_elevation = elevation
+
+        self.span(time)
+
+    def extend(self, xmin, xmax, ymin, ymax):
+        if xmin is None:
+            return
+        self.xmin = xmin if self.xmin is None else min(self.xmin, xmin)
+        self.xmax = xmax if self.xmax is None else max(self.xmax, xmax)
+        self.ymin = ymin if self.ymin is None else min(self.ymin, ymin)
+        self.ymax = ymax if self.ymax is None else max(self.ymax, ymax)
+
+    def span(self, time):
+        if time is not None:
+            if self.start_time is None or time < self.start_time:
+                self.start_time = time
+            if self.end_time is None or time > self.end_time:
+                self.end_time = time
+
+    def merge(self, other):
+        self.point_count += other.point_count
+        self.length += other.length
+        self.elevation_gain += other.elevation_gain
+        self.elevation_loss += other.elevation_loss
+        self.extend(other.xmin, other.xmax, other.ymin, other.ymax)
+        self.span(other.start_time)
+        self.span(other.end_time)
+
+    def fields(self):
+        return {
+            'point_count': self.point_count,
+            'length': self.length,
+            'xmin': self.xmin,
+            'xmax': self.xmax,
+            'ymin': self.ymin,
+            'ymax': self.ymax,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'elevation_gain': self.elevation_gain,
+            'elevation_loss': self.elevation_loss,
+        }
+
+
+def compute_statistics(apps, schema_editor):
+    """Fill the statistics columns of existing segments and tracks."""
+
+    Track = apps.get_model('trips', 'Track')
+    TrackSegment = apps.get_model('trips', 'TrackSegment')
+    TrackPoint = apps.get_model('trips', 'TrackPoint')
+
+    for track in Track.objects.all().iterator():
+        trackstats = TrackStatistics()
+        segment_count = 0
+
+        for segment in TrackSegment.objects.filter(
+                track=track).order_by('ordinal'):
+            stats = TrackStatistics()
+            points = TrackPoint.objects.filter(segment=segment).order_by(
+                'ordinal').values_list(
+                    'longitude', 'latitude', 'elevation', 'time')
+            for (longitude, latitude, elevation, time) in points.iterator():
+                if longitude is not None and latitude is not None:
+                    stats.add(longitude, latitude, elevation, time)
+
+            TrackSegment.objects.filter(
+                id=segment.id).update(**stats.fields())
+            trackstats.merge(stats)
+            segment_count += 1
+
+        fields = trackstats.fields()
+        fields['segment_count'] = segment_count
+        Track.objects.filter(id=track.id).update(**fields)
+
+
+def statistics_fields():
+    return [
+        ('point_count', models.IntegerField(default=0)),
+        ('length', models.FloatField(default=0)),
+        ('xmin', models.FloatField(blank=True, null=True)),
+        ('xmax', models.FloatField(blank=True, null=True)),
+        ('ymin', models.FloatField(blank=True, null=True)),
+        ('ymax', models.FloatField(blank=True, null=True)),
+        ('start_time', models.DateTimeField(blank=True, null=True)),
+        ('end_time', models.DateTimeField(blank=True, null=True)),
+        ('elevation_gain', models.FloatField(default=0)),
+        ('elevation_loss', models.FloatField(default=0)),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0002_gpxanalysis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name=model_name,
+            name=name,
+            field=field,
+        )
+        for model_name in ('track', 'tracksegment')
+        for (name, field) in statistics_fields()
+    ] + [
+        migrations.AddField(
+            model_name='track',
+            name='segment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(compute_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+import hashlib
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# The fingerprints of trips.digest as they were when this migration
+# was written. Tracks and routes are fingerprinted again, by their
+# points, in 0020.
+
+def normalise(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value, timezone.utc)
+        return value.isoformat()
+    if isinstance(value, float):
+        return '%.7f' % value
+
+    return '%s' % value
+
+
+def fingerprint(*values):
+    text = '\x1f'.join(normalise(value) for value in values)
+
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def waypoint_fingerprint(waypoint):
+    return fingerprint(waypoint.time, waypoint.latitude, waypoint.longitude)
+
+
+def feature_fingerprint(feature):
+    return fingerprint(feature.name, feature.number)
+
+
+def compute_fingerprints(apps, schema_editor):
+    """Fingerprint existing waypoints, tracks and routes."""
+
+    for (name, function) in (
+            ('Waypoint', waypoint_fingerprint),
+            ('Track', feature_fingerprint),
+            ('Route', feature_fingerprint),
+    ):
+        model = apps.get_model('trips', name)
+        for record in model.objects.filter(
+                fingerprint__isnull=True).iterator():
+            model.objects.filter(id=record.id).update(
+                fingerprint=function(record))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0004_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name=model_name,
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=40, null=True),
+        )
+        for model_name in ('route', 'track', 'waypoint')
+    ] + [
+        migrations.RunPython(compute_fingerprints, migrations.RunPython.noop),
+    ]
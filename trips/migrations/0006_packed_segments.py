@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0005_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tracksegment',
+            name='storage',
+            field=models.CharField(choices=[('rows', 'rows'), ('packed', 'packed')], default='rows', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='tracksegment',
+            name='coordinates',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tracksegment',
+            name='elevations',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tracksegment',
+            name='times',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
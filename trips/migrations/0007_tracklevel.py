@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0006_packed_segments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackLevel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.IntegerField()),
+                ('tolerance', models.FloatField()),
+                ('point_count', models.IntegerField(default=0)),
+                ('geom', django.contrib.gis.db.models.fields.MultiLineStringField(srid=4326)),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='levels', to='trips.Track')),
+            ],
+            options={
+                'ordering': ['track', 'zoom'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='tracklevel',
+            unique_together=set([('track', 'zoom')]),
+        ),
+    ]
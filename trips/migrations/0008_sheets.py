@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0007_tracklevel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='sheets',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='waypoint',
+            name='sheet',
+            field=models.CharField(blank=True, db_index=True, max_length=4, null=True),
+        ),
+    ]
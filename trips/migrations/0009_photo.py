@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0008_sheets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Photo',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('camera_time', models.DateTimeField(blank=True, null=True)),
+                ('offset', models.FloatField(default=0)),
+                ('time', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('elevation', models.FloatField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('new', 'new'), ('located', 'located'), ('unlocated', 'unlocated'), ('tagged', 'tagged'), ('failed', 'failed')], db_index=True, default='new', max_length=64)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('geom', django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photos', to='trips.Trip')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='photo',
+            unique_together=set([('trip', 'filename')]),
+        ),
+    ]
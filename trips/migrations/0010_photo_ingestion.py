@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0009_photo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='digest',
+            field=models.CharField(blank=True, db_index=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='width',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='height',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='status',
+            field=models.CharField(choices=[('queued', 'queued'), ('processing', 'processing'), ('new', 'new'), ('located', 'located'), ('unlocated', 'unlocated'), ('tagged', 'tagged'), ('failed', 'failed')], db_index=True, default='new', max_length=64),
+        ),
+    ]
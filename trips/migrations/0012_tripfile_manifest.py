@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+
+from django.db import migrations, models
+
+EXTENSIONS = {
+    '.gpx': 'gpx',
+    '.jpg': 'image',
+    '.jpeg': 'image',
+    '.png': 'image',
+    '.gif': 'image',
+    '.tif': 'image',
+    '.tiff': 'image',
+    '.pdf': 'document',
+    '.txt': 'document',
+    '.md': 'document',
+    '.html': 'document',
+}
+
+
+def fill_manifest(apps, schema_editor):
+    """Set the type and size of files already in the manifest."""
+
+    TripFile = apps.get_model('trips', 'TripFile')
+    for record in TripFile.objects.select_related('blob').iterator():
+        extension = os.path.splitext(record.filename)[1].lower()
+        TripFile.objects.filter(id=record.id).update(
+            filetype=EXTENSIONS.get(extension, 'other'),
+            size=record.blob.size,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0011_blob_tripfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tripfile',
+            name='filetype',
+            field=models.CharField(choices=[('gpx', 'gpx'), ('image', 'image'), ('document', 'document'), ('other', 'other')], db_index=True, default='other', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='tripfile',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tripfile',
+            name='mtime',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tripfile',
+            name='summary',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_manifest, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0012_tripfile_manifest'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='trackpoint',
+            index_together=set([('segment', 'ordinal')]),
+        ),
+    ]
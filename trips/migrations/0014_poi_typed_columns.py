@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Add typed columns for point of interest coordinates and times.
+
+    The text columns are converted by 0015, and replaced by 0016.
+    Schema and data changes are kept in separate migrations, so that
+    each runs in a transaction of its own on PostGIS.
+    """
+
+    dependencies = [
+        ('trips', '0013_trackpoint_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pointsofinterest',
+            name=name,
+            field=models.FloatField(blank=True, null=True),
+        )
+        for name in ('typed_latitude', 'typed_longitude', 'typed_elevation')
+    ] + [
+        migrations.AddField(
+            model_name='pointsofinterest',
+            name='typed_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+CHUNK = 2000  # Rows read and converted at a time.
+BATCH = 100   # Rows to an UPDATE, within SQLite's 999 parameters.
+
+FIELDS = ('latitude', 'longitude', 'elevation', 'time')
+
+
+def to_float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_time(text):
+    try:
+        value = parse_datetime(text.strip())
+    except (AttributeError, ValueError):
+        return None
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def to_text(value):
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return '%s' % value
+
+
+def chunks(model, fields):
+    """Yield lists of (id, values...) rows, a chunk at a time, by id."""
+
+    last = 0
+    while True:
+        rows = list(model.objects.filter(id__gt=last).order_by(
+            'id').values_list('id', *fields)[:CHUNK])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def update(model, fields, rows):
+    """Set fields from (id, values...) rows, with a CASE per column."""
+
+    for start in range(0, len(rows), BATCH):
+        batch = rows[start:start + BATCH]
+        values = {}
+        for (n, name) in enumerate(fields, 1):
+            field = model._meta.get_field(name)
+            values[name] = Case(
+                *[When(id=row[0], then=Value(row[n], output_field=field))
+                  for row in batch],
+                output_field=field)
+        model.objects.filter(id__in=[row[0] for row in batch]).update(
+            **values)
+
+
+def convert(apps, schema_editor):
+    """Parse the text columns into the typed columns."""
+
+    model = apps.get_model('trips', 'PointsOfInterest')
+
+    for rows in chunks(model, FIELDS):
+        converted = [
+            (poi_id, to_float(latitude), to_float(longitude),
+             to_float(elevation), to_time(time))
+            for (poi_id, latitude, longitude, elevation, time) in rows
+        ]
+        with transaction.atomic():
+            update(model, ['typed_' + field for field in FIELDS], [
+                row for row in converted
+                if any(value is not None for value in row[1:])])
+
+
+def convert_back(apps, schema_editor):
+    """Write the typed columns back into the text columns."""
+
+    model = apps.get_model('trips', 'PointsOfInterest')
+
+    for rows in chunks(model, ['typed_' + field for field in FIELDS]):
+        with transaction.atomic():
+            update(model, FIELDS, [
+                (row[0],) + tuple(to_text(value) for value in row[1:])
+                for row in rows])
+
+
+class Migration(migrations.Migration):
+
+    # Each chunk is committed as it is converted, rather than all of
+    # them in one transaction, so that a large table converts in
+    # bounded journal space.
+    atomic = False
+
+    dependencies = [
+        ('trips', '0014_poi_typed_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert, convert_back),
+    ]
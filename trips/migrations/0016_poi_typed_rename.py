@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Replace the text columns with the typed columns, and index them."""
+
+    dependencies = [
+        ('trips', '0015_poi_convert'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='pointsofinterest',
+            name=name,
+        )
+        for name in ('latitude', 'longitude', 'elevation', 'time')
+    ] + [
+        migrations.RenameField(
+            model_name='pointsofinterest',
+            old_name='typed_' + name,
+            new_name=name,
+        )
+        for name in ('latitude', 'longitude', 'elevation', 'time')
+    ] + [
+        migrations.AlterField(
+            model_name='pointsofinterest',
+            name='latitude',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='pointsofinterest',
+            name='longitude',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='pointsofinterest',
+            name='time',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+CHUNK = 2000  # Track and sheet pairs inserted at a time.
+
+
+def copy_sheets(apps, schema_editor):
+    """Relate tracks to the sheets listed in their text field."""
+
+    Track = apps.get_model('trips', 'Track')
+    Topo50 = apps.get_model('geolib', 'Topo50')
+    Through = Track.sheets.through
+
+    known = set(Topo50.objects.values_list('identifier', flat=True))
+    rows = []
+    tracks = Track.objects.filter(
+        sheet_text__isnull=False).values_list('id', 'sheet_text')
+    for (track_id, text) in tracks.iterator():
+        for identifier in sorted(set(text.split()) & known):
+            rows.append(Through(track_id=track_id, topo50_id=identifier))
+        if len(rows) >= CHUNK:
+            Through.objects.bulk_create(rows)
+            rows = []
+
+    Through.objects.bulk_create(rows)
+
+
+def copy_sheets_back(apps, schema_editor):
+    Track = apps.get_model('trips', 'Track')
+
+    for track in Track.objects.prefetch_related('sheets'):
+        track.sheet_text = ' '.join(
+            sorted(sheet.identifier for sheet in track.sheets.all()))
+        track.save(update_fields=['sheet_text'])
+
+
+class Migration(migrations.Migration):
+    """Relate tracks to Topo50 sheets, in place of a text field.
+
+    The text field is removed by 0019, in a migration of its own, so
+    that the table is not altered in the transaction that fills the
+    relation.
+    """
+
+    dependencies = [
+        ('geolib', '0002_placename'),
+        ('trips', '0017_route_geom'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='track',
+            old_name='sheets',
+            new_name='sheet_text',
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='sheets',
+            field=models.ManyToManyField(blank=True, related_name='tracks', to='geolib.Topo50'),
+        ),
+        migrations.RunPython(copy_sheets, copy_sheets_back),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0018_track_sheets'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='track',
+            name='sheet_text',
+        ),
+    ]
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+import hashlib
+import struct
+
+from django.db import migrations
+from django.utils import timezone
+
+EPOCH = datetime.datetime(1970, 1, 1)
+NO_TIME = -2 ** 63
+
+
+# trips.digest.feature_fingerprint, as it was when this migration was
+# written, over the points stored for a track or route.
+
+def normalise(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value, timezone.utc)
+        return value.isoformat()
+    if isinstance(value, float):
+        return '%.7f' % value
+
+    return '%s' % value
+
+
+def fingerprint(*values):
+    text = '\x1f'.join(normalise(value) for value in values)
+
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def feature_fingerprint(feature, points):
+    """Fingerprint from a feature and its (latitude, longitude, time)s."""
+
+    sha1 = hashlib.sha1()
+    count = 0
+    for (latitude, longitude, time) in points:
+        text = '%s\x1f%s\x1f%s\x1e' % (
+            normalise(latitude), normalise(longitude), normalise(time))
+        sha1.update(text.encode('utf-8'))
+        count += 1
+
+    return fingerprint(feature.name, feature.number, count, sha1.hexdigest())
+
+
+def packed_points(segment):
+    """Decode the points of a packed segment (see trips.packing)."""
+
+    coordinates = bytes(segment.coordinates or b'')
+    times = bytes(segment.times or b'')
+    count = len(coordinates) // 16
+
+    for n in range(count):
+        (longitude, latitude) = struct.unpack_from('<dd', coordinates, n * 16)
+        (microseconds,) = struct.unpack_from('<q', times, n * 8)
+        if microseconds == NO_TIME:
+            time = None
+        else:
+            time = EPOCH + datetime.timedelta(microseconds=microseconds)
+        yield (latitude, longitude, time)
+
+
+def track_points(apps, track):
+    TrackSegment = apps.get_model('trips', 'TrackSegment')
+    TrackPoint = apps.get_model('trips', 'TrackPoint')
+
+    for segment in TrackSegment.objects.filter(
+            track=track).order_by('ordinal').iterator():
+        if segment.storage == 'packed':
+            for point in packed_points(segment):
+                yield point
+            continue
+        rows = TrackPoint.objects.filter(segment=segment).order_by(
+            'ordinal').values_list('latitude', 'longitude', 'time')
+        for point in rows.iterator():
+            yield point
+
+
+def route_points(apps, route):
+    RoutePoint = apps.get_model('trips', 'RoutePoint')
+
+    return RoutePoint.objects.filter(route=route).order_by(
+        'ordinal').values_list('latitude', 'longitude', 'time').iterator()
+
+
+def compute_fingerprints(apps, schema_editor):
+    """Fingerprint existing tracks and routes by their points."""
+
+    for (name, points) in (
+            ('Track', track_points),
+            ('Route', route_points),
+    ):
+        model = apps.get_model('trips', name)
+        for record in model.objects.only('id', 'name', 'number').iterator():
+            model.objects.filter(id=record.id).update(
+                fingerprint=feature_fingerprint(record, points(apps, record)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0019_remove_track_sheet_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(compute_fingerprints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import shutil
+import stat
+
+from django.db import migrations
+
+import trips.settings as settings
+
+EXTENSIONS = {
+    '.gpx': 'gpx',
+    '.jpg': 'image',
+    '.jpeg': 'image',
+    '.png': 'image',
+    '.gif': 'image',
+    '.tif': 'image',
+    '.tiff': 'image',
+    '.pdf': 'document',
+    '.txt': 'document',
+    '.md': 'document',
+    '.html': 'document',
+}
+
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def filespace(trip):
+    """TripTemplate.filespace(), as it was when this was written."""
+
+    dirname = trip.name.replace(' ', '-').replace("'", "")
+    return os.path.join(
+        settings.STATICFILES_DIR, settings.BASE_FILESPACE, dirname)
+
+
+def digest_file(filepath, size=64 * 1024):
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(size), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def store_blob(filepath, digest):
+    """Copy a file into the blob store, unless it is there already.
+
+    The filespace file is left in place, rather than linked to the
+    blob, so that it may still be written to.
+    """
+
+    blob_path = os.path.join(
+        settings.STATICFILES_DIR, settings.BLOB_DIR, digest[:2], digest)
+    if os.path.exists(blob_path):
+        return
+
+    if not os.path.isdir(os.path.dirname(blob_path)):
+        os.makedirs(os.path.dirname(blob_path))
+    temporary = blob_path + '.tmp'
+    shutil.copyfile(filepath, temporary)
+    os.chmod(temporary, READ_ONLY)
+    os.rename(temporary, blob_path)
+
+
+def backfill(apps, schema_editor):
+    """List the files already in trip filespaces in their manifests.
+
+    Photos are left to the Photo model, as in reconcilefiles.
+    """
+
+    Trip = apps.get_model('trips', 'Trip')
+    Blob = apps.get_model('trips', 'Blob')
+    TripFile = apps.get_model('trips', 'TripFile')
+
+    for trip in Trip.objects.iterator():
+        directory = filespace(trip)
+        if not os.path.isdir(directory):
+            continue
+
+        listed = set(TripFile.objects.filter(
+            trip=trip).values_list('filename', flat=True))
+
+        for filename in sorted(os.listdir(directory)):
+            filepath = os.path.join(directory, filename)
+            extension = os.path.splitext(filename)[1].lower()
+            if (filename in listed or not os.path.isfile(filepath) or
+                    extension in settings.PHOTO_EXTENSIONS):
+                continue
+
+            digest = digest_file(filepath)
+            store_blob(filepath, digest)
+            status = os.stat(filepath)
+            (blob, created) = Blob.objects.get_or_create(
+                digest=digest, defaults={'size': status.st_size})
+            TripFile.objects.create(
+                trip=trip,
+                filename=filename,
+                blob=blob,
+                filetype=EXTENSIONS.get(extension, 'other'),
+                size=status.st_size,
+                mtime=status.st_mtime,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0020_content_fingerprints'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Sum
+
+import numpy
+
+import trips.settings as settings
+
+
+# trips.analytics.climb(), as it was when this migration was written.
+
+def smooth(elevations, window):
+    if len(elevations) < window or window < 2:
+        return elevations
+
+    half = window // 2
+    padded = numpy.concatenate(
+        (numpy.repeat(elevations[0], half), elevations,
+         numpy.repeat(elevations[-1], window - 1 - half)))
+
+    return numpy.convolve(padded, numpy.ones(window) / window, 'valid')
+
+
+def climb(elevations, window=None):
+    if window is None:
+        window = settings.ELEVATION_SMOOTHING
+
+    changes = numpy.diff(smooth(elevations, window))
+
+    return (
+        float(changes[changes > 0].sum()),
+        abs(float(changes[changes < 0].sum())),
+    )
+
+
+def segment_elevations(apps, segment):
+    """The known elevations of a segment's points, in order."""
+
+    if segment.storage == 'packed':
+        elevations = numpy.frombuffer(
+            bytes(segment.elevations or b''), dtype='<f8')
+        return elevations[~numpy.isnan(elevations)]
+
+    TrackPoint = apps.get_model('trips', 'TrackPoint')
+    rows = TrackPoint.objects.filter(
+        segment=segment,
+        longitude__isnull=False, latitude__isnull=False,
+        elevation__isnull=False,
+    ).order_by('ordinal').values_list('elevation', flat=True)
+
+    return numpy.array(list(rows.iterator()), dtype=float)
+
+
+def smoothed_climb(apps, schema_editor):
+    """Store the smoothed climb of segments and tracks, not the raw."""
+
+    Track = apps.get_model('trips', 'Track')
+    TrackSegment = apps.get_model('trips', 'TrackSegment')
+
+    segments = TrackSegment.objects.only('id', 'storage', 'elevations')
+    for segment in segments.iterator():
+        (gain, loss) = climb(segment_elevations(apps, segment))
+        TrackSegment.objects.filter(id=segment.id).update(
+            elevation_gain=gain, elevation_loss=loss)
+
+    for track in Track.objects.only('id').iterator():
+        totals = TrackSegment.objects.filter(track=track).aggregate(
+            gain=Sum('elevation_gain'), loss=Sum('elevation_loss'))
+        Track.objects.filter(id=track.id).update(
+            elevation_gain=totals['gain'] or 0.0,
+            elevation_loss=totals['loss'] or 0.0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0021_backfill_manifest'),
+    ]
+
+    operations = [
+        migrations.RunPython(smoothed_climb, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import shutil
+import stat
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import trips.settings as settings
+
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def base_dir():
+    return os.path.join(settings.STATICFILES_DIR, settings.BASE_FILESPACE)
+
+
+def named_dir(record):
+    """TripTemplate.filespace(), as it was named before this migration."""
+
+    return os.path.join(
+        base_dir(), record.name.replace(' ', '-').replace("'", ""))
+
+
+def id_dir(record):
+    """TripTemplate.filespace(), as it is named by this migration."""
+
+    return os.path.join(base_dir(), str(record.id))
+
+
+def records(apps):
+    for name in ('Trip', 'Template'):
+        for record in apps.get_model('trips', name).objects.iterator():
+            yield record
+
+
+def filespaces_by_id(apps, schema_editor):
+    """Move filespaces from directories named by name to ones by id.
+
+    A directory shared by records of the same name is copied to each,
+    and then removed.
+    """
+
+    sharing = {}
+    for record in records(apps):
+        sharing.setdefault(named_dir(record), []).append(record)
+
+    for (directory, group) in sharing.items():
+        if not os.path.isdir(directory):
+            continue
+        if len(group) == 1:
+            if not os.path.exists(id_dir(group[0])):
+                os.rename(directory, id_dir(group[0]))
+            continue
+        for record in group:
+            if not os.path.exists(id_dir(record)):
+                shutil.copytree(directory, id_dir(record))
+        shutil.rmtree(directory)
+
+
+def filespaces_by_name(apps, schema_editor):
+    for record in records(apps):
+        if (os.path.isdir(id_dir(record)) and
+                not os.path.exists(named_dir(record))):
+            os.rename(id_dir(record), named_dir(record))
+
+
+def digest_file(filepath, size=64 * 1024):
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(size), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def store_blob(filepath, digest):
+    """Copy a file into the blob store, unless it is there already."""
+
+    blob_path = os.path.join(
+        settings.STATICFILES_DIR, settings.BLOB_DIR, digest[:2], digest)
+    if os.path.exists(blob_path):
+        return
+
+    if not os.path.isdir(os.path.dirname(blob_path)):
+        os.makedirs(os.path.dirname(blob_path))
+    temporary = blob_path + '.tmp'
+    shutil.copyfile(filepath, temporary)
+    os.chmod(temporary, READ_ONLY)
+    os.rename(temporary, blob_path)
+
+
+def list_photos(apps, schema_editor):
+    """List photos in their trips' manifests, as receive() now does."""
+
+    Photo = apps.get_model('trips', 'Photo')
+    Blob = apps.get_model('trips', 'Blob')
+    TripFile = apps.get_model('trips', 'TripFile')
+
+    photos = Photo.objects.filter(tripfile__isnull=True).select_related(
+        'trip')
+    for photo in photos.iterator():
+        filepath = os.path.join(id_dir(photo.trip), photo.filename)
+        if not os.path.isfile(filepath):
+            continue
+
+        digest = digest_file(filepath)
+        store_blob(filepath, digest)
+        status = os.stat(filepath)
+        (blob, created) = Blob.objects.get_or_create(
+            digest=digest, defaults={'size': status.st_size})
+        (tripfile, created) = TripFile.objects.update_or_create(
+            trip=photo.trip, filename=photo.filename,
+            defaults={
+                'blob': blob,
+                'filetype': 'image',
+                'size': status.st_size,
+                'mtime': status.st_mtime,
+            },
+        )
+        Photo.objects.filter(id=photo.id).update(tripfile=tripfile)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0022_smoothed_climb'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='tripfile',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='photos', to='trips.TripFile'),
+        ),
+        migrations.RunPython(filespaces_by_id, filespaces_by_name),
+        migrations.RunPython(list_photos, migrations.RunPython.noop),
+    ]
@@ -3,14 +3,35 @@ from __future__ import unicode_literals
 
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import Point, LineString, MultiLineString
+from django.db import connections, transaction
+from django.db.models import F, Max, Min, Q
+from django.db.models.functions import Substr
+from django.utils import timezone
 from django.utils.timezone import make_aware
 
+import collections
+import contextlib
+import datetime
 import gpxpy
+import itertools
+import math
+import numpy
 import os
+import pickle
+import traceback
 import uuid
 
-import webnote
-
+from geolib.index import sheet_index
+from geolib.models import Topo50
+from trips.analytics import TrackStatistics
+import trips.analytics as analytics
+import trips.blobstore as blobstore
+from trips.digest import feature_fingerprint, waypoint_fingerprint
+from trips.gpxstream import GPXStream
+import trips.packing as packing
+import trips.photos as photos
+import trips.routing as routing
+import trips.tiles as tiles
 import trips.settings as settings
 
 MODE = (
@@ -91,47 +112,49 @@ class TripTemplate(models.Model):
     def waypoints(self):
         return Waypoint.objects.filter(trip=self)
 
-    def directory(self):
-        """Return a webnote.Directory object of the filespace."""
-
-        filespace = self.filespace()
-        if not os.path.isdir(filespace):
-            self.make_filespace()
-        directory = webnote.Directory(filespace)
-
-        return directory
-
     def gpxfiles(self):
         """A list of parsed gpx file objects."""
 
         gpxfiles = []
-        for gpxfile in self.directory().model['gpx']:
+        if not os.path.isdir(self.filespace()):
+            return gpxfiles
+
+        for gpxfile in sorted(os.listdir(self.filespace())):
             filepath = os.path.join(self.filespace(), gpxfile)
-            if os.path.isfile(filepath):
-                f = open(filepath)
-                gpxf = GPXFile(f, self)
-                gpxfiles.append(gpxf.analyse())
+            if (TripFile.filetype_of(gpxfile) == 'gpx' and
+                    os.path.isfile(filepath)):
+                gpxfiles.append(analysis_cache.analyse(filepath, self))
 
         return gpxfiles
 
+    def file_digests(self):
+        """A dictionary of content digests of stored files, by filename."""
+
+        return {}
+
+    def store_file(self, filename, upload):
+        """Write an uploaded file to filespace."""
+
+        filepath = os.path.join(self.filespace(), filename)
+
+        with open(filepath, 'wb+') as destination:
+            for chunk in upload.chunks():
+                destination.write(chunk)
+
+        analysis_cache.invalidate(filepath)
+
     def save(self, files=None, *args, **kwargs):
         """Save any uploaded file to filespace."""
 
         if not os.path.isdir(self.filespace()):
             self.make_filespace()
 
+        super(TripTemplate, self).save(*args, **kwargs)
+
         if files:
             for item in files:
-
                 f = files[item]
-                filepath = os.path.join(
-                    self.filespace(), str(f))
-
-                with open(filepath, 'wb+') as destination:
-                    for chunk in f.chunks():
-                        destination.write(chunk)
-
-        super(TripTemplate, self).save(*args, **kwargs)
+                self.store_file(str(f), f)
 
     def identifier(self):
         """The first eight characters of the uuid, chopped by hyphen."""
@@ -139,15 +162,20 @@ class TripTemplate(models.Model):
         uri_steps = str(self.id).split('-')
         return uri_steps[0]
 
+    def slug(self):
+        """The name, made fit for the filenames of downloads."""
+
+        return self.name.replace(' ', '-').replace("'", "")
+
     def filespace(self):
         """Return a string pathname to this object's filespace in static files.
-        """
 
-        dirname = self.name.replace(' ', '-').replace("'", "")
-        #dirname = dirname + '_' + self.identifier()
+        The directory is named by id, so that a trip or template keeps
+        its files when renamed.
+        """
 
         filepath = os.path.join(
-            settings.STATICFILES_DIR, settings.BASE_FILESPACE, dirname
+            settings.STATICFILES_DIR, settings.BASE_FILESPACE, str(self.id)
         )
 
         return filepath
@@ -215,6 +243,40 @@ class Trip(TripTemplate):
     start_date_actual = models.DateField(blank=True, null=True)
     end_date_actual = models.DateField(blank=True, null=True)
 
+    def gpxfiles(self):
+        """A list of parsed gpx file objects, from the file manifest."""
+
+        gpxfiles = []
+        tripfiles = self.files.filter(filetype='gpx').order_by('filename')
+        for tripfile in tripfiles:
+            tripfile.trip = self
+            gpxfiles.append(tripfile.analysis())
+
+        return gpxfiles
+
+    def file_digests(self):
+        return TripFile.digests(self)
+
+    def store_file(self, filename, upload):
+        """Store an uploaded file as a blob, listed in the trip's manifest.
+        """
+
+        TripFile.store(self, filename, upload.chunks())
+
+    def sheets(self):
+        """Topo50 sheets crossed by the trip's tracks or holding its waypoints.
+
+        These are recorded as data is injected, so no spatial queries
+        are made here.
+        """
+
+        waypoint_sheets = self.waypoint_set.filter(
+            sheet__isnull=False).values('sheet')
+
+        return Topo50.objects.filter(
+            Q(tracks__trip=self) | Q(identifier__in=waypoint_sheets)
+        ).distinct().order_by('identifier')
+
 
 class TripNote(models.Model):
     """Simple text notes attached to a trip record."""
@@ -244,22 +306,22 @@ class PointsOfInterest(models.Model):
     comment = models.TextField(blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     dgps_id = models.TextField(blank=True, null=True)
-    elevation = models.TextField(blank=True, null=True)
+    elevation = models.FloatField(blank=True, null=True)
     extensions = models.TextField(blank=True, null=True)
     geoid_height = models.TextField(blank=True, null=True)
     horizontal_dilution = models.TextField(blank=True, null=True)
-    latitude = models.TextField(blank=True, null=True)
+    latitude = models.FloatField(blank=True, null=True, db_index=True)
     link = models.TextField(blank=True, null=True)
     link_text = models.TextField(blank=True, null=True)
     link_type = models.TextField(blank=True, null=True)
-    longitude = models.TextField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True, db_index=True)
     magnetic_variation = models.TextField(blank=True, null=True)
     name = models.TextField(blank=True, null=True)
     position_dilution = models.TextField(blank=True, null=True)
     satellites = models.TextField(blank=True, null=True)
     source = models.TextField(blank=True, null=True)
     symbol = models.TextField(blank=True, null=True)
-    time = models.TextField(blank=True, null=True)
+    time = models.DateTimeField(blank=True, null=True, db_index=True)
     gtype = models.TextField(blank=True, null=True)
     type_of_gpx_fix = models.TextField(blank=True, null=True)
     vertical_dilution = models.TextField(blank=True, null=True)
@@ -275,6 +337,43 @@ class PointsOfInterest(models.Model):
     def __unicode__(self):
         return self.name
 
+    @classmethod
+    def from_places(cls, places, trip=None, template=None):
+        """Create points of interest from geolib PlaceName records.
+
+        The new points are attached to the trip or template given.
+        Return a list of the saved PointsOfInterest.
+        """
+
+        pois = []
+        for place in places:
+            poi = cls(
+                name=place.name,
+                latitude=place.latitude,
+                longitude=place.longitude,
+                gtype=place.feature_type,
+                source='LINZ Gazetteer',
+                provenance='linz:%s' % place.identifier,
+                geom=place.geom,
+            )
+            poi.save()
+            pois.append(poi)
+
+        if trip:
+            cls.trips.through.objects.bulk_create([
+                cls.trips.through(pointsofinterest_id=poi.id, trip_id=trip.id)
+                for poi in pois
+            ])
+            tiles.invalidate(trip)
+        if template:
+            cls.template.through.objects.bulk_create([
+                cls.template.through(
+                    pointsofinterest_id=poi.id, template_id=template.id)
+                for poi in pois
+            ])
+
+        return pois
+
 
 class Route(models.Model):
     """Outgoing linear features.
@@ -295,6 +394,8 @@ class Route(models.Model):
     number = models.TextField(blank=True, null=True)
     points = models.TextField(blank=True, null=True)
     source = models.TextField(blank=True, null=True)
+    fingerprint = models.CharField(
+        max_length=40, blank=True, null=True, db_index=True)
 
     owner = models.CharField(max_length=255, blank=True, null=True)
     group = models.CharField(max_length=255, blank=True, null=True)
@@ -302,6 +403,7 @@ class Route(models.Model):
     provenance = models.CharField(max_length=255, blank=True, null=True)
     created = models.DateTimeField(auto_now_add=True, editable=False)
 
+    geom = models.LineStringField(srid=SRID['WGS84'], blank=True, null=True)
 
     def __unicode__(self):
         return self.name
@@ -310,11 +412,32 @@ class Route(models.Model):
         """Create RoutePoint objects from the line geometry of this route.
 
         Return a list of RoutePoint model objects. If commit is set to
-        False, these will be unsaved objects.
+        False, these will be unsaved objects. Otherwise they replace
+        any points the route had, and are inserted in batches.
 
         """
 
         points = []
+        if self.geom is None:
+            return points
+
+        for (ordinal, coords) in enumerate(self.geom.coords):
+            (longitude, latitude) = coords[:2]
+            points.append(RoutePoint(
+                route=self,
+                name='RP%03d' % (ordinal + 1),
+                ordinal=ordinal,
+                longitude=longitude,
+                latitude=latitude,
+                geom=Point(longitude, latitude, srid=SRID['WGS84']),
+            ))
+
+        if commit:
+            with transaction.atomic():
+                RoutePoint.objects.filter(route=self).delete()
+                RoutePoint.objects.bulk_create(
+                    points, batch_size=settings.INJECT_BATCH_SIZE)
+
         return points
 
 
@@ -358,7 +481,43 @@ class RoutePoint(models.Model):
         return self.name
 
 
-class Track(models.Model):
+class TrackSummary(models.Model):
+    """Statistics stored with tracks and track segments.
+
+    These are computed as points are injected, and adjusted when
+    points are saved or deleted (see TrackSegment.changing), so that
+    listings need not count or scan points.
+    """
+
+    STATISTICS = [
+        'point_count', 'length', 'xmin', 'xmax', 'ymin', 'ymax',
+        'start_time', 'end_time', 'elevation_gain', 'elevation_loss',
+    ]
+
+    point_count = models.IntegerField(default=0)
+    length = models.FloatField(default=0)    # metres
+    xmin = models.FloatField(blank=True, null=True)
+    xmax = models.FloatField(blank=True, null=True)
+    ymin = models.FloatField(blank=True, null=True)
+    ymax = models.FloatField(blank=True, null=True)
+    start_time = models.DateTimeField(blank=True, null=True)
+    end_time = models.DateTimeField(blank=True, null=True)
+    elevation_gain = models.FloatField(default=0)
+    elevation_loss = models.FloatField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def set_fields(self, fields):
+        """Set and store a dictionary of values, without saving other fields.
+        """
+
+        for (field, value) in fields.items():
+            setattr(self, field, value)
+        type(self).objects.filter(id=self.id).update(**fields)
+
+
+class Track(TrackSummary):
     """Incoming linear features.
 
     A track may only belong to one trip record. The field names are
@@ -380,6 +539,8 @@ class Track(models.Model):
     name = models.TextField(blank=True, null=True)
     number = models.TextField(blank=True, null=True)
     source = models.TextField(blank=True, null=True)
+    fingerprint = models.CharField(
+        max_length=40, blank=True, null=True, db_index=True)
 
     owner = models.CharField(max_length=255, blank=True, null=True)
     group = models.CharField(max_length=255, blank=True, null=True)
@@ -387,6 +548,11 @@ class Track(models.Model):
     provenance = models.CharField(max_length=255, blank=True, null=True)
     created = models.DateTimeField(auto_now_add=True, editable=False)
 
+    segment_count = models.IntegerField(default=0)
+
+    # Topo50 sheets crossed, found as the track is injected.
+    sheets = models.ManyToManyField(Topo50, related_name='tracks', blank=True)
+
     geom = models.MultiLineStringField(
         srid=SRID['WGS84'], blank=True, null=True
     )
@@ -399,29 +565,220 @@ class Track(models.Model):
 
     url = property(__get_absolute_url__)
 
-    def convert_to_route(self):
+    def convert_to_route(self, budget=None, tolerance=None):
         """Return an unsaved Route object made of the points from this track.
 
-        No point objects, just a line geometry, and metadata.
+        No point objects, just a line geometry, and metadata. The
+        points of all segments are joined, and simplified to at most
+        budget points (see trips.routing.simplify).
         """
 
-        return None
+        columns = [[], []]
+        for segment in self.segments().order_by('ordinal'):
+            (longitudes, latitudes) = analytics.segment_arrays(segment)[:2]
+            columns[0].append(longitudes)
+            columns[1].append(latitudes)
+        if not columns[0]:
+            return None
+
+        (longitudes, latitudes) = [
+            numpy.concatenate(column) for column in columns]
+        if len(longitudes) < 2:
+            return None
+
+        keep = routing.simplify(longitudes, latitudes, budget, tolerance)
+
+        return Route(
+            name=self.name,
+            comment=self.comment,
+            description=self.description,
+            link=self.link,
+            link_text=self.link_text,
+            link_type=self.link_type,
+            source=self.source,
+            provenance='track:%d' % self.id,
+            geom=LineString(
+                list(zip(longitudes[keep].tolist(),
+                         latitudes[keep].tolist())),
+                srid=SRID['WGS84']),
+        )
 
     def pointcount(self):
-        pointcount = 0
-        for seg in self.tracksegment_set.all():
-            pointcount += seg.pointcount()
-
-        return pointcount
+        return self.point_count
 
     def segcount(self):
-        return TrackSegment.objects.filter(track=self).count()
+        return self.segment_count
 
     def segments(self):
         return TrackSegment.objects.filter(track=self)
 
+    def point_page(self, after=None, limit=None):
+        """Return a page of points, and the cursor of the next page.
+
+        Points are tuples of TrackPoint.PAGE_FIELDS, in segment then
+        ordinal order; packed points have no id. A page starts after
+        the (segment, ordinal) cursor given, and is found by key
+        rather than offset, so that every page costs the same however
+        far into the track it is. The next cursor is None on the last
+        page.
+        """
+
+        limit = limit or settings.POINT_PAGE_SIZE
+        (segment_id, ordinal) = after or (0, -1)
+        page = []
+
+        segments = self.segments().filter(
+            id__gte=segment_id).order_by('id').only('id', 'storage')
+        for segment in segments:
+            start = ordinal if segment.id == segment_id else -1
+            wanted = limit + 1 - len(page)  # One more tells of a next page.
+
+            if segment.storage == 'packed':
+                page.extend(
+                    (None, segment.id, point.ordinal, point.time,
+                     point.latitude, point.longitude, point.elevation)
+                    for point in segment.packed_run(start + 1, wanted)
+                )
+            else:
+                page.extend(TrackPoint.objects.filter(
+                    segment=segment, ordinal__gt=start,
+                ).order_by('ordinal').values_list(
+                    *TrackPoint.PAGE_FIELDS)[:wanted])
+
+            if len(page) > limit:
+                page = page[:limit]
+                return (page, (page[-1][1], page[-1][2]))
+
+        return (page, None)
+
+    def build_levels(self):
+        """Store simplified copies of the geometry, one per zoom level.
+
+        Levels are built for each zoom in settings.TRACK_LEVELS, with
+        Douglas-Peucker simplification to a tolerance of one 256 pixel
+        web map tile pixel at that zoom.
+        """
+
+        TrackLevel.objects.filter(track=self).delete()
+        if not self.geom:
+            return
+
+        levels = []
+        for zoom in settings.TRACK_LEVELS:
+            tolerance = 360.0 / (256 * 2 ** zoom)
+            simple = self.geom.simplify(tolerance)
+
+            if simple.geom_type == 'LineString':
+                lines = [simple]
+            else:
+                lines = [line for line in simple]
+            lines = [line for line in lines if line.num_points > 1]
+            if not lines:
+                continue
+
+            levels.append(TrackLevel(
+                track=self,
+                zoom=zoom,
+                tolerance=tolerance,
+                point_count=sum(line.num_points for line in lines),
+                geom=MultiLineString(lines, srid=SRID['WGS84']),
+            ))
+
+        TrackLevel.objects.bulk_create(levels)
+        tiles.invalidate(self.trip)
+
+    def geometry(self, zoom=None):
+        """Return the geometry to draw at a web map zoom level.
+
+        This is the coarsest stored level at or above the given zoom,
+        or the full geometry if there is none, or no zoom is given.
+        """
+
+        if zoom is None:
+            return self.geom
+
+        level = TrackLevel.objects.filter(
+            track=self, zoom__gte=zoom).order_by('zoom').first()
+        if level:
+            return level.geom
+
+        return self.geom
+
+    def stats(self):
+        """Distance, speeds, moving time and climb, from the points.
+
+        See trips.analytics.combine() for the keys of the dictionary
+        returned.
+        """
+
+        return analytics.combine(
+            analytics.segment_stats(*analytics.segment_arrays(segment))
+            for segment in self.segments().order_by('ordinal')
+        )
+
+    def update_sheets(self, index=None):
+        """Recompute the Topo50 sheets crossed, from segment geometries.
+
+        Give the sheet index when updating many tracks, to fetch it
+        once.
+        """
+
+        if index is None:
+            index = sheet_index(Topo50)
+        sheets = set()
+        for segment in self.segments().only('geom'):
+            sheets.update(index.crossing(segment.geom))
+
+        self.sheets.set(sorted(sheets))
+
+    def update_statistics(self):
+        """Recompute stored statistics from those of the segments."""
+
+        stats = TrackStatistics()
+        segments = TrackSegment.objects.filter(
+            track=self).order_by('ordinal').values(*self.STATISTICS)
+
+        segment_count = 0
+        for segment in segments:
+            stats.merge(segment)
+            segment_count += 1
+
+        fields = stats.fields()
+        fields['segment_count'] = segment_count
+        self.set_fields(fields)
+
+
+class TrackLevel(models.Model):
+    """A simplified copy of a track's geometry, for small scale maps."""
+
+    track = models.ForeignKey(Track, related_name='levels')
+    zoom = models.IntegerField()
+    tolerance = models.FloatField()    # degrees
+    point_count = models.IntegerField(default=0)
+
+    geom = models.MultiLineStringField(srid=SRID['WGS84'])
+
+    class Meta():
+        ordering = ['track', 'zoom']
+        unique_together = ('track', 'zoom')
+
+    def __unicode__(self):
+        return str(self.track) + " | zoom " + str(self.zoom)
+
+
+class TrackSegment(TrackSummary):
+    """A continuous run of points within a track.
+
+    Points are stored either as TrackPoint rows, or packed into
+    array columns (see trips.packing). The points() method returns
+    point-like objects in either case.
+    """
+
+    STORAGE = (
+        ('rows', 'rows'),
+        ('packed', 'packed'),
+    )
 
-class TrackSegment(models.Model):
     track = models.ForeignKey(Track)
     extensions = models.TextField(blank=True, null=True)
 
@@ -430,17 +787,178 @@ class TrackSegment(models.Model):
     created = models.DateTimeField(auto_now_add=True, editable=False)
     ordinal = models.IntegerField(default=0)
 
+    storage = models.CharField(
+        max_length=64, choices=STORAGE, default='rows')
+    coordinates = models.BinaryField(blank=True, null=True)
+    elevations = models.BinaryField(blank=True, null=True)
+    times = models.BinaryField(blank=True, null=True)
+
     geom = models.LineStringField(srid=SRID['WGS84'], blank=True, null=True)
 
     def __unicode__(self):
         return str(self.track) + " | seg " + str(self.id)
 
+    def delete(self, *args, **kwargs):
+        result = super(TrackSegment, self).delete(*args, **kwargs)
+        self.track.update_statistics()
+        return result
+
     def pointcount(self):
-        return TrackPoint.objects.filter(segment=self).count()
+        return self.point_count
 
     def points(self):
+        if self.storage == 'packed':
+            return self.packed_points()
         return TrackPoint.objects.filter(segment=self)
 
+    def packed_points(self):
+        """Return the PackedPoints of a packed segment, decoded once."""
+
+        if getattr(self, '_packed_points', None) is None:
+            self._packed_points = packing.PackedPoints(self)
+        return self._packed_points
+
+    def packed_run(self, start, count):
+        """Return PackedPoints of up to count points from ordinal start.
+
+        Only the bytes of those points are read from the packed
+        columns, so a page of a long segment costs no more than one
+        of a short segment.
+        """
+
+        runs = dict(
+            ('%s_run' % name, Substr(
+                name, start * size + 1, count * size,
+                output_field=models.BinaryField()))
+            for (name, size) in packing.COLUMNS)
+        row = TrackSegment.objects.filter(id=self.id).annotate(
+            **runs).values(*runs).get()
+
+        return packing.PackedPoints(self, columns=dict(
+            (name, row['%s_run' % name]) for (name, size) in packing.COLUMNS
+        ), start=start)
+
+    def pack(self):
+        """Move this segment's TrackPoint rows into packed array columns."""
+
+        points = TrackPoint.objects.filter(segment=self).order_by(
+            'ordinal').values_list(
+                'longitude', 'latitude', 'elevation', 'time')
+        columns = list(zip(*points.iterator())) or [(), (), (), ()]
+
+        with transaction.atomic():
+            self.set_fields(packing.pack(*columns))
+            TrackPoint.objects.filter(segment=self).delete()
+
+        self._packed_points = None
+
+    def update_statistics(self):
+        """Recompute stored statistics from the points of this segment."""
+
+        if self.storage != 'packed':
+            self.set_fields(self.range_statistics())
+            return
+
+        stats = TrackStatistics()
+        for point in self.packed_points():
+            stats.add(
+                point.longitude, point.latitude, point.elevation, point.time)
+
+        self.set_fields(stats.fields())
+
+    def located_points(self):
+        """The TrackPoint rows of this segment which count in statistics.
+        """
+
+        return TrackPoint.objects.filter(
+            segment=self, longitude__isnull=False, latitude__isnull=False)
+
+    def range_statistics(self, first=None, last=None):
+        """Statistics of the points with ordinals from first to last."""
+
+        points = self.located_points()
+        if first is not None:
+            points = points.filter(ordinal__gte=first)
+        if last is not None:
+            points = points.filter(ordinal__lte=last)
+
+        stats = TrackStatistics()
+        rows = points.order_by('ordinal', 'id').values_list(
+            'longitude', 'latitude', 'elevation', 'time')
+        for (longitude, latitude, elevation, time) in rows.iterator():
+            stats.add(longitude, latitude, elevation, time)
+
+        return stats.fields()
+
+    def neighbourhood(self, ordinal):
+        """Return the (first, last) ordinals of the points about ordinal.
+
+        These take in enough points with elevations, either side, for
+        the smoothing window of the climb (see trips.analytics.Climb),
+        so that a change at ordinal alters no statistics of the points
+        outside them. Either is None if it would pass the end.
+        """
+
+        context = settings.ELEVATION_SMOOTHING + 1
+        points = self.located_points().filter(elevation__isnull=False)
+
+        first = list(points.filter(ordinal__lt=ordinal).order_by(
+            '-ordinal').values_list('ordinal', flat=True)[
+                context - 1:context])
+        last = list(points.filter(ordinal__gt=ordinal).order_by(
+            'ordinal').values_list('ordinal', flat=True)[
+                context - 1:context])
+
+        return (first[0] if first else None, last[0] if last else None)
+
+    @contextlib.contextmanager
+    def changing(self, ordinal):
+        """Update stored statistics for a change to the point at ordinal.
+
+        Only the points about it are read, before and after the change
+        made in the with block, and the difference is applied to the
+        stored totals. The extent and times are found again by the
+        database only if the point was at one of their bounds.
+        """
+
+        with transaction.atomic():
+            (first, last) = self.neighbourhood(ordinal)
+            before = self.range_statistics(first, last)
+
+            yield
+
+            after = self.range_statistics(first, last)
+            stored = TrackSegment.objects.filter(id=self.id).values(
+                *self.STATISTICS).get()
+
+            fields = {}
+            for key in ('point_count', 'length',
+                        'elevation_gain', 'elevation_loss'):
+                fields[key] = stored[key] + after[key] - before[key]
+
+            for (key, bound) in (
+                    ('xmin', min), ('xmax', max),
+                    ('ymin', min), ('ymax', max),
+                    ('start_time', min), ('end_time', max),
+            ):
+                values = [
+                    value for value in (stored[key], after[key])
+                    if value is not None]
+                fields[key] = bound(values) if values else None
+                if (stored[key] is not None and
+                        before[key] == stored[key] and
+                        fields[key] != after[key]):
+                    # The bound may have gone with the changed point.
+                    fields.update(self.located_points().aggregate(
+                        xmin=Min('longitude'), xmax=Max('longitude'),
+                        ymin=Min('latitude'), ymax=Max('latitude'),
+                        start_time=Min('time'), end_time=Max('time'),
+                    ))
+                    break
+
+            self.set_fields(fields)
+
+
 class TrackPoint(models.Model):
     """Incoming gps points associated with a track."""
 
@@ -479,8 +997,14 @@ class TrackPoint(models.Model):
 
     geom = models.PointField(srid=SRID['WGS84'])
 
+    PAGE_FIELDS = (
+        'id', 'segment', 'ordinal', 'time', 'latitude', 'longitude',
+        'elevation',
+    )
+
     class Meta():
         ordering = ['segment', 'ordinal',]
+        index_together = [['segment', 'ordinal']]
 
 
 
@@ -490,6 +1014,50 @@ class TrackPoint(models.Model):
 
         return str(self.segment) + " | point " + str(self.ordinal)
 
+    def save(self, *args, **kwargs):
+        """Save, and update the statistics of the segment and track.
+
+        Pass statistics=False when saving many points, and call
+        update_statistics() on the segment and track afterwards.
+        """
+
+        if not kwargs.pop('statistics', True):
+            return super(TrackPoint, self).save(*args, **kwargs)
+
+        stored = None
+        if self.pk is not None:
+            stored = TrackPoint.objects.filter(pk=self.pk).values(
+                'segment_id', 'ordinal').first()
+
+        if stored and (stored['segment_id'], stored['ordinal']) != (
+                self.segment_id, self.ordinal):
+            # Moved, so recount both segments in full.
+            super(TrackPoint, self).save(*args, **kwargs)
+            for segment in TrackSegment.objects.filter(id__in=set(
+                    [stored['segment_id'], self.segment_id])):
+                segment.update_statistics()
+                segment.track.update_statistics()
+            return
+
+        with self.segment.changing(self.ordinal):
+            super(TrackPoint, self).save(*args, **kwargs)
+        self.segment.track.update_statistics()
+
+    def delete(self, *args, **kwargs):
+        """Delete, and update the statistics of the segment and track.
+
+        Pass statistics=False as for save().
+        """
+
+        if not kwargs.pop('statistics', True):
+            return super(TrackPoint, self).delete(*args, **kwargs)
+
+        with self.segment.changing(self.ordinal):
+            result = super(TrackPoint, self).delete(*args, **kwargs)
+        self.segment.track.update_statistics()
+
+        return result
+
 
 class TripReport(models.Model):
     """A trip report records written and photographic reports of a trip.
@@ -544,6 +1112,10 @@ class Waypoint(models.Model):
     gtype = models.TextField(blank=True, null=True)
     type_of_gpx_fix = models.TextField(blank=True, null=True)
     vertical_dilution = models.TextField(blank=True, null=True)
+    fingerprint = models.CharField(
+        max_length=40, blank=True, null=True, db_index=True)
+    sheet = models.CharField(
+        max_length=4, blank=True, null=True, db_index=True)  # Topo50
 
     owner = models.CharField(max_length=255, blank=True, null=True)
     group = models.CharField(max_length=255, blank=True, null=True)
@@ -562,6 +1134,813 @@ class Waypoint(models.Model):
     url = property(__get_absolute_url__)
 
 
+class Photo(models.Model):
+    """A photograph in a trip's filespace.
+
+    Uploaded photos are stored as blobs, listed in the trip's file
+    manifest, by receive() and queued for ingestion, which reads their
+    EXIF data and makes thumbnails out of band (see the runphotos
+    management command). Photos copied straight into the filespace
+    are listed and ingested by scan(). A photo's file is found from
+    its manifest entry.
+
+    Ingested photos are located on the trip's tracks by locate(), and
+    their positions written into their EXIF data by geotag(). See
+    trips.photos.
+    """
+
+    URL = 'photo/'
+
+    STATUS = (
+        ('queued', 'queued'),
+        ('processing', 'processing'),
+        ('new', 'new'),
+        ('located', 'located'),
+        ('unlocated', 'unlocated'),
+        ('tagged', 'tagged'),
+        ('failed', 'failed'),
+    )
+
+    trip = models.ForeignKey(Trip, related_name='photos')
+    filename = models.CharField(max_length=255)
+    tripfile = models.ForeignKey(
+        'TripFile', blank=True, null=True, on_delete=models.SET_NULL,
+        related_name='photos')
+    digest = models.CharField(
+        max_length=40, blank=True, null=True, db_index=True)  # SHA-1
+    width = models.IntegerField(blank=True, null=True)
+    height = models.IntegerField(blank=True, null=True)
+
+    camera_time = models.DateTimeField(blank=True, null=True)
+    offset = models.FloatField(default=0)  # Seconds added to camera time.
+    time = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    elevation = models.FloatField(blank=True, null=True)
+
+    status = models.CharField(
+        max_length=64, choices=STATUS, default='new', db_index=True)
+    error = models.TextField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    geom = models.PointField(srid=SRID['WGS84'], blank=True, null=True)
+
+    class Meta:
+        unique_together = ('trip', 'filename')
+
+    def __unicode__(self):
+        return self.filename
+
+    def __get_absolute_url__(self):
+        return os.path.join(settings.BASE_URL, self.URL, str(self.id))
+
+    url = property(__get_absolute_url__)
+
+    def filepath(self):
+        """The path of the photo, from its entry in the trip's manifest."""
+
+        if self.tripfile_id:
+            return self.tripfile.path()
+        return os.path.join(self.trip.filespace(), self.filename)
+
+    def thumbnail(self, size=None):
+        """The url of a thumbnail, by default the smallest."""
+
+        if not self.digest:
+            return None
+        return photos.thumbnail_url(
+            self.digest, size or min(settings.PHOTO_THUMBNAIL_SIZES))
+
+    def ingested(self, fields):
+        """Set the fields returned by trips.photos.ingest()."""
+
+        for (name, value) in fields.items():
+            setattr(self, name, value)
+        self.time = self.camera_time
+        if self.camera_time is None:
+            self.status = 'unlocated'
+        else:
+            self.status = 'new'
+
+    @classmethod
+    def receive(cls, trip, uploads):
+        """Store uploaded photos as blobs in the manifest, and queue them.
+
+        Content already in the blob store is not stored again. Nothing
+        is read from the images here, so the time taken is that of
+        writing them out. Return the list of Photo records.
+        """
+
+        tripfiles = {}
+        for upload in uploads:
+            filename = os.path.basename(upload.name)
+            tripfiles[filename] = TripFile.store(
+                trip, filename, upload.chunks())
+
+        known = set(cls.objects.filter(
+            trip=trip, filename__in=list(tripfiles)).values_list(
+                'filename', flat=True))
+        for filename in known:
+            cls.objects.filter(trip=trip, filename=filename).update(
+                tripfile=tripfiles[filename], status='queued', error=None,
+                updated=timezone.now())
+
+        cls.objects.bulk_create([
+            cls(trip=trip, filename=filename, tripfile=tripfiles[filename],
+                status='queued')
+            for filename in sorted(set(tripfiles) - known)
+        ])
+
+        return list(cls.objects.filter(
+            trip=trip, filename__in=list(tripfiles)))
+
+    @classmethod
+    def claim(cls, limit):
+        """Mark up to limit queued photos as processing, and return them.
+
+        As with Job.claim(), a photo is only claimed if it is still
+        queued when the update is made. The claims are made together,
+        so that if the database is locked part way, none are left
+        processing without a worker.
+        """
+
+        claimed = []
+        queued = cls.objects.filter(status='queued').order_by(
+            'id').values_list('id', flat=True)[:limit]
+
+        with transaction.atomic():
+            for photo_id in list(queued):
+                count = cls.objects.filter(
+                    id=photo_id, status='queued').update(
+                        status='processing', updated=timezone.now())
+                if count:
+                    claimed.append(photo_id)
+
+        return claimed
+
+    @classmethod
+    def requeue_stale(cls):
+        """Return photos whose worker has stopped responding to the queue."""
+
+        cutoff = timezone.now() - datetime.timedelta(
+            seconds=settings.JOB_TIMEOUT)
+        cls.objects.filter(status='processing', updated__lt=cutoff).update(
+            status='queued')
+
+    @classmethod
+    def process(cls, photo_ids):
+        """Ingest claimed photos, one after another."""
+
+        records = cls.objects.filter(
+            id__in=photo_ids).select_related('trip', 'tripfile__trip')
+        for record in records:
+            (filepath, fields) = photos.ingest(record.filepath())
+            record.ingested(fields)
+            record.save()
+
+    @classmethod
+    def scan(cls, trip, processes=None):
+        """Register and ingest new photos in a trip's filespace.
+
+        Each is stored as a blob and listed in the trip's manifest.
+        Return the list of new Photo records.
+        """
+
+        filespace = trip.filespace()
+        known = set(cls.objects.filter(trip=trip).values_list(
+            'filename', flat=True))
+        filepaths = [
+            os.path.join(filespace, filename)
+            for filename in sorted(os.listdir(filespace))
+            if filename not in known and os.path.splitext(
+                filename)[1].lower() in settings.PHOTO_EXTENSIONS
+        ]
+
+        # Workers must not share the parent's database connection.
+        connections.close_all()
+
+        records = []
+        for (filepath, fields) in photos.pool_map(
+                photos.ingest, filepaths, processes):
+            filename = os.path.basename(filepath)
+            record = cls(
+                trip=trip, filename=filename,
+                tripfile=TripFile.store_path(trip, filename))
+            record.ingested(fields)
+            records.append(record)
+
+        for batch in chunked(records, settings.INJECT_BATCH_SIZE):
+            cls.objects.bulk_create(batch)
+
+        return records
+
+    @classmethod
+    def locate(cls, trip, offset=None, max_gap=None):
+        """Locate a trip's photos on its tracks, by time.
+
+        An offset in seconds replaces the stored camera clock offset
+        of every photo. Return the number of photos located.
+        """
+
+        records = list(cls.objects.filter(
+            trip=trip, camera_time__isnull=False).order_by('camera_time'))
+
+        for record in records:
+            if offset is not None:
+                record.offset = offset
+            record.time = record.camera_time + datetime.timedelta(
+                seconds=record.offset)
+
+        segments = TrackSegment.objects.filter(
+            track__trip=trip).order_by('track', 'ordinal')
+        (longitudes, latitudes, elevations) = photos.correlate(
+            [photos.seconds(record.time) for record in records],
+            photos.track_fixes(segments), max_gap)
+
+        located = 0
+        with transaction.atomic():
+            for (record, longitude, latitude, elevation) in zip(
+                    records, longitudes, latitudes, elevations):
+
+                if math.isnan(longitude):
+                    record.status = 'unlocated'
+                    record.longitude = record.latitude = None
+                    record.elevation = record.geom = None
+                else:
+                    located += 1
+                    record.status = 'located'
+                    record.longitude = float(longitude)
+                    record.latitude = float(latitude)
+                    record.elevation = (
+                        None if math.isnan(elevation) else float(elevation))
+                    record.geom = Point(
+                        record.longitude, record.latitude,
+                        srid=SRID['WGS84'])
+
+                record.error = None
+                record.save(update_fields=[
+                    'offset', 'time', 'longitude', 'latitude', 'elevation',
+                    'geom', 'status', 'error', 'updated'])
+
+        return located
+
+    @classmethod
+    def geotag(cls, trip, processes=None):
+        """Write located photos' positions into their EXIF data.
+
+        Tagged photos are stored again, so that the manifest lists
+        their tagged content. Return the number of photos tagged, and
+        the number failed.
+        """
+
+        records = dict(
+            (record.filepath(), record)
+            for record in cls.objects.filter(
+                trip=trip, geom__isnull=False).select_related(
+                    'trip', 'tripfile__trip')
+        )
+        tasks = [
+            (filepath, record.longitude, record.latitude,
+             record.elevation, record.time)
+            for (filepath, record) in records.items()
+        ]
+
+        connections.close_all()
+        results = list(photos.pool_map(
+            photos.write_geotag, tasks, processes))
+
+        failed = 0
+        with transaction.atomic():
+            for (filepath, error) in results:
+                if error:
+                    failed += 1
+                elif records[filepath].tripfile_id:
+                    TripFile.store_path(trip, records[filepath].filename)
+                cls.objects.filter(id=records[filepath].id).update(
+                    status='failed' if error else 'tagged',
+                    error=error,
+                    updated=timezone.now(),
+                )
+
+        return (len(results) - failed, failed)
+
+
+class Blob(models.Model):
+    """A stored file, named by the SHA-1 digest of its content.
+
+    See trips.blobstore.
+    """
+
+    digest = models.CharField(max_length=40, primary_key=True)
+    size = models.BigIntegerField()
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+
+    def __unicode__(self):
+        return self.digest
+
+    def path(self):
+        return blobstore.blob_path(self.digest)
+
+    def open(self):
+        return open(self.path(), 'rb')
+
+    @classmethod
+    def store(cls, chunks):
+        """Write content to the blob store, unless it is already there."""
+
+        (digest, size) = blobstore.write(chunks)
+        (blob, created) = cls.objects.get_or_create(
+            digest=digest, defaults={'size': size})
+
+        return blob
+
+
+class TripFile(models.Model):
+    """An entry in a trip's manifest of files, naming a stored Blob.
+
+    A file keeps its name and content when the trip is renamed, and
+    is identified by its digest rather than its path. The manifest
+    records each file's type, size and, for gpx files, the analysis
+    summary, so that a trip's files are listed in one query without
+    reading the filespace.
+
+    The reconcilefiles management command brings the manifest up to
+    date with changes made directly in the filespace.
+    """
+
+    FILETYPE = (
+        ('gpx', 'gpx'),
+        ('image', 'image'),
+        ('document', 'document'),
+        ('other', 'other'),
+    )
+
+    EXTENSIONS = {
+        '.gpx': 'gpx',
+        '.jpg': 'image',
+        '.jpeg': 'image',
+        '.png': 'image',
+        '.gif': 'image',
+        '.tif': 'image',
+        '.tiff': 'image',
+        '.pdf': 'document',
+        '.txt': 'document',
+        '.md': 'document',
+        '.html': 'document',
+    }
+
+    trip = models.ForeignKey(Trip, related_name='files')
+    filename = models.CharField(max_length=255)
+    blob = models.ForeignKey(
+        Blob, related_name='files', on_delete=models.PROTECT)
+
+    filetype = models.CharField(
+        max_length=64, choices=FILETYPE, default='other', db_index=True)
+    size = models.BigIntegerField(default=0)
+    mtime = models.FloatField(blank=True, null=True)  # Of the filespace copy.
+    summary = models.BinaryField(blank=True, null=True)  # Pickled analysis.
+
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('trip', 'filename')
+
+    def __unicode__(self):
+        return self.filename
+
+    def __get_absolute_url__(self):
+        return os.path.join(self.trip.url, 'file', self.filename)
+
+    def __get_digest__(self):
+        return self.blob_id
+
+    url = property(__get_absolute_url__)
+    digest = property(__get_digest__)
+
+    def path(self):
+        """The path of the file in the trip's filespace."""
+
+        return os.path.join(self.trip.filespace(), self.filename)
+
+    def analysis(self):
+        """The analysis of a gpx file, made once and kept in the manifest.
+        """
+
+        if self.filetype != 'gpx':
+            return None
+
+        if self.summary is None:
+            result = analysis_cache.analyse(
+                self.path(), self.trip, self.digest)
+            self.summary = pickle.dumps(result, 2)
+            TripFile.objects.filter(id=self.id).update(summary=self.summary)
+        else:
+            result = pickle.loads(bytes(self.summary))
+
+        return analysis_cache.named(result, self.path(), self.trip)
+
+    def link(self):
+        """Link the blob into the filespace, recording the file's mtime."""
+
+        if not os.path.isdir(self.trip.filespace()):
+            self.trip.make_filespace()
+
+        # Photos are geotagged in place, so must not share the blob.
+        blobstore.link(self.digest, self.path(), copy=(
+            os.path.splitext(self.filename)[1].lower() in
+            settings.PHOTO_EXTENSIONS))
+        self.mtime = os.stat(self.path()).st_mtime
+        TripFile.objects.filter(id=self.id).update(mtime=self.mtime)
+
+    def is_current(self):
+        """Whether the filespace copy is known to match the blob.
+
+        A hard link to the blob, or a copy untouched since it was
+        linked, is current. Anything else must be hashed to tell.
+        """
+
+        try:
+            stat = os.stat(self.path())
+        except OSError:
+            return False
+
+        blob = os.stat(self.blob.path())
+        if (stat.st_dev, stat.st_ino) == (blob.st_dev, blob.st_ino):
+            return True
+
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+    @classmethod
+    def filetype_of(cls, filename):
+        extension = os.path.splitext(filename)[1].lower()
+        return cls.EXTENSIONS.get(extension, 'other')
+
+    @classmethod
+    def enter(cls, trip, filename, blob):
+        """List a blob in a trip's manifest, and link it into the filespace.
+        """
+
+        (record, created) = cls.objects.update_or_create(
+            trip=trip, filename=filename,
+            defaults={
+                'blob': blob,
+                'filetype': cls.filetype_of(filename),
+                'size': blob.size,
+                'summary': None,
+            },
+        )
+        record.link()
+
+        return record
+
+    @classmethod
+    def store(cls, trip, filename, chunks):
+        """Store content as a blob, and list it in a trip's manifest."""
+
+        return cls.enter(trip, filename, Blob.store(chunks))
+
+    @classmethod
+    def store_path(cls, trip, filename):
+        """Store a file already in a trip's filespace."""
+
+        (digest, size) = blobstore.write_file(
+            os.path.join(trip.filespace(), filename))
+        (blob, created) = Blob.objects.get_or_create(
+            digest=digest, defaults={'size': size})
+
+        return cls.enter(trip, filename, blob)
+
+    @classmethod
+    def digests(cls, trip):
+        return dict(cls.objects.filter(trip=trip).values_list(
+            'filename', 'blob_id'))
+
+
+class Job(models.Model):
+    """A gpx file queued for injection into a trip.
+
+    Jobs are submitted by the views, and run out of band by the
+    runjobs management command. Injection skips features already in
+    the database, so a failed or abandoned job may simply be run
+    again.
+    """
+
+    URL = 'job/'
+
+    STATUS = (
+        ('queued', 'queued'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed'),
+    )
+
+    trip = models.ForeignKey(Trip)
+    filename = models.CharField(max_length=255)
+
+    status = models.CharField(
+        max_length=64, choices=STATUS, default='queued', db_index=True)
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    warnings = models.TextField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    def __unicode__(self):
+        return self.filename + " | job " + str(self.id)
+
+    def __get_absolute_url__(self):
+        return os.path.join(settings.BASE_URL, self.URL + str(self.id))
+
+    url = property(__get_absolute_url__)
+
+    @classmethod
+    def submit(cls, trip, filename):
+        """Queue a file for injection, unless it is already queued."""
+
+        existing = cls.objects.filter(
+            trip=trip, filename=filename,
+            status__in=('queued', 'running'),
+        ).first()
+        if existing:
+            return existing
+
+        return cls.objects.create(trip=trip, filename=filename)
+
+    @classmethod
+    def claim(cls, limit):
+        """Mark up to limit queued jobs as running, and return them.
+
+        A job is only claimed if it is still queued when the update
+        is made, so several workers may share one queue.
+        """
+
+        claimed = []
+        queued = cls.objects.filter(status='queued').order_by(
+            'created').values_list('id', flat=True)[:limit]
+
+        for job_id in list(queued):
+            count = cls.objects.filter(id=job_id, status='queued').update(
+                status='running', attempts=F('attempts') + 1,
+                updated=timezone.now(),
+            )
+            if count:
+                claimed.append(job_id)
+
+        return list(cls.objects.filter(id__in=claimed))
+
+    @classmethod
+    def heartbeat(cls, job_ids):
+        """Mark running jobs as alive, from the process running them.
+
+        Workers only report progress between transactions, so a long
+        track would otherwise look stale while it is being injected.
+        """
+
+        cls.objects.filter(id__in=job_ids, status='running').update(
+            updated=timezone.now())
+
+    @classmethod
+    def requeue_stale(cls):
+        """Return jobs whose worker has stopped reporting to the queue."""
+
+        cutoff = timezone.now() - datetime.timedelta(
+            seconds=settings.JOB_TIMEOUT)
+        stale = cls.objects.filter(status='running', updated__lt=cutoff)
+
+        stale.filter(attempts__lt=settings.JOB_ATTEMPTS).update(
+            status='queued')
+        stale.filter(attempts__gte=settings.JOB_ATTEMPTS).update(
+            status='failed', error='Worker stopped responding.')
+
+    def run(self):
+        """Inject the file, recording progress, warnings and errors."""
+
+        self.progress = 0
+        self.reported = 0
+
+        try:
+            tripfile = self.trip.files.get(filename=self.filename)
+            summary = tripfile.analysis()
+            self.total = len(summary['waypoints']) + sum(
+                track['points'] for track in summary['tracks'])
+            self.save(update_fields=['progress', 'total', 'updated'])
+
+            with open(tripfile.blob.path()) as f:
+                gpxf = GPXFile(f, self.trip, name=tripfile.filename)
+                warnings = gpxf.inject(progress=self.advance)
+
+            self.status = 'done'
+            self.warnings = "\n".join(warnings)
+            self.error = None
+            self.finished = timezone.now()
+
+        except Exception:
+            self.error = traceback.format_exc()
+            if self.attempts < settings.JOB_ATTEMPTS:
+                self.status = 'queued'
+            else:
+                self.status = 'failed'
+                self.finished = timezone.now()
+
+        self.save()
+
+    def advance(self, count):
+        """Progress callback, recording progress every so many points."""
+
+        self.progress += count
+        if self.progress - self.reported >= settings.JOB_PROGRESS_INTERVAL:
+            self.reported = self.progress
+            Job.objects.filter(id=self.id).update(
+                progress=self.progress, updated=timezone.now())
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'trip': self.trip.identifier(),
+            'filename': self.filename,
+            'status': self.status,
+            'progress': self.progress,
+            'total': self.total,
+            'attempts': self.attempts,
+            'warnings': self.warnings.split("\n") if self.warnings else [],
+            'error': self.error,
+        }
+
+
+class GPXAnalysis(models.Model):
+    """Stored result of GPXFile.analyse() for a file in a filespace.
+
+    A record is only valid while the file's modification time and
+    size match those recorded here. Files in the blob store are
+    recorded by digest instead of path, as 'sha1:<digest>', with a
+    zero mtime and size.
+    """
+
+    path = models.TextField(unique=True)
+    mtime = models.FloatField()
+    size = models.BigIntegerField()
+    summary = models.BinaryField()
+    accessed = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __unicode__(self):
+        return self.path
+
+
+class GPXAnalysisCache():
+    """Two level cache of gpx file analyses.
+
+    Files are keyed by path, mtime and size, or by content digest if
+    they are stored as blobs.
+
+    Recently used summaries are held in process, in a least recently
+    used dictionary of settings.GPX_CACHE_SIZE entries. Behind that,
+    GPXAnalysis records persist summaries between processes, trimmed
+    to the settings.GPX_CACHE_DB_SIZE most recently used.
+    """
+
+    def __init__(self, size=None, db_size=None):
+        self.size = size or settings.GPX_CACHE_SIZE
+        self.db_size = db_size or settings.GPX_CACHE_DB_SIZE
+        self.entries = collections.OrderedDict()
+
+    def key(self, filepath, digest=None):
+        """Return a (path, mtime, size) tuple identifying a file version.
+
+        A blob is identified by its digest alone, so its analysis is
+        shared by every trip and name it is stored under.
+        """
+
+        if digest:
+            return ('sha1:' + digest, 0.0, 0)
+
+        stat = os.stat(filepath)
+        return (filepath, stat.st_mtime, stat.st_size)
+
+    def analyse(self, filepath, trip, digest=None):
+        """Return the analysis of the gpx file at filepath.
+
+        The file is only opened and parsed if no current analysis is
+        cached. Give the digest of a file stored as a blob.
+        """
+
+        key = self.key(filepath, digest)
+
+        summary = self.entries.pop(key[0], (None, None))
+        if summary[0] == key:
+            self.entries[key[0]] = summary
+            return self.named(summary[1], filepath, trip)
+
+        try:
+            record = GPXAnalysis.objects.get(
+                path=key[0], mtime=key[1], size=key[2])
+            result = pickle.loads(bytes(record.summary))
+            record.save(update_fields=['accessed'])
+
+        except GPXAnalysis.DoesNotExist:
+            source = blobstore.blob_path(digest) if digest else filepath
+            with open(source) as f:
+                result = GPXFile(f, trip, name=filepath).analyse()
+            self.store(key, result)
+
+        self.remember(key, result)
+        return self.named(result, filepath, trip)
+
+    def named(self, result, filepath, trip):
+        """A copy of a result, named for the file at filepath in a trip."""
+
+        name = os.path.basename(filepath)
+        result = dict(result)
+        result['name'] = name
+        result['url'] = os.path.join(trip.url, 'file', name)
+
+        return result
+
+    def remember(self, key, result):
+        """Hold a result in process, evicting the least recently used."""
+
+        self.entries[key[0]] = (key, result)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def store(self, key, result):
+        """Persist a result, trimming the table to db_size records."""
+
+        GPXAnalysis.objects.update_or_create(
+            path=key[0],
+            defaults={
+                'mtime': key[1],
+                'size': key[2],
+                'summary': pickle.dumps(result, 2),
+            }
+        )
+
+        stale = GPXAnalysis.objects.order_by(
+            '-accessed').values_list('id', flat=True)[self.db_size:]
+        stale = list(stale)
+        if stale:
+            GPXAnalysis.objects.filter(id__in=stale).delete()
+
+    def invalidate(self, filepath):
+        """Forget any analysis of the file at filepath."""
+
+        self.entries.pop(filepath, None)
+        GPXAnalysis.objects.filter(path=filepath).delete()
+
+
+analysis_cache = GPXAnalysisCache()
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size items from iterable."""
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def coordinate_array(coords):
+    """An n by 2 array of a list of (longitude, latitude) pairs."""
+
+    return numpy.array(coords, dtype=float).reshape(-1, 2)
+
+
+def joined_arrays(arrays):
+    """Join coordinate arrays, each of a batch of points, end to end.
+
+    Points are held as arrays rather than lists of pairs, so that the
+    coordinates of a long segment take 16 bytes a point.
+    """
+
+    if not arrays:
+        return coordinate_array([])
+
+    return numpy.concatenate(arrays)
+
+
+def gpx_attributes(model):
+    """Names of model fields that may be copied from a gpxpy object.
+
+    Only concrete fields are returned, so that gpxpy attributes such
+    as a segment's points are not mistaken for model methods.
+    """
+
+    return set(
+        field.name for field in model._meta.fields
+        if field.name not in ('id', 'geom')
+    )
+
+
 class GPXFile():
     """Class to process a gpx file from upload or other place.
 
@@ -570,27 +1949,59 @@ class GPXFile():
     Will insert records into the database.
     """
 
-    gpx = None     # Parsed gpxpy object
+    gpx = None     # Parsed gpxpy object, or a GPXStream.
     trip = None    # A Trip object.
     warnings = []  # List of strings.
+    progress = None  # Callable, passed counts of points injected.
 
-    def __init__(self, gpxfile, trip):
+    def __init__(self, gpxfile, trip, stream=None, storage=None,
+                 name=None):
         """Parse the file with gpxpy.
 
         Instantiate with a file, from request.FILES, or the result of
-        a file open operation.
+        a file open operation. Give the name the file is known by in
+        the trip if it was opened from elsewhere, such as the blob
+        store; it is used for provenance and links.
 
         Data from a GPX file must be associated with an existing trip
         record.
+
+        Files larger than settings.GPX_STREAM_SIZE bytes, or any file
+        if stream is True, are read incrementally with a GPXStream
+        rather than parsed whole.
+
+        Track points are injected as TrackPoint rows, or packed into
+        their segments if storage (by default settings.TRACK_STORAGE)
+        is 'packed'.
         """
 
         self.gpxfile = gpxfile
+        self.name = name or gpxfile.name
         self.trip = trip
-        self.gpx = gpxpy.parse(gpxfile)
+        self.storage = storage or settings.TRACK_STORAGE
+
+        if stream is None:
+            stream = self.filesize() > settings.GPX_STREAM_SIZE
+
+        if stream:
+            self.gpx = GPXStream(gpxfile)
+        else:
+            self.gpx = gpxpy.parse(gpxfile)
+
+    def filesize(self):
+        """Size of the gpx file in bytes, or 0 if it can't be found."""
+
+        if getattr(self.gpxfile, 'size', None) is not None:
+            return self.gpxfile.size
+
+        try:
+            return os.fstat(self.gpxfile.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            return 0
 
     def __get_absolute_url__(self):
 
-        (path, fname) = os.path.split(self.gpxfile.name)
+        (path, fname) = os.path.split(self.name)
         return os.path.join(self.trip.url, 'file', fname)
 
     url = property(__get_absolute_url__)
@@ -601,7 +2012,7 @@ class GPXFile():
         Indicate whether a record exists in the db matching this one.
         """
 
-        (path, name) = os.path.split(self.gpxfile.name)
+        (path, name) = os.path.split(self.name)
 
         result = {
             "name": name,
@@ -619,7 +2030,7 @@ class GPXFile():
         result = []
 
         for route in self.gpx.routes:
-            points = len(route.points)
+            points = sum(1 for point in route.points)
             routerec = {
                 "name": route.name,
                 "points": points,
@@ -630,19 +2041,31 @@ class GPXFile():
         return result
 
     def analyse_tracks(self):
-        """List basic data about each track."""
+        """List basic data about each track.
+
+        Each segment is read into arrays and summarised with the
+        vectorised functions of trips.analytics, so only one segment's
+        points are held at a time.
+        """
 
         result = []
 
         for track in self.gpx.tracks:
-            points = 0
-            for segment in track.segments:
-                points += len(segment.points)
+            segments = [
+                analytics.segment_stats(*analytics.point_arrays(
+                    segment.points))
+                for segment in track.segments
+            ]
+            stats = analytics.combine(segments)
 
             trackrec = {
                 "name": track.name,
-                "segments": len(track.segments),
-                "points": points,
+                "segments": len(segments),
+                "points": stats['points'],
+                "distance": stats['distance'],
+                "moving_time": stats['moving_time'],
+                "elevation_gain": stats['elevation_gain'],
+                "elevation_loss": stats['elevation_loss'],
             }
 
             result.append(trackrec)
@@ -671,11 +2094,18 @@ class GPXFile():
     def inject(
             self,
             comment=None, description=None, gtype=None,
-            owner=None, group=None,
+            owner=None, group=None, progress=None,
     ):
-        """Sequencer for the injection operation. Calls waypoints etc."""
+        """Sequencer for the injection operation. Calls waypoints etc.
+
+        If given, progress is called with the number of points
+        processed, as each batch is written. The Topo50 sheet index is
+        fetched once, for both tracks and waypoints.
+        """
 
         warnings = []
+        self.progress = progress
+        index = sheet_index(Topo50)
 
         warnings.extend(self.inject_routes(
             self.gpx, self.trip,
@@ -686,76 +2116,168 @@ class GPXFile():
         warnings.extend(self.inject_tracks(
             self.gpx, self.trip,
             comment=comment, description=description, gtype=gtype,
-            owner=owner, group=group,
+            owner=owner, group=group, index=index,
         ))
 
         warnings.extend(self.inject_waypoints(
             self.gpx, self.trip,
             comment=comment, description=description, gtype=gtype,
-            owner=owner, group=group,
+            owner=owner, group=group, index=index,
         ))
 
+        tiles.invalidate(self.trip)
+
         return warnings
 
+    def report_progress(self, count):
+        """Pass counts of points on to the progress callback.
+
+        Counts made inside a transaction are held back until it
+        closes, since progress written inside it would not be seen
+        until it commits, and on SpatiaLite would hold the write lock
+        meanwhile. Call with a count of 0 to pass on any held back.
+        """
+
+        self.unreported = getattr(self, 'unreported', 0) + count
+        if not self.progress or transaction.get_connection().in_atomic_block:
+            return
+
+        if self.unreported:
+            self.progress(self.unreported)
+        self.unreported = 0
+
     def inject_routes(
             self, gpx, trip,
             comment=None, description=None, gtype=None,
             owner=None, group=None,
     ):
+        """Insert records into db for routes and their points.
+
+        A route already recorded for another trip, with the same
+        fingerprint, is shared with this trip rather than duplicated.
+        Points are written with bulk inserts, and each route is
+        injected inside a single transaction, with its line geometry
+        built in the same pass.
+        """
+
         warnings = []
 
-        provenance = self.gpxfile.name
+        (path, provenance) = os.path.split(self.name)
+
+        # A gpxpy route's points are not the text field of that name.
+        route_attrs = gpx_attributes(Route) - set(['points'])
+
+        # Fingerprints read the points, so are found in a pass of their
+        # own, and looked up together.
+        fingerprints = [feature_fingerprint(route) for route in gpx.routes]
+        known = dict(Route.objects.filter(
+            fingerprint__in=fingerprints).values_list('fingerprint', 'id'))
+        linked = set(Route.objects.filter(
+            trips=trip, fingerprint__in=fingerprints,
+        ).values_list('fingerprint', flat=True))
+
+        for (number, route) in enumerate(gpx.routes):
 
-        for route in gpx.routes:
+            fingerprint = fingerprints[number]
 
-            try:
-                existing = Route.objects.get(name=route.name)
+            if fingerprint in linked:
                 warnings.append(
                     "Route record already exists for <tt>" + route.name +
                     "</tt>."
                 )
-            except Route.DoesNotExist:
+
+            elif fingerprint in known:
+                Route.trips.through.objects.create(
+                    route_id=known[fingerprint], trip_id=trip.id)
+                linked.add(fingerprint)
+                warnings.append(
+                    "Linked existing route record <tt>" + route.name +
+                    "</tt>."
+                )
+
+            else:
 
                 routedata = {
+                    'provenance': provenance,
                     'owner': owner,
                     'group': group,
+                    'fingerprint': fingerprint,
                 }
 
 #               Load the routedata dictionary from the gpx file attributes.
                 for attr in route.__dict__:
-                    if attr in Route.__dict__:
+                    if attr in route_attrs:
                         routedata[attr] = getattr(route, attr)
 
-                routerec = Route(**routedata)
-                routerec.save()
-                routerec.trips.add(trip)
-
-                ordinal = 0
-                for point in route.points:
-                    pointdata = {
-                        'provenance': provenance,
-                        'geom': Point(
-                            point.longitude, point.latitude, srid=SRID['WGS84']
-                        ),
-                        'ordinal': ordinal,
-                    }
-                    for attr in point.__dict__:
-                        if attr in RoutePoint.__dict__:
-                            routedata[attr] = getattr(point, attr)
-
-                    pointrec = RoutePoint(**pointdata)
-                    pointrc.save()
-                    ordinal += 1
+                with transaction.atomic():
+                    routerec = Route(**routedata)
+                    routerec.save()
+                    routerec.trips.add(trip)
+
+                    coords = self.inject_routepoints(
+                        route.points, routerec, provenance)
+                    if len(coords) > 1:
+                        routerec.geom = LineString(
+                            coords, srid=SRID['WGS84'])
+                        Route.objects.filter(id=routerec.id).update(
+                            geom=routerec.geom)
+
+                self.report_progress(0)
+                known[fingerprint] = routerec.id
+                linked.add(fingerprint)
 
                 warnings.append(
                     "Injected route record <tt>" + route.name +
-                    "</tt> with " + str(ordinal + 1) + " points."
+                    "</tt> with " + str(len(coords)) + " points."
                 )
 
         return warnings
 
+    def inject_routepoints(self, points, route, provenance,
+                           batch_size=None):
+        """Bulk insert RoutePoint records for one route.
+
+        Points are consumed from any iterable of gpxpy points, and
+        written in chunks of batch_size, numbered in order from 0.
+        Return a list of the (longitude, latitude) pairs written, for
+        the route geometry.
+        """
+
+        if batch_size is None:
+            batch_size = settings.INJECT_BATCH_SIZE
+
+        point_attrs = gpx_attributes(RoutePoint)
+        coords = []
+
+        for chunk in chunked(points, batch_size):
+            records = []
+            for point in chunk:
+
+                pointdata = {
+                    "route": route,
+                    "provenance": provenance,
+                }
+
+                for attr in point.__dict__:
+                    if attr in point_attrs:
+                        pointdata[attr] = getattr(point, attr)
+
+                pointdata['geom'] = Point(
+                    point.longitude, point.latitude, srid=SRID['WGS84']
+                )
+                pointdata['ordinal'] = len(coords)
+                coords.append((point.longitude, point.latitude))
+
+                records.append(RoutePoint(**pointdata))
+
+            RoutePoint.objects.bulk_create(records, batch_size=batch_size)
+            self.report_progress(len(records))
+
+        return coords
+
     def inject_tracks(self, gpx, trip,
-                      comment=None, description=None, gtype=None):
+                      comment=None, description=None, gtype=None,
+                      owner=None, group=None, index=None):
 
         """Insert records into db for tracks, segments and points.
 
@@ -763,107 +2285,234 @@ class GPXFile():
         through tracks in the gpx object, extracting segments and
         points, and create database records for each.
 
+        Points are written with bulk inserts of settings.INJECT_BATCH_SIZE
+        rows, and each track is injected inside a single transaction.
+        Segment and track geometries, and the Topo50 sheets crossed,
+        are found in the same pass, from the sheet index given or
+        fetched here.
+
         """
 
         warnings = []
+        if index is None:
+            index = sheet_index(Topo50)
 
-        (path, provenance) = os.path.split(self.gpxfile.name)
+        (path, provenance) = os.path.split(self.name)
 
-        for track in gpx.tracks:
+        track_attrs = gpx_attributes(Track)
+        segment_attrs = gpx_attributes(TrackSegment)
 
-            try:
-                existing = Track.objects.get(
-                    name=track.name, number=track.number)
+        # Fingerprints read the points, so are found in a pass of their
+        # own, and looked up together.
+        fingerprints = [feature_fingerprint(track) for track in gpx.tracks]
+        known = set(Track.objects.filter(
+            trip=trip, fingerprint__in=fingerprints,
+        ).values_list('fingerprint', flat=True))
+
+        for (number, track) in enumerate(gpx.tracks):
+
+            fingerprint = fingerprints[number]
+
+            if fingerprint in known:
                 warnings.append(
                     "Track record already exists for <tt>" + track.name +
                     "</tt>."
                 )
 
-            except Track.DoesNotExist:
+            else:
 
                 trackdata = {
                     "trip": trip,
                     "provenance": provenance,
+                    "owner": owner,
+                    "group": group,
+                    "fingerprint": fingerprint,
                 }
 
 #               Load the trackdatadata dictionary from the gpx file
 #               attributes.
                 for attr in track.__dict__:
-                    if attr in Track.__dict__:
+                    if attr in track_attrs:
                         trackdata[attr] = getattr(track, attr)
 
-                trackrc = Track(**trackdata)
-                trackrc.save()
-
-                pointcount = 0
-                seg_ordinal = 0
-
-                for segment in track.segments:
-                    segdata = {
-                        "track": trackrc,
-                        "provenance": provenance,
-                        "ordinal": seg_ordinal,
-                    }
-
-                    for attr in segment.__dict__:
-                        if attr in TrackSegment.__dict__:
-                            segdata[attr] = getattr(segment, attr)
-
-                    segrc = TrackSegment(**segdata)
-                    segrc.save()
-                    seg_ordinal += 1
+                with transaction.atomic():
+                    trackrc = Track(**trackdata)
+                    trackrc.save()
 
-                    point_ordinal = 0
-                    for point in segment.points:
+                    segcount = 0
+                    pointcount = 0
+                    lines = []
+                    sheets = set()
+                    stats = TrackStatistics()
 
-                        pointdata = {
-                            "segment": segrc,
+                    for seg_ordinal, segment in enumerate(track.segments):
+                        segdata = {
+                            "track": trackrc,
                             "provenance": provenance,
+                            "ordinal": seg_ordinal,
                         }
 
-                        for attr in point.__dict__:
-                            if attr in TrackPoint.__dict__:
-                                pointdata[attr] = getattr(point, attr)
-
-                        pointdata['geom'] = Point(
-                            point.longitude, point.latitude, srid=SRID['WGS84']
-                        )
-                        pointdata['ordinal'] = point_ordinal
-                        point_ordinal += 1
-                        pointcount += 1
-
-                        pointrc = TrackPoint(**pointdata)
-                        pointrc.save()
+                        for attr in segment.__dict__:
+                            if attr in segment_attrs:
+                                segdata[attr] = getattr(segment, attr)
+
+                        segrc = TrackSegment(**segdata)
+                        segrc.save()
+                        segcount += 1
+
+                        (coords, segstats) = self.inject_trackpoints(
+                            segment.points, segrc, provenance)
+                        pointcount += len(coords)
+                        stats.merge(segstats)
+
+                        segfields = segstats.fields()
+                        if len(coords) > 1:
+                            segfields['geom'] = LineString(
+                                coords, srid=SRID['WGS84'])
+                            lines.append(segfields['geom'])
+                            sheets.update(index.crossing(segfields['geom']))
+                        elif len(coords):
+                            sheets.update(index.touching(
+                                coords[:, 0], coords[:, 1]))
+                        segrc.set_fields(segfields)
+
+                    trackfields = stats.fields()
+                    trackfields['segment_count'] = segcount
+                    if lines:
+                        trackfields['geom'] = MultiLineString(
+                            lines, srid=SRID['WGS84'])
+                    trackrc.set_fields(trackfields)
+                    trackrc.sheets.add(*sorted(sheets))
+                    trackrc.build_levels()
+
+                self.report_progress(0)
+                known.add(fingerprint)
 
                 warning = "Created track record for <tt>" + track.name
-                warning += "</tt> with " + str(len(track.segments))
+                warning += "</tt> with " + str(segcount)
                 warning += " segments, and " + str(pointcount) + " points."
 
                 warnings.append(warning)
 
         return warnings
 
+    def inject_trackpoints(self, points, segment, provenance,
+                           batch_size=None):
+        """Bulk insert TrackPoint records for one segment.
+
+        Points are consumed from any iterable of gpxpy points, and
+        written in chunks of batch_size. Return an array of the
+        (longitude, latitude) pairs written, for the segment geometry,
+        and a TrackStatistics object for the segment.
+        """
+
+        if batch_size is None:
+            batch_size = settings.INJECT_BATCH_SIZE
+
+        if self.storage == 'packed':
+            return self.inject_packed_points(points, segment, batch_size)
+
+        point_attrs = gpx_attributes(TrackPoint)
+        arrays = []
+        count = 0
+        stats = TrackStatistics()
+
+        for chunk in chunked(points, batch_size):
+            records = []
+            coords = []
+            for point in chunk:
+
+                pointdata = {
+                    "segment": segment,
+                    "provenance": provenance,
+                }
+
+                for attr in point.__dict__:
+                    if attr in point_attrs:
+                        pointdata[attr] = getattr(point, attr)
+
+                pointdata['geom'] = Point(
+                    point.longitude, point.latitude, srid=SRID['WGS84']
+                )
+                pointdata['ordinal'] = count + len(coords)
+                coords.append((point.longitude, point.latitude))
+                stats.add(
+                    point.longitude, point.latitude,
+                    point.elevation, point.time,
+                )
+
+                records.append(TrackPoint(**pointdata))
+
+            TrackPoint.objects.bulk_create(records, batch_size=batch_size)
+            self.report_progress(len(records))
+            arrays.append(coordinate_array(coords))
+            count += len(coords)
+
+        return (joined_arrays(arrays), stats)
+
+    def inject_packed_points(self, points, segment, batch_size):
+        """Store a segment's points in its packed array columns.
+
+        Return values as for inject_trackpoints().
+        """
+
+        arrays = []
+        elevations = []
+        times = []
+        stats = TrackStatistics()
+
+        for chunk in chunked(points, batch_size):
+            coords = []
+            for point in chunk:
+                coords.append((point.longitude, point.latitude))
+                elevations.append(point.elevation)
+                times.append(point.time)
+                stats.add(
+                    point.longitude, point.latitude,
+                    point.elevation, point.time,
+                )
+            self.report_progress(len(coords))
+            arrays.append(coordinate_array(coords))
+
+        coords = joined_arrays(arrays)
+        segment.set_fields(
+            packing.pack(coords[:, 0], coords[:, 1], elevations, times))
+
+        return (coords, stats)
+
     def inject_waypoints(self, gpx, trip,
-                         comment=None, description=None, gtype=None):
+                         comment=None, description=None, gtype=None,
+                         owner=None, group=None, index=None):
         """Extract waypoint data from gpxpy object, insert records into db.
+
+        Waypoints already recorded for the trip are recognised by
+        fingerprint, from a single query, and new ones are written
+        with bulk inserts. Each is tagged with its Topo50 sheet, from
+        the sheet index given or fetched here.
         """
 
         warnings = []
 
+        (path, provenance) = os.path.split(self.name)
+
+        known = set(Waypoint.objects.filter(
+            trip=trip).values_list('fingerprint', flat=True))
+        waypoint_attrs = gpx_attributes(Waypoint)
+        if index is None:
+            index = sheet_index(Topo50)
+        records = []
+
         for waypoint in gpx.waypoints:
 
-            try:
-                existing = Waypoint.objects.get(
-                    time=waypoint.time, latitude=waypoint.latitude,
-                    longitude=waypoint.longitude,
-                )
+            fingerprint = waypoint_fingerprint(waypoint)
+
+            if fingerprint in known:
                 warnings.append(
                     "Waypoint record already exists for <tt>" + waypoint.name +
                     "</tt>."
                 )
-            except Waypoint.DoesNotExist:
 
-                (path, provenance) = os.path.split(self.gpxfile.name)
+            else:
 
                 data = {
                     'trip': trip,
@@ -871,17 +2520,21 @@ class GPXFile():
                     'group': None,
                     'status': None,
                     'provenance': provenance,
+                    'fingerprint': fingerprint,
                     'geom': Point(
                         waypoint.longitude, waypoint.latitude, srid=4326),
 
                 }
 
                 for attr in waypoint.__dict__:
-                    if attr in Waypoint.__dict__:
+                    if attr in waypoint_attrs:
                         data[attr] = getattr(waypoint, attr)
 
-                p = Waypoint(**data)
-                p.save()
+                data['sheet'] = index.sheet(
+                    waypoint.longitude, waypoint.latitude)
+
+                records.append(Waypoint(**data))
+                known.add(fingerprint)
 
                 warnings.append(
                     "creating " + " ".join(
@@ -893,4 +2546,12 @@ class GPXFile():
                     )
                 )
 
+            if len(records) >= settings.INJECT_BATCH_SIZE:
+                Waypoint.objects.bulk_create(records)
+                self.report_progress(len(records))
+                records = []
+
+        Waypoint.objects.bulk_create(records)
+        self.report_progress(len(records))
+
         return warnings
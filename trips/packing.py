@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Packed array storage for track segment points.
+
+A packed segment keeps its points in three binary columns instead of
+TrackPoint rows: coordinates as little endian float64 (longitude,
+latitude) pairs, elevations as float64 with NaN where missing, and
+times as int64 microseconds since the epoch, with NO_TIME where
+missing. The arrays are decoded with NumPy when first used.
+"""
+from __future__ import unicode_literals
+
+import datetime
+
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+
+import numpy
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+NO_TIME = numpy.iinfo(numpy.int64).min
+
+FLOAT = numpy.dtype('<f8')
+INTEGER = numpy.dtype('<i8')
+
+# The packed columns, and the bytes of each point in them.
+COLUMNS = (
+    ('coordinates', 2 * FLOAT.itemsize),
+    ('elevations', FLOAT.itemsize),
+    ('times', INTEGER.itemsize),
+)
+
+
+def to_microseconds(time):
+    if time is None:
+        return NO_TIME
+    if timezone.is_naive(time):
+        time = timezone.make_aware(time, timezone.utc)
+    delta = time - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_microseconds(value):
+    if value == NO_TIME:
+        return None
+    return EPOCH + datetime.timedelta(microseconds=int(value))
+
+
+def pack(longitudes, latitudes, elevations, times):
+    """Return a dictionary of TrackSegment field values for the points."""
+
+    coordinates = numpy.empty((len(longitudes), 2), dtype=FLOAT)
+    coordinates[:, 0] = longitudes
+    coordinates[:, 1] = latitudes
+
+    elevations = numpy.array(
+        [numpy.nan if e is None else e for e in elevations], dtype=FLOAT)
+    times = numpy.array(
+        [to_microseconds(t) for t in times], dtype=INTEGER)
+
+    return {
+        'storage': 'packed',
+        'coordinates': coordinates.tobytes(),
+        'elevations': elevations.tobytes(),
+        'times': times.tobytes(),
+    }
+
+
+class PackedPoints(object):
+    """Lazily decoded arrays of a packed segment's points.
+
+    Iterating yields PackedPoint objects, which stand in for TrackPoint
+    records in templates and the admin.
+
+    Given columns, a dictionary of the bytes of a run of the segment's
+    points from ordinal start in each packed column, only that run is
+    decoded, in place of the segment's whole columns.
+    """
+
+    def __init__(self, segment, columns=None, start=0):
+        self.segment = segment
+        self.columns = columns
+        self.start = start
+        self.decoded = None
+
+    def decode(self):
+        if self.decoded is None:
+            columns = self.columns or dict(
+                (name, getattr(self.segment, name))
+                for (name, size) in COLUMNS)
+            coordinates = numpy.frombuffer(
+                columns['coordinates'] or b'', dtype=FLOAT).reshape(-1, 2)
+            self.decoded = {
+                'longitude': coordinates[:, 0],
+                'latitude': coordinates[:, 1],
+                'elevation': numpy.frombuffer(
+                    columns['elevations'] or b'', dtype=FLOAT),
+                'time': numpy.frombuffer(
+                    columns['times'] or b'', dtype=INTEGER),
+            }
+        return self.decoded
+
+    def __get_longitude__(self):
+        return self.decode()['longitude']
+
+    def __get_latitude__(self):
+        return self.decode()['latitude']
+
+    def __get_elevation__(self):
+        return self.decode()['elevation']
+
+    def __get_time__(self):
+        """Times as int64 microseconds since the epoch."""
+        return self.decode()['time']
+
+    longitude = property(__get_longitude__)
+    latitude = property(__get_latitude__)
+    elevation = property(__get_elevation__)
+    time = property(__get_time__)
+
+    def __len__(self):
+        return len(self.longitude)
+
+    def __getitem__(self, ordinal):
+        if isinstance(ordinal, slice):
+            return [self[i] for i in range(*ordinal.indices(len(self)))]
+        elevation = self.elevation[ordinal]
+        return PackedPoint(
+            segment=self.segment,
+            ordinal=self.start + ordinal,
+            longitude=float(self.longitude[ordinal]),
+            latitude=float(self.latitude[ordinal]),
+            elevation=None if numpy.isnan(elevation) else float(elevation),
+            time=from_microseconds(self.time[ordinal]),
+        )
+
+    def __iter__(self):
+        for ordinal in range(len(self)):
+            yield self[ordinal]
+
+    def count(self):
+        return len(self)
+
+
+class PackedPoint(object):
+    """Read only stand in for a TrackPoint of a packed segment."""
+
+    id = None
+    name = None
+    comment = None
+    description = None
+
+    def __init__(self, segment, ordinal, longitude, latitude,
+                 elevation, time):
+        self.segment = segment
+        self.ordinal = ordinal
+        self.longitude = longitude
+        self.latitude = latitude
+        self.elevation = elevation
+        self.time = time
+
+    def __unicode__(self):
+        return str(self.segment) + " | point " + str(self.ordinal)
+
+    def __get_geom__(self):
+        return Point(self.longitude, self.latitude, srid=4326)
+
+    geom = property(__get_geom__)
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""Locate photographs from gps tracks, and geotag them.
+
+Photo times are matched against the sorted fix times of a trip's
+tracks by binary search, and positions interpolated between the fixes
+either side. A photo between two segments, or in a gap between fixes
+longer than PHOTO_MAX_GAP, takes the position of the nearest fix if
+that is within PHOTO_MAX_GAP, and is otherwise left unlocated.
+
+Camera clocks are rarely right. Camera times are read as local time
+in PHOTO_TIME_ZONE, and an offset in seconds added to correct them.
+
+Reading and writing EXIF data is done with piexif, in a pool of
+worker processes, since each photo is a separate file. Ingestion also
+makes thumbnails with Pillow, cached on disk under the SHA-1 digest of
+the original, so that a photo uploaded twice is only scaled once.
+"""
+from __future__ import unicode_literals
+
+import datetime
+import hashlib
+import io
+import multiprocessing
+import os
+import shutil
+
+from django.utils import timezone
+
+import numpy
+import piexif
+from PIL import Image
+import pytz
+
+import trips.analytics as analytics
+import trips.packing as packing
+import trips.settings as settings
+
+EXIF_TIME = '%Y:%m:%d %H:%M:%S'
+
+
+# Transpositions of EXIF orientations 2 to 8.
+ORIENTATION = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.ROTATE_90, Image.FLIP_TOP_BOTTOM),
+    6: (Image.ROTATE_270,),
+    7: (Image.ROTATE_270, Image.FLIP_TOP_BOTTOM),
+    8: (Image.ROTATE_90,),
+}
+
+
+def camera_time_text(exif):
+    """Return the camera time text of a piexif dictionary, or None."""
+
+    value = (
+        exif['Exif'].get(piexif.ExifIFD.DateTimeOriginal) or
+        exif['Exif'].get(piexif.ExifIFD.DateTimeDigitized) or
+        exif['0th'].get(piexif.ImageIFD.DateTime)
+    )
+    if value is None:
+        return None
+
+    return value.decode('ascii').strip('\x00 ')
+
+
+def thumbnail_name(digest, size):
+    return os.path.join(digest[:2], '%s-%d.jpg' % (digest, size))
+
+
+def thumbnail_path(digest, size):
+    return os.path.join(
+        settings.STATICFILES_DIR, settings.PHOTO_THUMBNAIL_DIR,
+        thumbnail_name(digest, size))
+
+
+def thumbnail_url(digest, size):
+    return (settings.STATIC_URL + settings.PHOTO_THUMBNAIL_DIR +
+            thumbnail_name(digest, size))
+
+
+def make_thumbnails(image, digest, orientation=None, sizes=None):
+    """Write any missing thumbnails of an opened image.
+
+    Thumbnails are made largest first, each scaled from the last. A
+    JPEG is decoded at the smallest scale that will do for the first.
+    """
+
+    missing = [
+        size for size in sorted(
+            sizes or settings.PHOTO_THUMBNAIL_SIZES, reverse=True)
+        if not os.path.exists(thumbnail_path(digest, size))
+    ]
+    if not missing:
+        return
+
+    image.draft('RGB', (missing[0], missing[0]))
+    image = image.convert('RGB')
+    for method in ORIENTATION.get(orientation, ()):
+        image = image.transpose(method)
+
+    for size in missing:
+        image.thumbnail((size, size), Image.LANCZOS)
+
+        filepath = thumbnail_path(digest, size)
+        if not os.path.isdir(os.path.dirname(filepath)):
+            try:
+                os.makedirs(os.path.dirname(filepath))
+            except OSError:
+                pass  # Made by another worker.
+
+        # Write aside and rename, so a thumbnail is never seen half made.
+        temporary = '%s.%d.tmp' % (filepath, os.getpid())
+        image.save(
+            temporary, 'JPEG', quality=settings.PHOTO_THUMBNAIL_QUALITY)
+        os.rename(temporary, filepath)
+
+
+def ingest(filepath):
+    """Read a photo's digest, size and camera time, and make thumbnails.
+
+    Return (filepath, fields), where fields is a dictionary of Photo
+    field values, including any error.
+    """
+
+    fields = {
+        'digest': None,
+        'width': None,
+        'height': None,
+        'camera_time': None,
+        'error': None,
+    }
+
+    try:
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        fields['digest'] = hashlib.sha1(data).hexdigest()
+
+        try:
+            exif = piexif.load(data)
+        except Exception:
+            exif = None
+
+        orientation = None
+        if exif:
+            text = camera_time_text(exif)
+            fields['camera_time'] = parse_camera_time(text)
+            orientation = exif['0th'].get(piexif.ImageIFD.Orientation)
+        if fields['camera_time'] is None:
+            fields['error'] = 'No camera time in EXIF data.'
+
+        image = Image.open(io.BytesIO(data))
+        (width, height) = image.size
+        if orientation in (5, 6, 7, 8):
+            (width, height) = (height, width)
+        (fields['width'], fields['height']) = (width, height)
+
+        make_thumbnails(image, fields['digest'], orientation)
+
+    except Exception as e:
+        fields['error'] = '%s' % e
+
+    return (filepath, fields)
+
+
+def parse_camera_time(text, tz=None):
+    """Return an aware datetime from EXIF time text, in the camera's zone.
+    """
+
+    if not text:
+        return None
+
+    try:
+        naive = datetime.datetime.strptime(text, EXIF_TIME)
+    except ValueError:
+        return None
+
+    return pytz.timezone(tz or settings.PHOTO_TIME_ZONE).localize(naive)
+
+
+def clock_offset(camera_time, gps_time):
+    """Seconds to add to camera times, from one photo of a known time.
+
+    A photo of the gps receiver's clock gives both times at once.
+    """
+
+    return (gps_time - camera_time).total_seconds()
+
+
+def track_fixes(segments):
+    """Return sorted arrays of the timed fixes of track segments.
+
+    The arrays are times (seconds since the epoch), longitudes,
+    latitudes, elevations, and the number of the segment each fix
+    came from.
+    """
+
+    columns = [[], [], [], [], []]
+    for (number, segment) in enumerate(segments):
+        (longitudes, latitudes, elevations, times) = \
+            analytics.segment_arrays(segment)
+        timed = ~numpy.isnan(times)
+        columns[0].append(times[timed])
+        columns[1].append(longitudes[timed])
+        columns[2].append(latitudes[timed])
+        columns[3].append(elevations[timed])
+        columns[4].append(numpy.full(timed.sum(), number, dtype=int))
+
+    if not columns[0]:
+        return tuple(numpy.array([]) for column in columns)
+
+    columns = [numpy.concatenate(column) for column in columns]
+    order = numpy.argsort(columns[0], kind='mergesort')
+
+    return tuple(column[order] for column in columns)
+
+
+def correlate(photo_times, fixes, max_gap=None):
+    """Locate photos taken at photo_times on the track_fixes().
+
+    Return longitude, latitude and elevation arrays, with NaN for
+    photos which could not be located.
+    """
+
+    if max_gap is None:
+        max_gap = settings.PHOTO_MAX_GAP
+
+    (times, longitudes, latitudes, elevations, segments) = fixes
+    photo_times = numpy.asarray(photo_times, dtype=float)
+    count = len(times)
+
+    result = tuple(
+        numpy.full(len(photo_times), numpy.nan) for i in range(3))
+    if not count or not len(photo_times):
+        return result
+
+    # The fixes before and after each photo.
+    upper = numpy.clip(numpy.searchsorted(times, photo_times), 0, count - 1)
+    lower = numpy.clip(upper - 1, 0, count - 1)
+    (t0, t1) = (times[lower], times[upper])
+
+    span = t1 - t0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        fraction = numpy.where(span > 0, (photo_times - t0) / span, 0.0)
+
+    bracketed = (
+        (t0 <= photo_times) & (photo_times <= t1) &
+        (segments[lower] == segments[upper]) & (span <= max_gap)
+    )
+
+    nearest = numpy.where(
+        numpy.abs(photo_times - t0) <= numpy.abs(t1 - photo_times),
+        lower, upper)
+    near = ~bracketed & (
+        numpy.abs(photo_times - times[nearest]) <= max_gap)
+
+    for (output, values) in zip(result, (longitudes, latitudes, elevations)):
+        interpolated = values[lower] + fraction * (
+            values[upper] - values[lower])
+        output[bracketed] = interpolated[bracketed]
+        output[near] = values[nearest][near]
+
+    return result
+
+
+def seconds(time):
+    """Seconds since the epoch of an aware datetime."""
+
+    return packing.to_microseconds(time) / 1e6
+
+
+def rational(value, denominator=10000):
+    return (int(round(value * denominator)), denominator)
+
+
+def dms(degrees):
+    """EXIF degrees, minutes and seconds of an angle."""
+
+    degrees = abs(degrees)
+    minutes = (degrees % 1) * 60
+    return (
+        (int(degrees), 1),
+        (int(minutes), 1),
+        rational((minutes % 1) * 60),
+    )
+
+
+def gps_ifd(longitude, latitude, elevation=None, time=None):
+    """Return a piexif GPS IFD dictionary for a position and time."""
+
+    ifd = {
+        piexif.GPSIFD.GPSVersionID: (2, 3, 0, 0),
+        piexif.GPSIFD.GPSLatitudeRef: b'N' if latitude >= 0 else b'S',
+        piexif.GPSIFD.GPSLatitude: dms(latitude),
+        piexif.GPSIFD.GPSLongitudeRef: b'E' if longitude >= 0 else b'W',
+        piexif.GPSIFD.GPSLongitude: dms(longitude),
+        piexif.GPSIFD.GPSMapDatum: b'WGS-84',
+    }
+
+    if elevation is not None:
+        ifd[piexif.GPSIFD.GPSAltitudeRef] = 0 if elevation >= 0 else 1
+        ifd[piexif.GPSIFD.GPSAltitude] = rational(abs(elevation), 100)
+
+    if time is not None:
+        time = time.astimezone(timezone.utc)
+        ifd[piexif.GPSIFD.GPSTimeStamp] = (
+            (time.hour, 1), (time.minute, 1),
+            rational(time.second + time.microsecond / 1e6, 1000),
+        )
+        ifd[piexif.GPSIFD.GPSDateStamp] = time.strftime(
+            '%Y:%m:%d').encode('ascii')
+
+    return ifd
+
+
+def private_copy(filepath):
+    """Give a file a writable inode of its own, if it shares one.
+
+    A photo uploaded as a trip file is hard linked to a read only blob
+    (see trips.blobstore), which writing in place would corrupt for
+    every trip sharing it.
+    """
+
+    if os.stat(filepath).st_nlink < 2 and os.access(filepath, os.W_OK):
+        return
+
+    temporary = '%s.%d.tmp' % (filepath, os.getpid())
+    shutil.copyfile(filepath, temporary)
+    os.rename(temporary, filepath)
+
+
+def write_geotag(task):
+    """Write a GPS IFD into a photo's EXIF data, in place.
+
+    The task is (filepath, longitude, latitude, elevation, time).
+    Return (filepath, error or None).
+    """
+
+    (filepath, longitude, latitude, elevation, time) = task
+
+    try:
+        exif = piexif.load(filepath)
+        exif['GPS'] = gps_ifd(longitude, latitude, elevation, time)
+        # Thumbnails are kept; piexif refuses to dump some broken ones.
+        try:
+            data = piexif.dump(exif)
+        except Exception:
+            exif['thumbnail'] = None
+            exif['1st'] = {}
+            data = piexif.dump(exif)
+        private_copy(filepath)
+        piexif.insert(data, filepath)
+        return (filepath, None)
+
+    except Exception as e:
+        return (filepath, '%s' % e)
+
+
+def pool_map(function, tasks, processes=None):
+    """Map a function over tasks in a pool of worker processes.
+
+    Results are yielded as they complete, in no particular order.
+    """
+
+    tasks = list(tasks)
+    if not tasks:
+        return
+
+    processes = processes or settings.PHOTO_PROCESSES
+    if processes < 2 or len(tasks) < 2:
+        for task in tasks:
+            yield function(task)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunksize = max(1, len(tasks) // (processes * 8))
+        for result in pool.imap_unordered(function, tasks, chunksize):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
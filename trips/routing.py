@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Build routes from tracks.
+
+GPS receivers hold only so many points per route, often 250 or fewer,
+so a track is simplified to a budget of points rather than to a
+tolerance. Points are chosen in Douglas-Peucker order: the line is
+split at whichever point lies furthest from the chord of its section,
+worst first, until the budget is spent or every point left out lies
+within the tolerance of the route. Each split measures its section
+with NumPy, so a track of tens of thousands of points simplifies in
+milliseconds.
+
+Coordinates are projected to metres on a plane tangent at the middle
+of the track, which is close enough over the extent of a trip.
+"""
+from __future__ import unicode_literals
+
+import heapq
+import math
+
+import numpy
+
+from trips.analytics import EARTH_RADIUS
+import trips.settings as settings
+
+
+def planar(longitudes, latitudes):
+    """Project coordinates to x and y metres about their middle."""
+
+    longitudes = numpy.asarray(longitudes, dtype=float)
+    latitudes = numpy.asarray(latitudes, dtype=float)
+    if not len(longitudes):
+        return (longitudes, latitudes)
+
+    middle = (latitudes.min() + latitudes.max()) / 2
+    scale = math.radians(1) * EARTH_RADIUS
+
+    return (
+        (longitudes - longitudes[0]) * scale * math.cos(math.radians(middle)),
+        (latitudes - latitudes[0]) * scale,
+    )
+
+
+def deviations(x, y, first, last):
+    """Metres from each point between first and last to their chord."""
+
+    px = x[first + 1:last] - x[first]
+    py = y[first + 1:last] - y[first]
+    dx = x[last] - x[first]
+    dy = y[last] - y[first]
+
+    length = dx * dx + dy * dy
+    if length == 0:
+        return numpy.hypot(px, py)
+
+    t = numpy.clip((px * dx + py * dy) / length, 0, 1)
+    return numpy.hypot(px - t * dx, py - t * dy)
+
+
+def simplify(longitudes, latitudes, budget=None, tolerance=None):
+    """Return the sorted indices of at most budget points to keep.
+
+    The first and last points are always kept. Fewer points are kept
+    if the rest all lie within tolerance metres of the route.
+    """
+
+    budget = max(2, budget or settings.ROUTE_POINT_LIMIT)
+    if tolerance is None:
+        tolerance = settings.ROUTE_TOLERANCE
+
+    count = len(longitudes)
+    if count <= 2:
+        return list(range(count))
+
+    (x, y) = planar(longitudes, latitudes)
+    keep = [0, count - 1]
+    sections = []
+
+    def split(first, last):
+        if last - first < 2:
+            return
+        distances = deviations(x, y, first, last)
+        worst = int(numpy.argmax(distances))
+        if distances[worst] > tolerance:
+            heapq.heappush(
+                sections, (-distances[worst], first, last, first + 1 + worst))
+
+    split(0, count - 1)
+    while sections and len(keep) < budget:
+        (distance, first, last, index) = heapq.heappop(sections)
+        keep.append(index)
+        split(first, index)
+        split(index, last)
+
+    return sorted(keep)
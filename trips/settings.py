@@ -2,3 +2,83 @@ from home.settings import *
 
 BASE_URL = '/trips'
 BASE_FILESPACE = 'trips/'
+
+# Number of rows written per bulk insert when injecting gpx data.
+INJECT_BATCH_SIZE = 2000
+
+# Number of gpx file analyses held in process, and in the database.
+GPX_CACHE_SIZE = 256
+GPX_CACHE_DB_SIZE = 4096
+
+# Gpx files larger than this many bytes are read incrementally.
+GPX_STREAM_SIZE = 8 * 1024 * 1024
+
+# Background injection jobs, run by the runjobs management command.
+JOB_PROCESSES = 2
+JOB_ATTEMPTS = 3              # Tries before a job is marked failed.
+JOB_TIMEOUT = 600             # Seconds without progress before a retry.
+JOB_PROGRESS_INTERVAL = 5000  # Points between progress updates.
+
+# How injected track points are stored: 'rows' of TrackPoint, or
+# 'packed' into array columns of their TrackSegment.
+TRACK_STORAGE = 'rows'
+
+# Track analytics: points in the elevation smoothing window, and the
+# speed in metres per second below which a step counts as stopped.
+ELEVATION_SMOOTHING = 5
+STOPPED_SPEED = 0.3
+
+# Web map zoom levels at which simplified track geometry is stored.
+TRACK_LEVELS = [6, 9, 12, 15]
+
+# Characters of gpx text sent per chunk of a streamed export.
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Photographs: file extensions scanned for, the zone camera clocks
+# are set to, the longest gap in seconds between gps fixes that a
+# photo position is interpolated or extrapolated across, and the
+# worker processes reading and writing EXIF data.
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg')
+PHOTO_TIME_ZONE = 'Pacific/Auckland'
+PHOTO_MAX_GAP = 300
+PHOTO_PROCESSES = 4
+
+# Photo ingestion: thumbnail sizes in pixels along the longer side,
+# their JPEG quality and directory under STATICFILES_DIR, and the
+# number of photos handed to a runphotos worker at a time.
+PHOTO_THUMBNAIL_SIZES = (160, 640, 1280)
+PHOTO_THUMBNAIL_QUALITY = 85
+PHOTO_THUMBNAIL_DIR = 'trips/thumbnails/'
+PHOTO_BATCH_SIZE = 20
+
+# Directory under STATICFILES_DIR of the content addressed blob store.
+BLOB_DIR = 'trips/blobs/'
+
+# GeoJSON map tiles: cache directory under STATICFILES_DIR, the buffer
+# in pixels that lines are clipped to beyond the tile, and the
+# highest zoom served.
+TILE_DIR = 'trips/tiles/'
+TILE_BUFFER = 8
+TILE_MAX_ZOOM = 18
+
+# Track points shown per page of the track data view.
+POINT_PAGE_SIZE = 500
+
+# Spatial queries: the radius in metres a nearest search starts from,
+# and the most results returned.
+SPATIAL_NEAREST_START = 1000
+SPATIAL_LIMIT = 1000
+
+# Routes made from tracks: the most points in a route, since gps
+# receivers limit them, and the distance in metres within which
+# points are left out even when the budget allows.
+ROUTE_POINT_LIMIT = 250
+ROUTE_TOLERANCE = 2
+
+# Offline map packs: directory under STATICFILES_DIR, the corridor
+# width in metres either side of tracks and routes, the track level
+# zoom drawn, and the worker processes building sheets.
+MAPPACK_DIR = 'trips/mappacks/'
+MAPPACK_BUFFER = 2000
+MAPPACK_ZOOM = 15
+MAPPACK_PROCESSES = 4
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Spatial queries: what lies in an area, or near a point.
+
+Every query first narrows a queryset to the rows whose geometry's
+bounding box overlaps the search box, using the spatial index of the
+geom column: the R*Tree of SpatiaLite, through its SpatialIndex
+virtual table, or the GiST index of PostGIS, through the && operator.
+Exact tests and distances are then worked out for those candidates
+only, so a query costs much the same however much data lies outside
+the search box.
+
+Distances are in metres. Those to points are great circle distances.
+Those to lines are measured in a plane tangent at the query point,
+which is accurate to well under a percent over the tens of kilometres
+of a trip.
+"""
+from __future__ import unicode_literals
+
+import math
+
+from django.contrib.gis.geos import Polygon
+from django.db import connection
+
+import numpy
+
+from trips.analytics import EARTH_RADIUS, haversine
+import trips.settings as settings
+
+HALF_CIRCUMFERENCE = math.pi * EARTH_RADIUS
+
+
+def bbox_polygon(bbox):
+    polygon = Polygon.from_bbox(bbox)
+    polygon.srid = 4326
+    return polygon
+
+
+def radius_bbox(longitude, latitude, metres):
+    """The bounding box, in degrees, of a circle around a point."""
+
+    dlat = math.degrees(metres / EARTH_RADIUS)
+    north = min(90.0, latitude + dlat)
+    south = max(-90.0, latitude - dlat)
+
+    poleward = max(abs(north), abs(south))
+    if poleward >= 89.9:
+        dlon = 180.0
+    else:
+        dlon = min(180.0, dlat / math.cos(math.radians(poleward)))
+
+    return (longitude - dlon, south, longitude + dlon, north)
+
+
+def prefilter(queryset, bbox):
+    """Rows whose geometry's bounding box overlaps bbox, by the index."""
+
+    model = queryset.model
+    if connection.ops.spatialite:
+        table = model._meta.db_table
+        return queryset.extra(
+            where=[
+                '"%s"."%s" IN (SELECT ROWID FROM SpatialIndex WHERE '
+                'f_table_name = %%s AND f_geometry_column = %%s AND '
+                'search_frame = BuildMbr(%%s, %%s, %%s, %%s, 4326))' % (
+                    table, model._meta.pk.column),
+            ],
+            params=[table, 'geom'] + list(bbox),
+        )
+
+    return queryset.filter(geom__bboverlaps=bbox_polygon(bbox))
+
+
+def in_bbox(queryset, bbox):
+    """Rows whose geometry intersects the box (west, south, east, north).
+    """
+
+    return prefilter(queryset, bbox).filter(
+        geom__intersects=bbox_polygon(bbox))
+
+
+def line_distance(coords, longitude, latitude):
+    """Metres from a point to the nearest part of a line."""
+
+    coords = numpy.asarray(coords, dtype=float)[:, :2]
+    scale = math.radians(1) * EARTH_RADIUS
+    x = (coords[:, 0] - longitude) * scale * math.cos(math.radians(latitude))
+    y = (coords[:, 1] - latitude) * scale
+
+    if len(coords) == 1:
+        return float(numpy.hypot(x[0], y[0]))
+
+    (dx, dy) = (numpy.diff(x), numpy.diff(y))
+    lengths = dx ** 2 + dy ** 2
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        t = numpy.clip(-(x[:-1] * dx + y[:-1] * dy) / lengths, 0, 1)
+    t[lengths == 0] = 0
+
+    return float(numpy.hypot(x[:-1] + t * dx, y[:-1] + t * dy).min())
+
+
+def distance(geom, longitude, latitude):
+    """Metres from a point to a point, line or multiline geometry."""
+
+    if geom.geom_type == 'Point':
+        return haversine(longitude, latitude, geom.x, geom.y)
+    if geom.geom_type == 'LineString':
+        return line_distance(geom.coords, longitude, latitude)
+
+    return min(line_distance(line.coords, longitude, latitude)
+               for line in geom)
+
+
+def measured(queryset, longitude, latitude):
+    """[(metres, record)] for the rows of a queryset, nearest first."""
+
+    result = [
+        (distance(record.geom, longitude, latitude), record)
+        for record in queryset if record.geom is not None
+    ]
+    result.sort(key=lambda pair: pair[0])
+
+    return result
+
+
+def within(queryset, longitude, latitude, metres):
+    """[(metres, record)] for rows within a distance of a point."""
+
+    candidates = prefilter(
+        queryset, radius_bbox(longitude, latitude, metres))
+
+    return [
+        pair for pair in measured(candidates, longitude, latitude)
+        if pair[0] <= metres
+    ]
+
+
+def nearest(queryset, longitude, latitude, k=10, start=None):
+    """[(metres, record)] for the k rows nearest a point.
+
+    The search box grows from a radius of start metres until it holds
+    k candidates. Rows outside the box may still be nearer than the
+    kth candidate, though no nearer than the radius, so the box is
+    widened once more to the kth distance if that is beyond it.
+    """
+
+    metres = start or settings.SPATIAL_NEAREST_START
+
+    while True:
+        candidates = prefilter(
+            queryset, radius_bbox(longitude, latitude, metres))
+        if metres >= HALF_CIRCUMFERENCE or candidates.count() >= k:
+            break
+        metres *= 4
+
+    found = measured(candidates, longitude, latitude)[:k]
+    if len(found) == k and found[-1][0] > metres:
+        candidates = prefilter(
+            queryset, radius_bbox(longitude, latitude, found[-1][0]))
+        found = measured(candidates, longitude, latitude)[:k]
+
+    return found
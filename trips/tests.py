@@ -1,6 +1,1393 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
+import stat
+import tempfile
 
-# Create your tests here.
+from django.contrib.gis.geos import (
+    GEOSGeometry, LineString, MultiLineString, Polygon)
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+import gpxpy
+import numpy
+from PIL import Image
+import piexif
+
+from geolib.models import PlaceName, Topo50
+from trips.analytics import EARTH_RADIUS, haversine
+import trips.blobstore as blobstore
+from trips.digest import feature_fingerprint
+import trips.gpxwriter as gpxwriter
+import trips.models as models
+import trips.packing as packing
+import trips.photos as photos
+import trips.routing as routing
+import trips.settings as settings
+import trips.spatial as spatial
+import trips.tiles as tiles
+
+
+def gpx_points(tag, count, latitude=-42.9, longitude=171.5, start=None):
+    """GPX text of count points along a line, a minute apart."""
+
+    start = start or datetime.datetime(2017, 1, 2, 3, 4, 5)
+    return ''.join(
+        '<%s lat="%.6f" lon="%.6f"><ele>%d</ele><time>%s</time></%s>' % (
+            tag, latitude + n * 0.001, longitude + n * 0.001, 700 + n,
+            (start + datetime.timedelta(minutes=n)).isoformat() + 'Z', tag)
+        for n in range(count))
+
+
+def gpx(*features):
+    return (
+        '<gpx version="1.1" creator="tests" '
+        'xmlns="http://www.topografix.com/GPX/1/1">%s</gpx>' %
+        ''.join(features))
+
+
+def track(name, *segments):
+    return '<trk><name>%s</name>%s</trk>' % (name, ''.join(
+        '<trkseg>%s</trkseg>' % segment for segment in segments))
+
+
+def route(name, points):
+    return '<rte><name>%s</name>%s</rte>' % (name, points)
+
+
+def jpeg(camera_time=None):
+    """A small JPEG, with camera time text in its EXIF data if given."""
+
+    exif = {'0th': {}, 'Exif': {}, 'GPS': {}, '1st': {}}
+    if camera_time:
+        exif['Exif'][piexif.ExifIFD.DateTimeOriginal] = \
+            camera_time.encode('ascii')
+
+    data = io.BytesIO()
+    Image.new('RGB', (40, 30), (90, 120, 60)).save(
+        data, 'JPEG', exif=piexif.dump(exif))
+    return data.getvalue()
+
+
+class Feature(object):
+    """A stand in for a gpxpy track or route."""
+
+    def __init__(self, name, points, number=None):
+        self.name = name
+        self.number = number
+        self.points = points
+
+
+class Point(object):
+
+    def __init__(self, latitude, longitude, time=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.time = time
+
+
+class Segment(object):
+    """A stand in for a packed TrackSegment."""
+
+    def __init__(self, fields):
+        self.coordinates = fields['coordinates']
+        self.elevations = fields['elevations']
+        self.times = fields['times']
+
+
+class FilespaceTestCase(TestCase):
+    """Tests with a trip, whose files are kept in a temporary directory.
+    """
+
+    def setUp(self):
+        self.saved = (settings.INJECT_BATCH_SIZE, settings.STATICFILES_DIR)
+        settings.STATICFILES_DIR = tempfile.mkdtemp()
+        os.makedirs(os.path.join(
+            settings.STATICFILES_DIR, settings.BASE_FILESPACE))
+
+        self.trip = models.Trip.objects.create(name='Test trip')
+
+    def tearDown(self):
+        shutil.rmtree(settings.STATICFILES_DIR)
+        (settings.INJECT_BATCH_SIZE, settings.STATICFILES_DIR) = self.saved
+
+    def inject(self, text, trip=None, storage='rows'):
+        gpxfile = models.GPXFile(
+            io.BytesIO(text.encode('utf-8')), trip or self.trip,
+            stream=True, storage=storage, name='test.gpx')
+        return gpxfile.inject()
+
+
+class InjectionTests(FilespaceTestCase):
+    """Points are injected in batches, in order, and features once."""
+
+    def setUp(self):
+        super(InjectionTests, self).setUp()
+        settings.INJECT_BATCH_SIZE = 3
+
+    def test_track_points(self):
+        self.inject(gpx(track(
+            'Day one', gpx_points('trkpt', 7), gpx_points('trkpt', 4))))
+
+        record = models.Track.objects.get()
+        self.assertEqual(record.point_count, 11)
+        self.assertEqual(record.segment_count, 2)
+
+        segments = record.segments().order_by('ordinal')
+        for (segment, count) in zip(segments, (7, 4)):
+            ordinals = list(models.TrackPoint.objects.filter(
+                segment=segment).order_by('ordinal').values_list(
+                    'ordinal', flat=True))
+            self.assertEqual(ordinals, list(range(count)))
+            self.assertEqual(segment.point_count, count)
+            self.assertEqual(segment.geom.num_points, count)
+
+    def test_packed_track_points(self):
+        self.inject(gpx(track('Day one', gpx_points('trkpt', 8))),
+                    storage='packed')
+
+        segment = models.TrackSegment.objects.get()
+        points = list(segment.packed_points())
+        self.assertEqual([point.ordinal for point in points], list(range(8)))
+        self.assertAlmostEqual(points[5].latitude, -42.895)
+        self.assertEqual(segment.point_count, 8)
+        self.assertFalse(models.TrackPoint.objects.exists())
+
+        run = list(segment.packed_run(3, 4))
+        self.assertEqual([point.ordinal for point in run], [3, 4, 5, 6])
+        self.assertEqual(run[2].time, points[5].time)
+
+    def test_reinjection(self):
+        text = gpx(
+            track('Day one', gpx_points('trkpt', 5)),
+            route('Pass', gpx_points('rtept', 4)))
+        self.inject(text)
+        self.inject(text)
+
+        self.assertEqual(models.Track.objects.count(), 1)
+        self.assertEqual(models.Route.objects.count(), 1)
+        self.assertEqual(models.TrackPoint.objects.count(), 5)
+
+    def test_same_name_other_points(self):
+        self.inject(gpx(
+            track('ACTIVE LOG', gpx_points('trkpt', 5)),
+            track('ACTIVE LOG', gpx_points('trkpt', 5, latitude=-43.5)),
+            route('ROUTE 001', gpx_points('rtept', 3)),
+            route('ROUTE 001', gpx_points('rtept', 3, longitude=172.0))))
+
+        self.assertEqual(models.Track.objects.count(), 2)
+        self.assertEqual(models.Route.objects.count(), 2)
+
+    def test_route_points(self):
+        self.inject(gpx(route('Pass', gpx_points('rtept', 7))))
+
+        record = models.Route.objects.get()
+        ordinals = list(record.routepoint_set.order_by(
+            'ordinal').values_list('ordinal', flat=True))
+        self.assertEqual(ordinals, list(range(7)))
+        self.assertEqual(record.geom.num_points, 7)
+
+    def test_route_shared_between_trips(self):
+        text = gpx(route('Pass', gpx_points('rtept', 4)))
+        other = models.Trip.objects.create(name='Other trip')
+        self.inject(text)
+        self.inject(text, trip=other)
+
+        record = models.Route.objects.get()
+        self.assertEqual(record.trips.count(), 2)
+        self.assertEqual(record.routepoint_set.count(), 4)
+
+
+class PointPageTests(FilespaceTestCase):
+    """Points are paged across segments, rows and packed runs alike."""
+
+    def setUp(self):
+        super(PointPageTests, self).setUp()
+        self.tracks = {}
+        for storage in ('rows', 'packed'):
+            self.inject(gpx(track(
+                storage, gpx_points('trkpt', 7), gpx_points('trkpt', 5),
+            )), storage=storage)
+            self.tracks[storage] = models.Track.objects.get(name=storage)
+
+    def expected(self, record):
+        return [
+            (segment.id, ordinal)
+            for segment in record.segments().order_by('id')
+            for ordinal in range(segment.point_count)
+        ]
+
+    def test_pages(self):
+        for (storage, record) in self.tracks.items():
+            (pages, after) = ([], None)
+            while True:
+                (page, after) = record.point_page(after, limit=4)
+                pages.append([(point[1], point[2]) for point in page])
+                if after is None:
+                    break
+
+            self.assertEqual(
+                [len(page) for page in pages], [4, 4, 4], msg=storage)
+            # The second page runs from one segment into the next.
+            self.assertNotEqual(pages[1][0][0], pages[1][-1][0])
+            self.assertEqual(
+                sum(pages, []), self.expected(record), msg=storage)
+
+    def test_packed_fields(self):
+        (rows, after) = self.tracks['rows'].point_page(limit=12)
+        (packed, after) = self.tracks['packed'].point_page(limit=12)
+
+        for (row, point) in zip(rows, packed):
+            self.assertIsNone(point[0])
+            self.assertEqual(row[2:], point[2:])
+
+    def test_view(self):
+        url = '/trips/track/%d/points' % self.tracks['packed'].id
+        response = self.client.get(url, {'limit': 5})
+        self.assertEqual(response.status_code, 200)
+        first = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(first['points']), 5)
+
+        response = self.client.get(url, {'limit': 10, 'after': first['next']})
+        rest = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(rest['points']), 7)
+        self.assertIsNone(rest['next'])
+
+    def test_bad_parameters(self):
+        record = self.tracks['rows']
+        for (url, parameters) in (
+                ('/trips/track/%d/points' % record.id, {'limit': 0}),
+                ('/trips/track/%d/points' % record.id, {'limit': 'ten'}),
+                ('/trips/track/%d/points' % record.id, {'after': '12'}),
+                ('/trips/track/%d/points' % record.id, {'after': 'a:b'}),
+                ('/trips/track/%d/geojson' % record.id, {'zoom': -1}),
+                ('/trips/track/%d/geojson' % record.id, {'zoom': 'far'}),
+                ('/trips/search', {'bbox': '171,-43,172'}),
+                ('/trips/search', {'near': 'here'}),
+                ('/trips/search', {'near': '-43,171', 'k': 0}),
+                ('/trips/search', {'near': '-43,171', 'radius': 'far'}),
+                ('/trips/search', {'bbox': '171,-43,172,-42', 'limit': -1}),
+                ('/geolib/places', {'q': 'arthur', 'limit': 'all'}),
+                ('/geolib/places', {'near': '-43'}),
+        ):
+            response = self.client.get(url, parameters)
+            self.assertEqual(
+                response.status_code, 400, msg='%s %s' % (url, parameters))
+            self.assertIn(
+                'error', json.loads(response.content.decode('utf-8')))
+
+        response = self.client.get(
+            '/trips/track/%d/points' % record.id, {'limit': 10 ** 6})
+        self.assertEqual(
+            len(json.loads(response.content.decode('utf-8'))['points']), 12)
+
+
+class ChangingTests(FilespaceTestCase):
+    """Statistics adjusted as points change equal those found afresh."""
+
+    def setUp(self):
+        super(ChangingTests, self).setUp()
+        self.inject(gpx(track('Day one', gpx_points('trkpt', 30))))
+        self.segment = models.TrackSegment.objects.get()
+        self.track = self.segment.track
+
+        # Up and down, so that smoothing changes the climb.
+        for point in models.TrackPoint.objects.all():
+            point.elevation = 700 + 40 * (point.ordinal % 7 in (2, 3))
+            point.save(statistics=False)
+        self.segment.update_statistics()
+        self.track.update_statistics()
+
+    def point(self, ordinal):
+        return models.TrackPoint.objects.filter(
+            segment=self.segment, ordinal=ordinal).first()
+
+    def new_point(self, ordinal, longitude, latitude, elevation=None,
+                  minutes=0):
+        return models.TrackPoint(
+            segment=self.segment, ordinal=ordinal,
+            longitude=longitude, latitude=latitude, elevation=elevation,
+            time=datetime.datetime(
+                2017, 1, 2, 3, 4, 5, tzinfo=timezone.utc) +
+            datetime.timedelta(minutes=minutes),
+            geom=GEOSGeometry(
+                'POINT(%s %s)' % (longitude, latitude), srid=4326))
+
+    def assertRecomputed(self):
+        for record in (self.segment, self.track):
+            model = type(record)
+            stored = model.objects.filter(id=record.id).values(
+                *model.STATISTICS).get()
+            record.update_statistics()
+            expected = model.objects.filter(id=record.id).values(
+                *model.STATISTICS).get()
+
+            for key in model.STATISTICS:
+                if isinstance(expected[key], float):
+                    self.assertAlmostEqual(
+                        stored[key], expected[key], places=6, msg=key)
+                else:
+                    self.assertEqual(stored[key], expected[key], msg=key)
+
+    def test_edit(self):
+        point = self.point(15)
+        point.elevation = 900.0
+        point.latitude += 0.01
+        point.save()
+        self.assertRecomputed()
+
+        point.elevation = None
+        point.save()
+        self.assertRecomputed()
+
+    def test_edit_near_ends(self):
+        for ordinal in (1, 28):
+            point = self.point(ordinal)
+            point.elevation = 650.0
+            point.save()
+            self.assertRecomputed()
+
+    def test_edit_bounds(self):
+        # The first point has the least longitude and time, the last the
+        # greatest.
+        point = self.point(0)
+        point.longitude = 171.51
+        point.time += datetime.timedelta(minutes=5)
+        point.save()
+        self.assertRecomputed()
+
+        point = self.point(29)
+        point.latitude = -43.0
+        point.save()
+        self.assertRecomputed()
+
+    def test_insert(self):
+        self.new_point(10, 171.6, -42.8, 760.0, minutes=10).save()
+        self.assertRecomputed()
+
+        self.new_point(30, 171.53, -42.87, minutes=30).save()
+        self.assertRecomputed()
+
+        self.new_point(-1, 171.4, -43.1, 690.0, minutes=-1).save()
+        self.assertRecomputed()
+        self.assertEqual(self.segment.point_count, 33)
+
+    def test_delete(self):
+        for ordinal in (12, 0, 29, 1):
+            self.point(ordinal).delete()
+            self.assertRecomputed()
+        self.assertEqual(self.track.point_count, 26)
+
+
+class ExportTests(FilespaceTestCase):
+    """A trip exported as gpx holds the data it was injected from."""
+
+    text = gpx(
+        '<wpt lat="-42.950000" lon="171.550000"><ele>800</ele>'
+        '<name>Hut &amp; shelter</name><sym>Lodge</sym></wpt>',
+        route('Pass', gpx_points('rtept', 4)),
+        track('Day one', gpx_points('trkpt', 7),
+              gpx_points('trkpt', 3, latitude=-43.0)),
+    )
+
+    def export(self, size=256):
+        chunks = list(gpxwriter.trip_gpx(self.trip, size=size))
+        self.assertGreater(len(chunks), 1)
+        return gpxpy.parse(''.join(chunks))
+
+    def points(self, points):
+        return [
+            (round(point.latitude, 6), round(point.longitude, 6),
+             point.elevation, point.time)
+            for point in points
+        ]
+
+    def assertRoundTrip(self, storage):
+        self.inject(self.text, storage=storage)
+        (source, exported) = (gpxpy.parse(self.text), self.export())
+
+        self.assertEqual(exported.name, self.trip.name)
+        self.assertEqual(
+            [(waypoint.name, waypoint.symbol, waypoint.elevation)
+             for waypoint in exported.waypoints],
+            [('Hut & shelter', 'Lodge', 800.0)])
+        self.assertEqual(
+            self.points(exported.waypoints), self.points(source.waypoints))
+
+        self.assertEqual([route.name for route in exported.routes], ['Pass'])
+        self.assertEqual(
+            self.points(exported.routes[0].points),
+            self.points(source.routes[0].points))
+
+        self.assertEqual(
+            [track.name for track in exported.tracks], ['Day one'])
+        self.assertEqual(
+            [self.points(segment.points)
+             for segment in exported.tracks[0].segments],
+            [self.points(segment.points)
+             for segment in source.tracks[0].segments])
+
+    def test_rows(self):
+        self.assertRoundTrip('rows')
+
+    def test_packed(self):
+        self.assertRoundTrip('packed')
+
+    def test_view(self):
+        self.inject(self.text)
+        response = self.client.get(
+            '/trips/%s/gpx' % self.trip.identifier())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="%s.gpx"' % self.trip.slug())
+        exported = gpxpy.parse(
+            b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(
+            [len(segment.points) for segment in exported.tracks[0].segments],
+            [7, 3])
+
+
+class TrackLevelTests(FilespaceTestCase):
+    """Simplified levels are built on injection, and drawn by zoom."""
+
+    def setUp(self):
+        super(TrackLevelTests, self).setUp()
+        # A zigzag 55 metres wide and 16 kilometres long.
+        start = datetime.datetime(2017, 1, 2, 3, 4, 5)
+        self.inject(gpx(track('Day one', ''.join(
+            '<trkpt lat="%.6f" lon="%.6f"><time>%s</time></trkpt>' % (
+                -42.9 + 0.0005 * (n % 2), 171.5 + 0.001 * n,
+                (start + datetime.timedelta(minutes=n)).isoformat() + 'Z')
+            for n in range(200)))))
+        self.record = models.Track.objects.get()
+
+    def test_levels(self):
+        levels = list(self.record.levels.order_by('zoom'))
+
+        self.assertEqual(
+            [level.zoom for level in levels], settings.TRACK_LEVELS)
+        counts = [level.point_count for level in levels]
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(counts[0], 2)
+        self.assertEqual(counts[-1], 200)
+        for level in levels:
+            self.assertEqual(level.geom.num_points, level.point_count)
+
+    def test_rebuild(self):
+        self.record.build_levels()
+        self.assertEqual(
+            self.record.levels.count(), len(settings.TRACK_LEVELS))
+
+    def test_geometry(self):
+        levels = dict(self.record.levels.values_list('zoom', 'point_count'))
+
+        self.assertEqual(
+            self.record.geometry(5).num_points, levels[min(levels)])
+        self.assertEqual(self.record.geometry(7).num_points, levels[9])
+        self.assertEqual(self.record.geometry(9).num_points, levels[9])
+        self.assertEqual(
+            self.record.geometry(max(levels) + 1), self.record.geom)
+        self.assertEqual(self.record.geometry(), self.record.geom)
+
+
+class LoadSheetsTests(FilespaceTestCase):
+    """Reloading the sheet grid keeps the sheets related to tracks."""
+
+    def load(self, *sheets):
+        path = os.path.join(settings.STATICFILES_DIR, 'sheets.csv')
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write('sheet_code,sheet_name,WKT\n')
+            for (identifier, name, xmin, ymin) in sheets:
+                polygon = Polygon.from_bbox(
+                    (xmin, ymin, xmin + 0.5, ymin + 0.5))
+                f.write('%s,%s,"%s"\n' % (identifier, name, polygon.wkt))
+
+        call_command(
+            'loadsheets', 'topo50', path, srid='WGS84', stdout=io.StringIO())
+
+    def identifiers(self, queryset):
+        return sorted(queryset.values_list('identifier', flat=True))
+
+    def test_reload(self):
+        self.load(
+            ('BX01', 'Kaikoura', 171.0, -43.0),
+            ('BX02', 'Arthurs Pass', 171.5, -43.0),
+            ('BX03', 'Lake Coleridge', 172.0, -43.0))
+        self.inject(gpx(track(
+            'Day one', gpx_points('trkpt', 200, longitude=171.4))))
+        record = models.Track.objects.get()
+        self.assertEqual(
+            self.identifiers(record.sheets), ['BX01', 'BX02'])
+        updated = Topo50.objects.get(identifier='BX01').updated
+
+        self.load(
+            ('BX01', 'Kaikoura', 171.0, -43.0),
+            ('BX02', 'Arthurs Pass Village', 171.5, -43.0),
+            ('BX04', 'Hanmer Springs', 172.5, -43.0))
+
+        self.assertEqual(
+            self.identifiers(Topo50.objects), ['BX01', 'BX02', 'BX04'])
+        self.assertEqual(
+            Topo50.objects.get(identifier='BX02').sheet_name,
+            'Arthurs Pass Village')
+        self.assertEqual(
+            Topo50.objects.get(identifier='BX01').updated, updated)
+        self.assertEqual(
+            self.identifiers(record.sheets), ['BX01', 'BX02'])
+
+
+class PhotoStorageTests(FilespaceTestCase):
+    """Photos are stored once, and found by their trip's manifest."""
+
+    def receive(self, trip, *names):
+        return models.Photo.receive(trip, [
+            SimpleUploadedFile(name, b'not really a jpeg') for name in names])
+
+    def test_receive(self):
+        other = models.Trip.objects.create(name='Other trip')
+        self.receive(self.trip, 'a.jpg', 'b.jpg')
+        self.receive(other, 'c.jpg')
+
+        self.assertEqual(models.Blob.objects.count(), 1)
+        for photo in models.Photo.objects.all():
+            self.assertEqual(photo.status, 'queued')
+            self.assertEqual(photo.tripfile.filename, photo.filename)
+            self.assertEqual(
+                os.path.dirname(photo.filepath()), photo.trip.filespace())
+            with open(photo.filepath(), 'rb') as f:
+                self.assertEqual(f.read(), b'not really a jpeg')
+            # A copy, since photos are geotagged in place.
+            self.assertEqual(os.stat(photo.filepath()).st_nlink, 1)
+
+    def test_receive_again(self):
+        self.receive(self.trip, 'a.jpg')
+        models.Photo.objects.update(status='tagged')
+        self.receive(self.trip, 'a.jpg')
+
+        photo = models.Photo.objects.get()
+        self.assertEqual(photo.status, 'queued')
+        self.assertEqual(self.trip.files.count(), 1)
+
+    def test_rename(self):
+        filespace = self.trip.filespace()
+        self.receive(self.trip, 'a.jpg')
+        self.trip.name = 'Renamed trip'
+        self.trip.save()
+
+        photo = models.Photo.objects.get()
+        self.assertEqual(self.trip.filespace(), filespace)
+        self.assertTrue(os.path.isfile(photo.filepath()))
+        self.assertTrue(self.trip.files.get().is_current())
+
+
+class PhotoQueueTests(FilespaceTestCase):
+    """Received photos are claimed once, requeued if stale, and ingested.
+    """
+
+    def receive(self, **contents):
+        return models.Photo.receive(self.trip, [
+            SimpleUploadedFile(name, content)
+            for (name, content) in sorted(contents.items())])
+
+    def status(self, photo_id):
+        return models.Photo.objects.get(id=photo_id).status
+
+    def test_claim(self):
+        self.receive(**{
+            'a.jpg': jpeg(), 'b.jpg': jpeg('2017:01:02 15:04:05'),
+            'c.jpg': b'not really a jpeg'})
+
+        first = models.Photo.claim(2)
+        second = models.Photo.claim(2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(models.Photo.claim(2), [])
+        for photo_id in first + second:
+            self.assertEqual(self.status(photo_id), 'processing')
+
+    def test_requeue_stale(self):
+        self.receive(**{'a.jpg': jpeg(), 'b.jpg': b'not really a jpeg'})
+        (stale, alive) = models.Photo.claim(2)
+        models.Photo.objects.filter(id=stale).update(
+            updated=timezone.now() - datetime.timedelta(
+                seconds=settings.JOB_TIMEOUT + 1))
+
+        models.Photo.requeue_stale()
+
+        self.assertEqual(self.status(stale), 'queued')
+        self.assertEqual(self.status(alive), 'processing')
+        self.assertEqual(models.Photo.claim(2), [stale])
+
+    def test_process(self):
+        self.receive(**{
+            'a.jpg': jpeg('2017:01:02 15:04:05'), 'b.jpg': jpeg(),
+            'c.jpg': b'not really a jpeg'})
+        models.Photo.process(models.Photo.claim(3))
+
+        (timed, untimed, broken) = models.Photo.objects.order_by('filename')
+        self.assertEqual(timed.status, 'new')
+        self.assertEqual(
+            timed.camera_time,
+            datetime.datetime(2017, 1, 2, 2, 4, 5, tzinfo=timezone.utc))
+        self.assertEqual((timed.width, timed.height), (40, 30))
+        self.assertEqual(timed.digest, timed.tripfile.digest)
+        for size in settings.PHOTO_THUMBNAIL_SIZES:
+            self.assertTrue(os.path.isfile(
+                photos.thumbnail_path(timed.digest, size)))
+
+        self.assertEqual(untimed.status, 'unlocated')
+        self.assertEqual(untimed.error, 'No camera time in EXIF data.')
+        self.assertEqual(broken.status, 'unlocated')
+        self.assertIsNone(broken.width)
+        self.assertTrue(broken.error)
+
+
+class ReconcileTests(FilespaceTestCase):
+    """reconcilefiles brings the manifest up to date with the filespace.
+    """
+
+    def setUp(self):
+        super(ReconcileTests, self).setUp()
+        for (filename, content) in (('a.txt', b'first'), ('b.txt', b'second')):
+            models.TripFile.store(self.trip, filename, [content])
+
+    def write(self, filename, content):
+        # As an editor would, rather than writing through the blob's link.
+        filepath = os.path.join(self.trip.filespace(), filename)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        with open(filepath, 'wb') as f:
+            f.write(content)
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command('reconcilefiles', *args, stdout=out)
+        return [line.split(': ', 1)[1] for line in out.getvalue().splitlines()
+                if ': ' in line]
+
+    def digests(self):
+        return models.TripFile.digests(self.trip)
+
+    def test_current(self):
+        self.write('b.txt', b'second')
+        self.assertEqual(self.reconcile(), [])
+        self.assertTrue(self.trip.files.get(filename='b.txt').is_current())
+
+    def test_added_and_changed(self):
+        old = self.digests()['a.txt']
+        self.write('a.txt', b'edited')
+        self.write('c.txt', b'third')
+
+        self.assertEqual(
+            self.reconcile(), ['a.txt changed', 'c.txt added'])
+        digests = self.digests()
+        self.assertEqual(digests['a.txt'], blobstore.digest_file(
+            os.path.join(self.trip.filespace(), 'a.txt')))
+        self.assertNotEqual(digests['a.txt'], old)
+        self.assertIn('c.txt', digests)
+        with open(blobstore.blob_path(old), 'rb') as f:
+            self.assertEqual(f.read(), b'first')
+
+    def test_dry_run(self):
+        self.write('c.txt', b'third')
+        os.remove(os.path.join(self.trip.filespace(), 'b.txt'))
+
+        self.assertEqual(
+            self.reconcile('--dry-run'), ['b.txt restored', 'c.txt added'])
+        self.assertEqual(sorted(self.digests()), ['a.txt', 'b.txt'])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.trip.filespace(), 'b.txt')))
+
+    def test_restored(self):
+        os.remove(os.path.join(self.trip.filespace(), 'b.txt'))
+
+        self.assertEqual(self.reconcile(), ['b.txt restored'])
+        self.assertTrue(self.trip.files.get(filename='b.txt').is_current())
+
+    def test_prune_and_collect(self):
+        digest = self.digests()['b.txt']
+        os.remove(os.path.join(self.trip.filespace(), 'b.txt'))
+
+        self.assertEqual(self.reconcile('--prune'), ['b.txt removed'])
+        self.assertEqual(sorted(self.digests()), ['a.txt'])
+        self.assertTrue(os.path.exists(blobstore.blob_path(digest)))
+
+        out = io.StringIO()
+        call_command('reconcilefiles', '--collect', stdout=out)
+        self.assertIn('%s unused' % digest, out.getvalue())
+        self.assertFalse(os.path.exists(blobstore.blob_path(digest)))
+        self.assertFalse(models.Blob.objects.filter(digest=digest).exists())
+        self.assertTrue(models.Blob.objects.filter(
+            digest=self.digests()['a.txt']).exists())
+
+
+class SpatialTests(FilespaceTestCase):
+    """Spatial queries find the same rows as a scan of the table."""
+
+    def setUp(self):
+        super(SpatialTests, self).setUp()
+        for (name, longitude, latitude) in (
+                ('Hut', 171.5, -42.9),
+                ('Bridge', 171.51, -42.9),
+                ('Saddle', 171.6, -42.9),
+                ('Summit', 175.0, -41.3)):
+            models.Waypoint.objects.create(
+                trip=self.trip, name=name, latitude=latitude,
+                longitude=longitude,
+                geom=GEOSGeometry(
+                    'POINT(%s %s)' % (longitude, latitude), srid=4326))
+        self.queryset = models.Waypoint.objects.all()
+
+    def names(self, found):
+        return [record.name for (metres, record) in found]
+
+    def test_in_bbox(self):
+        found = spatial.in_bbox(
+            self.queryset, (171.45, -42.95, 171.55, -42.85))
+        self.assertEqual(
+            sorted(record.name for record in found), ['Bridge', 'Hut'])
+
+    def test_within(self):
+        found = spatial.within(self.queryset, 171.5, -42.9, 1000)
+
+        self.assertEqual(self.names(found), ['Hut', 'Bridge'])
+        self.assertEqual(found[0][0], 0)
+        self.assertAlmostEqual(
+            found[1][0], haversine(171.5, -42.9, 171.51, -42.9))
+
+    def test_nearest(self):
+        found = spatial.nearest(self.queryset, 171.5, -42.9, k=3, start=100)
+        self.assertEqual(self.names(found), ['Hut', 'Bridge', 'Saddle'])
+
+        found = spatial.nearest(self.queryset, 171.5, -42.9, k=10)
+        self.assertEqual(
+            self.names(found), ['Hut', 'Bridge', 'Saddle', 'Summit'])
+
+    def test_view(self):
+        response = self.client.get(
+            '/trips/search',
+            {'kind': 'waypoint', 'near': '-42.9,171.5', 'k': '2'})
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content.decode('utf-8'))['results']
+        self.assertEqual(
+            [result['id'] for result in results],
+            [self.queryset.get(name=name).id for name in ('Hut', 'Bridge')])
+
+
+class AnalysisCacheTests(FilespaceTestCase):
+    """Analyses are kept while a file is unchanged, then made again."""
+
+    def setUp(self):
+        super(AnalysisCacheTests, self).setUp()
+        self.cache = models.GPXAnalysisCache(size=2)
+        self.filepath = self.write('a.gpx', 'Day one', 5)
+
+    def write(self, filename, name, count, mtime=1500000000):
+        filepath = os.path.join(settings.STATICFILES_DIR, filename)
+        with io.open(filepath, 'w', encoding='utf-8') as f:
+            f.write(gpx(track(name, gpx_points('trkpt', count))))
+        os.utime(filepath, (mtime, mtime))
+        return filepath
+
+    def analyse(self, cache=None, filepath=None):
+        return (cache or self.cache).analyse(
+            filepath or self.filepath, self.trip)['tracks'][0]
+
+    def test_unchanged(self):
+        self.assertEqual(self.analyse()['points'], 5)
+        self.assertEqual(
+            models.GPXAnalysis.objects.get().path, self.filepath)
+
+        # Same size and mtime: taken to be the same file, in process
+        # and by another process reading the table.
+        self.write('a.gpx', 'Day two', 5)
+        self.assertEqual(self.analyse()['name'], 'Day one')
+        self.assertEqual(
+            self.analyse(models.GPXAnalysisCache())['name'], 'Day one')
+
+    def test_changed(self):
+        self.analyse()
+        self.write('a.gpx', 'Day one', 6)
+        self.assertEqual(self.analyse()['points'], 6)
+
+        self.write('a.gpx', 'Day two', 6, mtime=1500000060)
+        self.assertEqual(self.analyse()['name'], 'Day two')
+        self.assertEqual(models.GPXAnalysis.objects.count(), 1)
+
+    def test_invalidate(self):
+        self.analyse()
+        self.write('a.gpx', 'Day two', 5)
+        self.cache.invalidate(self.filepath)
+
+        self.assertFalse(models.GPXAnalysis.objects.exists())
+        self.assertEqual(self.analyse()['name'], 'Day two')
+
+    def test_evict(self):
+        self.analyse()
+        for filename in ('b.gpx', 'c.gpx'):
+            self.analyse(filepath=self.write(filename, 'Day one', 5))
+
+        self.assertEqual(
+            [os.path.basename(path) for path in self.cache.entries],
+            ['b.gpx', 'c.gpx'])
+        self.assertEqual(models.GPXAnalysis.objects.count(), 3)
+
+    def test_digest(self):
+        other = models.Trip.objects.create(name='Other trip')
+        content = gpx(track('Day one', gpx_points('trkpt', 5)))
+        results = [
+            models.TripFile.store(
+                trip, filename, [content.encode('utf-8')]).analysis()
+            for (trip, filename) in ((self.trip, 'a.gpx'), (other, 'b.gpx'))]
+
+        self.assertEqual(
+            [result['name'] for result in results], ['a.gpx', 'b.gpx'])
+        self.assertEqual(results[1]['url'], other.url + '/file/b.gpx')
+        self.assertEqual(
+            models.GPXAnalysis.objects.get().path,
+            'sha1:' + models.TripFile.objects.get(filename='a.gpx').digest)
+
+
+class JobTests(FilespaceTestCase):
+    """Jobs are claimed once, retried while stale, and fail in the end."""
+
+    def age(self, *jobs):
+        models.Job.objects.filter(id__in=[job.id for job in jobs]).update(
+            updated=timezone.now() - datetime.timedelta(
+                seconds=settings.JOB_TIMEOUT + 1))
+
+    def status(self, job):
+        return models.Job.objects.get(id=job.id).status
+
+    def test_submit(self):
+        job = models.Job.submit(self.trip, 'a.gpx')
+        self.assertEqual(models.Job.submit(self.trip, 'a.gpx'), job)
+
+        models.Job.objects.update(status='done')
+        self.assertNotEqual(models.Job.submit(self.trip, 'a.gpx'), job)
+
+    def test_claim(self):
+        for filename in ('a.gpx', 'b.gpx', 'c.gpx'):
+            models.Job.submit(self.trip, filename)
+
+        first = models.Job.claim(2)
+        second = models.Job.claim(2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(
+            set(job.id for job in first) & set(job.id for job in second))
+        self.assertEqual(models.Job.claim(2), [])
+
+        for job in first + second:
+            self.assertEqual(job.status, 'running')
+            self.assertEqual(job.attempts, 1)
+
+    def test_requeue_stale(self):
+        (stale, alive, spent) = [
+            models.Job.submit(self.trip, filename)
+            for filename in ('a.gpx', 'b.gpx', 'c.gpx')]
+        models.Job.claim(3)
+        models.Job.objects.filter(id=spent.id).update(
+            attempts=settings.JOB_ATTEMPTS)
+        self.age(stale, alive, spent)
+        models.Job.heartbeat([alive.id])
+
+        models.Job.requeue_stale()
+
+        self.assertEqual(self.status(stale), 'queued')
+        self.assertEqual(self.status(alive), 'running')
+        self.assertEqual(self.status(spent), 'failed')
+        self.assertEqual(
+            models.Job.objects.get(id=spent.id).error,
+            'Worker stopped responding.')
+
+    def test_run(self):
+        models.TripFile.store(self.trip, 'a.gpx', [gpx(track(
+            'Day one', gpx_points('trkpt', 5))).encode('utf-8')])
+        models.Job.submit(self.trip, 'a.gpx')
+
+        (job,) = models.Job.claim(1)
+        job.run()
+
+        job = models.Job.objects.get(id=job.id)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.total, 5)
+        self.assertIsNone(job.error)
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(models.Track.objects.get().point_count, 5)
+
+    def test_failure(self):
+        models.Job.submit(self.trip, 'missing.gpx')
+
+        for attempt in range(1, settings.JOB_ATTEMPTS + 1):
+            (job,) = models.Job.claim(1)
+            job.run()
+
+            job = models.Job.objects.get(id=job.id)
+            self.assertIn('DoesNotExist', job.error)
+            if attempt < settings.JOB_ATTEMPTS:
+                self.assertEqual(job.status, 'queued')
+                self.assertIsNone(job.finished)
+
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(models.Job.claim(1), [])
+
+
+class FromPlacesTests(FilespaceTestCase):
+
+    def setUp(self):
+        super(FromPlacesTests, self).setUp()
+        self.places = [
+            PlaceName.objects.create(
+                identifier=identifier, name=name, key=name.lower(),
+                feature_type='Locality', latitude=latitude,
+                longitude=longitude,
+                geom=GEOSGeometry(
+                    'POINT(%s %s)' % (longitude, latitude), srid=4326))
+            for (identifier, name, longitude, latitude) in (
+                (1, 'Arthurs Pass', 171.56, -42.94),
+                (2, 'Bealey', 171.59, -43.02),
+            )
+        ]
+
+    def test_trip(self):
+        pois = models.PointsOfInterest.from_places(
+            self.places, trip=self.trip)
+
+        self.assertEqual(
+            sorted(poi.name for poi in self.trip.pois.all()),
+            ['Arthurs Pass', 'Bealey'])
+        self.assertEqual(pois[1].provenance, 'linz:2')
+        self.assertEqual(pois[1].gtype, 'Locality')
+
+    def test_template(self):
+        template = models.Template.objects.create(name='Test template')
+        models.PointsOfInterest.from_places(
+            self.places[:1], trip=self.trip, template=template)
+
+        self.assertEqual(
+            [poi.name for poi in template.pois.all()], ['Arthurs Pass'])
+        self.assertEqual(self.trip.pois.count(), 1)
+
+
+class FingerprintTests(SimpleTestCase):
+
+    def points(self, latitude=-42.9):
+        time = datetime.datetime(2017, 1, 2, 3, 4, 5)
+        return [
+            Point(latitude + n * 0.001, 171.5,
+                  time + datetime.timedelta(minutes=n))
+            for n in range(5)
+        ]
+
+    def test_same_points(self):
+        self.assertEqual(
+            feature_fingerprint(Feature('ACTIVE LOG', self.points())),
+            feature_fingerprint(Feature('ACTIVE LOG', self.points())))
+
+    def test_other_points(self):
+        self.assertNotEqual(
+            feature_fingerprint(Feature('ACTIVE LOG', self.points())),
+            feature_fingerprint(Feature('ACTIVE LOG', self.points(-43.0))))
+
+    def test_fewer_points(self):
+        self.assertNotEqual(
+            feature_fingerprint(Feature('ACTIVE LOG', self.points())),
+            feature_fingerprint(Feature('ACTIVE LOG', self.points()[:4])))
+
+    def test_name_and_number(self):
+        fingerprints = set(
+            feature_fingerprint(Feature(name, self.points(), number))
+            for (name, number) in (('A', None), ('B', None), ('A', 1)))
+        self.assertEqual(len(fingerprints), 3)
+
+
+class PackingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.longitudes = [171.5, 171.6, 171.7, 171.8]
+        self.latitudes = [-42.9, -42.8, -42.7, -42.6]
+        self.elevations = [700.5, None, 702.0, 0.0]
+        self.times = [
+            datetime.datetime(2017, 1, 2, 3, 4, 5, 123456,
+                              tzinfo=timezone.utc),
+            None,
+            datetime.datetime(2017, 1, 2, 3, 6, 5),
+            datetime.datetime(1969, 12, 31, 23, 59, 59,
+                              tzinfo=timezone.utc),
+        ]
+        self.fields = packing.pack(
+            self.longitudes, self.latitudes, self.elevations, self.times)
+
+    def test_round_trip(self):
+        self.assertEqual(self.fields['storage'], 'packed')
+        points = list(packing.PackedPoints(Segment(self.fields)))
+
+        self.assertEqual([point.ordinal for point in points], [0, 1, 2, 3])
+        self.assertEqual(
+            [point.longitude for point in points], self.longitudes)
+        self.assertEqual([point.latitude for point in points], self.latitudes)
+        self.assertEqual(
+            [point.elevation for point in points], self.elevations)
+        self.assertEqual(points[0].time, self.times[0])
+        self.assertIsNone(points[1].time)
+        self.assertEqual(
+            points[2].time, timezone.make_aware(self.times[2], timezone.utc))
+        self.assertEqual(points[3].time, self.times[3])
+
+    def test_run(self):
+        columns = dict(
+            (name, self.fields[name][2 * size:4 * size])
+            for (name, size) in packing.COLUMNS)
+        points = list(packing.PackedPoints(
+            Segment(self.fields), columns=columns, start=2))
+
+        self.assertEqual([point.ordinal for point in points], [2, 3])
+        self.assertEqual([point.elevation for point in points], [702.0, 0.0])
+
+    def test_empty(self):
+        fields = packing.pack([], [], [], [])
+        self.assertEqual(len(packing.PackedPoints(Segment(fields))), 0)
+
+
+class SimplifyTests(SimpleTestCase):
+
+    def setUp(self):
+        n = numpy.arange(2000)
+        self.longitudes = 171.5 + n * 0.0001
+        self.latitudes = -42.9 + 0.01 * numpy.sin(n / 50.0)
+
+    def test_budget(self):
+        keep = routing.simplify(
+            self.longitudes, self.latitudes, budget=50, tolerance=0)
+
+        self.assertEqual(len(keep), 50)
+        self.assertEqual(keep, sorted(set(keep)))
+        self.assertEqual((keep[0], keep[-1]), (0, 1999))
+
+    def test_tolerance(self):
+        tolerance = 25.0
+        keep = routing.simplify(
+            self.longitudes, self.latitudes, budget=2000, tolerance=tolerance)
+        self.assertLess(len(keep), 2000)
+
+        (x, y) = routing.planar(self.longitudes, self.latitudes)
+        for (first, last) in zip(keep, keep[1:]):
+            if last - first > 1:
+                self.assertLessEqual(
+                    routing.deviations(x, y, first, last).max(), tolerance)
+
+    def test_straight_line(self):
+        n = numpy.arange(100)
+        keep = routing.simplify(
+            171.5 + n * 0.0001, -42.9 + n * 0.0001, budget=100, tolerance=1)
+        self.assertEqual(keep, [0, 99])
+
+    def test_few_points(self):
+        self.assertEqual(routing.simplify([], []), [])
+        self.assertEqual(routing.simplify([171.5], [-42.9]), [0])
+        self.assertEqual(
+            routing.simplify([171.5, 171.6], [-42.9, -42.8], budget=1),
+            [0, 1])
+
+
+class ClippedTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clip = Polygon.from_bbox((0, 0, 10, 10))
+        self.clip.srid = 4326
+
+    def line(self, *coords):
+        return LineString(coords, srid=4326)
+
+    def test_nothing(self):
+        self.assertIsNone(tiles.clipped(None, self.clip))
+        self.assertIsNone(tiles.clipped(
+            GEOSGeometry('LINESTRING EMPTY', srid=4326), self.clip))
+
+    def test_inside(self):
+        line = self.line((1, 1), (9, 9))
+        self.assertEqual(tiles.clipped(line, self.clip), line)
+
+    def test_outside(self):
+        self.assertIsNone(
+            tiles.clipped(self.line((11, 11), (20, 20)), self.clip))
+
+    def test_crossing(self):
+        part = tiles.clipped(self.line((-5, 5), (15, 5)), self.clip)
+        self.assertEqual(part.geom_type, 'LineString')
+        self.assertEqual(part.extent, (0, 5, 10, 5))
+
+    def test_touching_corner(self):
+        self.assertIsNone(
+            tiles.clipped(self.line((-5, 5), (10, 20)), self.clip))
+
+    def test_touching_twice(self):
+        line = MultiLineString(
+            [self.line((-5, 5), (10, 20)), self.line((15, 5), (0, 20))],
+            srid=4326)
+        self.assertIsNone(tiles.clipped(line, self.clip))
+
+    def test_crossing_and_touching(self):
+        line = MultiLineString(
+            [self.line((-5, 5), (10, 20)), self.line((-5, 2), (15, 2))],
+            srid=4326)
+        part = tiles.clipped(line, self.clip)
+        self.assertEqual(part.geom_type, 'MultiLineString')
+        self.assertEqual(len(part), 1)
+        self.assertEqual(part.extent, (0, 2, 10, 2))
+
+
+class DistanceTests(SimpleTestCase):
+
+    def test_radius_bbox(self):
+        (west, south, east, north) = spatial.radius_bbox(0.0, 0.0, 1000)
+        self.assertAlmostEqual(north, 1000 / (math.pi * EARTH_RADIUS) * 180)
+        self.assertAlmostEqual(east, north)
+        self.assertEqual((west, south), (-east, -north))
+
+        (west, south, east, north) = spatial.radius_bbox(171.5, 89.95, 1e4)
+        self.assertEqual((west, east, north), (-8.5, 351.5, 90.0))
+
+    def test_line_distance(self):
+        line = [(171.4, -42.9), (171.6, -42.9)]
+        degree = math.radians(1) * EARTH_RADIUS
+
+        self.assertAlmostEqual(
+            spatial.line_distance(line, 171.5, -42.91), 0.01 * degree)
+        self.assertAlmostEqual(
+            spatial.line_distance(line, 171.7, -42.9),
+            0.1 * degree * math.cos(math.radians(42.9)))
+        self.assertAlmostEqual(
+            spatial.line_distance(line[:1], 171.4, -42.91), 0.01 * degree)
+
+    def test_distance(self):
+        lines = MultiLineString(
+            LineString((171.4, -42.9), (171.6, -42.9)),
+            LineString((171.4, -43.0), (171.6, -43.0)), srid=4326)
+        self.assertAlmostEqual(
+            spatial.distance(lines, 171.5, -42.99),
+            spatial.line_distance(lines[1].coords, 171.5, -42.99))
+
+
+class BlobStoreTests(SimpleTestCase):
+    """Content is stored once, read only, and linked or copied out."""
+
+    def setUp(self):
+        self.saved = settings.STATICFILES_DIR
+        settings.STATICFILES_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(settings.STATICFILES_DIR)
+        settings.STATICFILES_DIR = self.saved
+
+    def stored(self):
+        return sorted(
+            filename
+            for (directory, names, filenames) in os.walk(blobstore.blob_dir())
+            for filename in filenames)
+
+    def test_write(self):
+        (digest, size) = blobstore.write([b'some ', b'content'])
+        self.assertEqual(digest, hashlib.sha1(b'some content').hexdigest())
+        self.assertEqual(size, 12)
+        self.assertEqual(os.stat(blobstore.blob_path(digest)).st_mode & (
+            stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH), 0)
+
+        self.assertEqual(
+            blobstore.write([b'some content']), (digest, size))
+        self.assertEqual(self.stored(), [digest])
+
+    def test_link(self):
+        (digest, size) = blobstore.write([b'some content'])
+        (linked, copied) = [
+            os.path.join(settings.STATICFILES_DIR, filename)
+            for filename in ('linked.txt', 'copied.txt')]
+        for filepath in (linked, copied):
+            with open(filepath, 'wb') as f:
+                f.write(b'replaced')
+
+        blobstore.link(digest, linked)
+        blobstore.link(digest, copied, copy=True)
+
+        blob = os.stat(blobstore.blob_path(digest))
+        self.assertEqual(os.stat(linked).st_ino, blob.st_ino)
+        self.assertNotEqual(os.stat(copied).st_ino, blob.st_ino)
+        for filepath in (linked, copied):
+            self.assertEqual(blobstore.digest_file(filepath), digest)
+
+    def test_remove(self):
+        (digest, size) = blobstore.write([b'some content'])
+        blobstore.remove(digest)
+        blobstore.remove(digest)
+        self.assertEqual(self.stored(), [])
+
+
+class PhotoTests(SimpleTestCase):
+    """Photos are located on track fixes, and geotagged in place."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # Two segments, the second starting 880 seconds after the first.
+        self.fixes = tuple(numpy.array(column) for column in (
+            [0.0, 60.0, 120.0, 1000.0, 1060.0],
+            [171.0, 171.1, 171.2, 172.0, 172.1],
+            [-43.0, -42.9, -42.8, -42.0, -41.9],
+            [700.0, 710.0, 720.0, 800.0, 810.0],
+            [0, 0, 0, 1, 1],
+        ))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def photo(self, name, camera_time='2017:01:02 15:04:05'):
+        filepath = os.path.join(self.directory, name)
+        with open(filepath, 'wb') as f:
+            f.write(jpeg(camera_time))
+        return filepath
+
+    def test_dms(self):
+        self.assertEqual(
+            photos.dms(-42.5125), ((42, 1), (30, 1), (450000, 10000)))
+        self.assertEqual(photos.rational(1.5, 100), (150, 100))
+
+    def test_gps_ifd(self):
+        time = photos.parse_camera_time('2017:01:02 15:04:05')
+        ifd = photos.gps_ifd(171.5, -42.9, -5.0, time)
+
+        self.assertEqual(ifd[piexif.GPSIFD.GPSLatitudeRef], b'S')
+        self.assertEqual(ifd[piexif.GPSIFD.GPSLongitudeRef], b'E')
+        self.assertEqual(ifd[piexif.GPSIFD.GPSAltitudeRef], 1)
+        self.assertEqual(ifd[piexif.GPSIFD.GPSAltitude], (500, 100))
+        # New Zealand daylight time is thirteen hours ahead of UTC.
+        self.assertEqual(
+            ifd[piexif.GPSIFD.GPSTimeStamp], ((2, 1), (4, 1), (5000, 1000)))
+        self.assertEqual(ifd[piexif.GPSIFD.GPSDateStamp], b'2017:01:02')
+
+        ifd = photos.gps_ifd(171.5, -42.9)
+        self.assertNotIn(piexif.GPSIFD.GPSAltitude, ifd)
+        self.assertNotIn(piexif.GPSIFD.GPSTimeStamp, ifd)
+
+    def test_camera_time(self):
+        time = photos.parse_camera_time('2017:01:02 15:04:05')
+        self.assertEqual(
+            time, datetime.datetime(2017, 1, 2, 2, 4, 5, tzinfo=timezone.utc))
+        self.assertIsNone(photos.parse_camera_time('2017-01-02 15:04'))
+        self.assertIsNone(photos.parse_camera_time(None))
+
+        self.assertEqual(
+            photos.clock_offset(time, time + datetime.timedelta(seconds=90)),
+            90.0)
+
+    def test_correlate(self):
+        (longitudes, latitudes, elevations) = photos.correlate(
+            [30.0, -100.0, 200.0, 900.0, 550.0, 2000.0], self.fixes)
+
+        # Between fixes of a segment, the position is interpolated.
+        self.assertAlmostEqual(longitudes[0], 171.05)
+        self.assertAlmostEqual(latitudes[0], -42.95)
+        self.assertAlmostEqual(elevations[0], 705.0)
+        # Otherwise the nearest fix is taken, if near enough in time,
+        # before the first fix, after a segment, or before the next.
+        self.assertEqual(list(longitudes[1:4]), [171.0, 171.2, 172.0])
+        self.assertTrue(numpy.isnan(longitudes[4:]).all())
+        self.assertTrue(numpy.isnan(elevations[4:]).all())
+
+    def test_correlate_gap(self):
+        (longitudes, latitudes, elevations) = photos.correlate(
+            [20.0, 30.0], self.fixes, max_gap=25)
+
+        self.assertEqual(longitudes[0], 171.0)
+        self.assertTrue(numpy.isnan(longitudes[1]))
+
+    def test_correlate_nothing(self):
+        empty = tuple(numpy.array([]) for column in self.fixes)
+        (longitudes, latitudes, elevations) = photos.correlate([30.0], empty)
+        self.assertTrue(numpy.isnan(longitudes).all())
+
+    def test_write_geotag(self):
+        filepath = self.photo('a.jpg')
+        time = photos.parse_camera_time('2017:01:02 15:04:05')
+
+        self.assertEqual(
+            photos.write_geotag((filepath, 171.5, -42.9, 700.0, time)),
+            (filepath, None))
+
+        exif = piexif.load(filepath)
+        self.assertEqual(
+            exif['GPS'][piexif.GPSIFD.GPSLatitude], photos.dms(-42.9))
+        self.assertEqual(
+            photos.camera_time_text(exif), '2017:01:02 15:04:05')
+
+        missing = os.path.join(self.directory, 'missing.jpg')
+        (filepath, error) = photos.write_geotag(
+            (missing, 171.5, -42.9, None, None))
+        self.assertIsNotNone(error)
+
+    def test_linked_twin(self):
+        filepath = self.photo('a.jpg')
+        twin = os.path.join(self.directory, 'twin.jpg')
+        os.link(filepath, twin)
+
+        photos.write_geotag((filepath, 171.5, -42.9, None, None))
+
+        self.assertEqual(os.stat(filepath).st_nlink, 1)
+        self.assertTrue(piexif.load(filepath)['GPS'])
+        self.assertFalse(piexif.load(twin)['GPS'])
+
+
+class POIConversionTests(TransactionTestCase):
+    """Migration 0015 parses the text columns of points of interest."""
+
+    before = [('trips', '0014_poi_typed_columns')]
+    after = [('trips', '0015_poi_convert')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_convert(self):
+        apps = self.migrate(self.before)
+        model = apps.get_model('trips', 'PointsOfInterest')
+        geom = 'SRID=4326;POINT(171.5 -42.9)'
+        valid = model.objects.create(
+            latitude='-42.9', longitude=' 171.5 ', elevation='1234.5',
+            time='2017-01-02T03:04:05', geom=geom)
+        invalid = model.objects.create(
+            latitude='south', longitude='', elevation=None,
+            time='yesterday', geom=geom)
+
+        apps = self.migrate(self.after)
+        model = apps.get_model('trips', 'PointsOfInterest')
+
+        valid = model.objects.get(id=valid.id)
+        self.assertEqual(valid.typed_latitude, -42.9)
+        self.assertEqual(valid.typed_longitude, 171.5)
+        self.assertEqual(valid.typed_elevation, 1234.5)
+        self.assertEqual(valid.typed_time, datetime.datetime(
+            2017, 1, 2, 3, 4, 5, tzinfo=timezone.utc))
+
+        invalid = model.objects.get(id=invalid.id)
+        for name in ('latitude', 'longitude', 'elevation', 'time'):
+            self.assertIsNone(getattr(invalid, 'typed_' + name))
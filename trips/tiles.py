@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""GeoJSON map tiles of a trip's tracks, routes, waypoints and POIs.
+
+Tiles are addressed z/x/y, as for web map (slippy map) tiles, and
+carry the features of a trip which cross them: tracks at the stored
+simplification level for the zoom (see Track.build_levels), routes
+simplified on the fly, and points. Lines are clipped to the tile,
+plus a buffer of a few pixels so that they join up when drawn, and
+coordinates are rounded to a fraction of a pixel.
+
+Generated tiles are cached on disk, under TILE_DIR/<trip id>/. The
+cache of a trip is dropped by invalidate() whenever data is injected
+into it or its track levels are rebuilt.
+"""
+from __future__ import unicode_literals
+
+import json
+import math
+import os
+import shutil
+import tempfile
+
+from django.contrib.gis.geos import LineString, MultiLineString, Polygon
+from django.db.models import Q
+
+import trips.settings as settings
+
+
+def tile_bounds(z, x, y):
+    """Return (west, south, east, north) of a tile, in degrees."""
+
+    n = 2.0 ** z
+
+    def latitude(row):
+        radians = math.atan(math.sinh(math.pi * (1 - 2 * row / n)))
+        return math.degrees(radians)
+
+    return (x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180,
+            latitude(y))
+
+
+def pixel(z):
+    """Width of a tile pixel in degrees of longitude."""
+
+    return 360.0 / (256 * 2 ** z)
+
+
+def precision(z):
+    """Decimal places which resolve a quarter of a pixel."""
+
+    return max(0, int(math.ceil(-math.log10(pixel(z) / 4))))
+
+
+def rounded(coords, digits):
+    """Round nested coordinate tuples, as lists for json."""
+
+    if isinstance(coords[0], (tuple, list)):
+        return [rounded(c, digits) for c in coords]
+    return [round(c, digits) for c in coords[:2]]
+
+
+def feature(kind, record, geom, digits):
+    return {
+        'type': 'Feature',
+        'geometry': {
+            'type': geom.geom_type,
+            'coordinates': rounded(geom.coords, digits),
+        },
+        'properties': {
+            'kind': kind,
+            'id': record.id,
+            'name': record.name,
+            'url': getattr(record, 'url', None),
+        },
+    }
+
+
+def clipped(geom, clip):
+    """The lines of a line geometry within clip, or None."""
+
+    if geom is None or geom.empty:
+        return None
+    if clip.contains(geom):
+        return geom
+
+    part = geom.intersection(clip)
+    if part.empty:
+        return None
+    if part.geom_type in ('LineString', 'MultiLineString'):
+        return part
+    if part.geom_type != 'GeometryCollection':
+        return None  # Only touches the clip, at a point or points.
+
+    # Lines touching the clip edge give a collection with points.
+    lines = [g for g in part if g.geom_type == 'LineString']
+    if not lines:
+        return None
+
+    return MultiLineString(lines, srid=geom.srid)
+
+
+def route_line(route):
+    """A route's line geometry, or else its points as a line."""
+
+    if route.geom is not None:
+        return route.geom
+
+    coords = list(route.routepoint_set.order_by('ordinal').values_list(
+        'longitude', 'latitude'))
+    coords = [c for c in coords if None not in c]
+    if len(coords) < 2:
+        return None
+
+    return LineString(coords, srid=4326)
+
+
+def trip_tile(trip, z, x, y):
+    """Return a GeoJSON FeatureCollection of a trip's data in a tile."""
+
+    (west, south, east, north) = tile_bounds(z, x, y)
+    buffer = settings.TILE_BUFFER * pixel(z)
+    clip = Polygon.from_bbox(
+        (west - buffer, south - buffer, east + buffer, north + buffer))
+    clip.srid = 4326
+    digits = precision(z)
+    features = []
+
+    tracks = trip.track_set.filter(
+        xmin__lte=east + buffer, xmax__gte=west - buffer,
+        ymin__lte=north + buffer, ymax__gte=south - buffer,
+    ).defer('geom')
+    for track in tracks:
+        geom = clipped(track.geometry(z), clip)
+        if geom is not None:
+            features.append(feature('track', track, geom, digits))
+
+    # Routes not yet given a line (see convert_to_route) are drawn
+    # from their points, so can't be filtered on the database.
+    routes = trip.route_set.filter(
+        Q(geom__isnull=True) | Q(geom__intersects=clip))
+    for route in routes:
+        line = route_line(route)
+        if line is None:
+            continue
+        geom = clipped(line.simplify(pixel(z)), clip)
+        if geom is not None:
+            features.append(feature('route', route, geom, digits))
+
+    waypoints = trip.waypoint_set.filter(
+        longitude__gte=west, longitude__lt=east,
+        latitude__gt=south, latitude__lte=north,
+    )
+    for waypoint in waypoints:
+        features.append(
+            feature('waypoint', waypoint, waypoint.geom, digits))
+
+    bounds = Polygon.from_bbox((west, south, east, north))
+    bounds.srid = 4326
+    for poi in trip.pois.filter(geom__intersects=bounds):
+        features.append(feature('poi', poi, poi.geom, digits))
+
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def trip_dir(trip):
+    return os.path.join(
+        settings.STATICFILES_DIR, settings.TILE_DIR, str(trip.id))
+
+
+def tile_path(trip, z, x, y):
+    return os.path.join(trip_dir(trip), str(z), str(x), '%d.json' % y)
+
+
+def cached_tile(trip, z, x, y):
+    """Return a tile as json text, from the disk cache if possible."""
+
+    filepath = tile_path(trip, z, x, y)
+    try:
+        with open(filepath, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        pass
+
+    data = json.dumps(
+        trip_tile(trip, z, x, y), separators=(',', ':')).encode('utf-8')
+
+    directory = os.path.dirname(filepath)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass  # Made by another request.
+
+    (handle, temporary) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'wb') as f:
+        f.write(data)
+    os.rename(temporary, filepath)
+
+    return data
+
+
+def invalidate(trip):
+    """Drop all cached tiles of a trip."""
+
+    directory = trip_dir(trip)
+    if not os.path.isdir(directory):
+        return
+
+    # Move the tiles aside first, so none are served while deleting.
+    (parent, name) = os.path.split(directory)
+    doomed = tempfile.mkdtemp(dir=parent, prefix=name + '.')
+    os.rename(directory, os.path.join(doomed, name))
+    shutil.rmtree(doomed, ignore_errors=True)
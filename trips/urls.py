@@ -8,9 +8,18 @@ import views
 
 urlpatterns = [
     url(r'^$', views.index, name='index'),
+    url(r'^([0-9a-f\-]*)/download/([\-\w\s\.]*)$', views.download),
     url(r'^([0-9a-f\-]*)/file/([\-\w\s\.]*)', views.viewfile),    
+    url(r'^([0-9a-f\-]*)/gpx$', views.export),
+    url(r'^([0-9a-f\-]*)/mappack$', views.mappack_download),
+    url(r'^([0-9a-f\-]*)/places$', views.addplaces),
+    url(r'^([0-9a-f\-]*)/tiles/([0-9]+)/([0-9]+)/([0-9]+)$', views.tile),
     url(r'^([0-9a-f\-]*)$', views.triptemplate),
     url(r'^([0-9a-f\-]*)/$', views.triptemplate),
     url(r'^newtrip/$', views.newtrip),
+    url(r'^search$', views.search),
+    url(r'^job/([0-9]+)$', views.job),
+    url(r'^track/([0-9]+)/geojson$', views.track_geometry),
+    url(r'^track/([0-9]+)/points$', views.track_points),
     url(r'^([\w]+)/([0-9]*)', views.viewdata),
 ]
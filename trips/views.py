@@ -1,11 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-import os
+import json
+import mimetypes
 
-from django.shortcuts import render
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.http import HttpResponseBadRequest
+from django.http import StreamingHttpResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.views.decorators.http import etag
+
+from geolib.models import PlaceName
 import trips.forms as forms
+import trips.gpxwriter as gpxwriter
+import trips.mappack as mappack
 import trips.models as models
+import trips.settings as settings
+import trips.spatial as spatial
+import trips.tiles as tiles
 
 
 def index(request):
@@ -48,7 +60,6 @@ def newtrip(request):
 def triptemplate(request, identifier):
 
     trip = None
-    directory = None
 
     trips = models.Trip.objects.filter(id__startswith=identifier)
 
@@ -59,20 +70,26 @@ def triptemplate(request, identifier):
 
     if request.POST:
 
-        if request.FILES:
-            trip.save(files=request.FILES)
+        # Photos are queued for ingestion by the runphotos command.
+        photos = request.FILES.getlist('uploadPhotos')
+        if photos:
+            models.Photo.receive(trip, photos)
+
+        files = request.FILES.copy()
+        files.pop('uploadPhotos', None)
+        if files:
+            trip.save(files=files)
 
         trip = models.Trip.objects.get(id=trip.id)
 
-    # Read and analyse any gpx files
+    # Read and analyse any gpx files, from the analysis cache.
     gpxfiles = []
-
-    for gpxfile in trip.directory().model['gpx']:
-        filepath = os.path.join(trip.filespace(), gpxfile)
-        if os.path.isfile(filepath):
-            f = open(filepath)
-            gpxf = models.GPXFile(f, trip)
-            gpxfiles.append(gpxf.analyse())
+    tracks = []
+    sheets = []
+    if trip:
+        gpxfiles = trip.gpxfiles()
+        tracks = trip.track_set.prefetch_related('sheets')
+        sheets = trip.sheets()
 
     if trip:
         h1 = trip.name
@@ -85,23 +102,161 @@ def triptemplate(request, identifier):
         'trip': trip,
         'trips': trips,
         'uploadFile': forms.UploadFile(),
+        'uploadPhotos': forms.UploadPhotos(),
         'forms': True,
-        #'gpxfiles': gpxfiles,
+        'gpxfiles': gpxfiles,
+        'tracks': tracks,
+        'sheets': sheets,
     }
 
     return render(request, template, context)
 
 
+def export(request, identifier):
+    """Download a trip's waypoints, points of interest, routes and tracks.
+
+    The gpx file is streamed from the database as it is written.
+    """
+
+    trip = get_object_or_404(models.Trip, id__startswith=identifier)
+
+    response = StreamingHttpResponse(
+        gpxwriter.trip_gpx(trip), content_type='application/gpx+xml')
+    response['Content-Disposition'] = (
+        'attachment; filename="%s.gpx"' % trip.slug())
+
+    return response
+
+
+def mappack_download(request, identifier):
+    """Download a trip's offline map pack, as a GeoPackage.
+
+    Packs are built ahead of time, by the buildmappack command; a
+    request never builds one.
+    """
+
+    trip = get_object_or_404(models.Trip, id__startswith=identifier)
+
+    filepath = mappack.latest(trip)
+    if filepath is None:
+        raise Http404('No map pack has been built for this trip.')
+    try:
+        f = open(filepath, 'rb')
+    except (IOError, OSError):
+        raise Http404('The map pack is being rebuilt; try again shortly.')
+
+    response = FileResponse(
+        f, content_type='application/geopackage+sqlite3')
+    response['Content-Disposition'] = (
+        'attachment; filename="%s.gpkg"' % trip.slug())
+
+    return response
+
+
+def file_etag(request, identifier, filename):
+    trip = models.Trip.objects.filter(id__startswith=identifier).first()
+    if trip:
+        return trip.file_digests().get(filename)
+
+
+@etag(file_etag)
+def download(request, identifier, filename):
+    """Download a stored file. Its content digest is the ETag."""
+
+    trip = get_object_or_404(models.Trip, id__startswith=identifier)
+    tripfile = get_object_or_404(
+        models.TripFile, trip=trip, filename=filename)
+
+    response = FileResponse(
+        tripfile.blob.open(),
+        content_type=(
+            mimetypes.guess_type(filename)[0] or 'application/octet-stream'),
+    )
+    response['Content-Disposition'] = (
+        'attachment; filename="%s"' % filename)
+
+    return response
+
+
+def addplaces(request, identifier):
+    """Add gazetteer places, posted by identifier, as points of interest.
+    """
+
+    trip = get_object_or_404(models.Trip, id__startswith=identifier)
+
+    if request.POST:
+        places = PlaceName.objects.filter(
+            identifier__in=request.POST.getlist('place'))
+        models.PointsOfInterest.from_places(places, trip=trip)
+
+    return redirect(trip.url)
+
+
+def cursor(text):
+    """Parse a 'segment:ordinal' point page cursor, or return None."""
+
+    try:
+        (segment, ordinal) = text.split(':')
+        return (int(segment), int(ordinal))
+    except (AttributeError, ValueError):
+        return None
+
+
+def bad_request(message):
+    """A JSON response for a request with an invalid parameter."""
+
+    return JsonResponse({'error': message}, status=400)
+
+
+def positive(request, name, default):
+    """Parse a positive integer parameter, or raise ValueError."""
+
+    try:
+        value = int(request.GET.get(name, default))
+    except (TypeError, ValueError):
+        value = 0
+    if value < 1:
+        raise ValueError('%s must be a positive integer.' % name)
+
+    return value
+
+
+def numbers(request, name, count):
+    """Parse a parameter of count comma separated numbers."""
+
+    try:
+        values = [float(value) for value in request.GET[name].split(',')]
+    except ValueError:
+        values = []
+    if len(values) != count:
+        raise ValueError('%s must be %d comma separated numbers.' % (
+            name, count))
+
+    return values
+
+
 def viewdata(request, command, identifier):
     template = 'trips/data.html'
     route = None
     track = None
+    stats = None
+    points = None
+    after = None
     waypoint = None
 
     if command == 'route':
         pass
     elif command == 'track':
         track = models.Track.objects.get(id=identifier)
+        after = cursor(request.GET.get('after'))
+        if request.GET.get('after') and after is None:
+            return HttpResponseBadRequest('Invalid after cursor.')
+        if after is None:
+            # Statistics read every point, so only head the first page.
+            stats = track.stats()
+        (points, after) = track.point_page(after)
+        if after:
+            after = '%d:%d' % after
     elif command == 'waypoint':
         waypoint = models.Waypoint.objects.get(id=identifier)
         pass
@@ -112,6 +267,9 @@ def viewdata(request, command, identifier):
         'identifier': identifier,
         'route': route,
         'track': track,
+        'stats': stats,
+        'points': points,
+        'after': after,
         'waypoint': waypoint,
     }
     return render(request, template, context)
@@ -122,21 +280,30 @@ def viewfile(request, identifier, filename):
     template = 'trips/viewfile.html'
     h1 = 'View a file'
     warnings = []
+    filetype = None
+    gpxfile = None
 
     trip = models.Trip.objects.get(id__startswith=identifier)
-    filepath = os.path.join(trip.filespace(), filename)
+    tripfile = get_object_or_404(
+        models.TripFile, trip=trip, filename=filename)
+    tripfile.trip = trip
 
-    if filename in trip.directory().model['gpx']:
+    if tripfile.filetype == 'gpx':
         h1 = 'Examine a gpx file'
         filetype = 'gpx'
-
-        f = open(filepath)
-        gpxf = models.GPXFile(f, trip)
+        gpxfile = tripfile.analysis()
 
     if request.GET:
         if ('command' in request.GET.keys() and
                 request.GET['command'] == 'inject'):
-            warnings.extend(gpxf.inject())
+            job = models.Job.submit(trip, filename)
+            warnings.append(
+                "Injection queued as job <a href='" + job.url + "'>" +
+                str(job.id) + "</a>."
+            )
+
+    job = models.Job.objects.filter(
+        trip=trip, filename=filename).order_by('-created').first()
 
     context = {
         'h1': h1,
@@ -144,11 +311,197 @@ def viewfile(request, identifier, filename):
         'filename': filename,
         'filetype': filetype,
         'trip': trip,
-        'gpxf': gpxf,
-        'gpxfile': gpxf.analyse(),
+        'gpxfile': gpxfile,
+        'job': job,
         'warnings': warnings,
     }
 
     return render(request, template, context)
 
 
+def track_geometry(request, identifier):
+    """Return a track as a GeoJSON feature.
+
+    With a zoom parameter, the geometry is simplified to suit a web
+    map at that zoom level.
+    """
+
+    track = get_object_or_404(models.Track, id=identifier)
+
+    zoom = request.GET.get('zoom')
+    if zoom is not None:
+        try:
+            zoom = int(zoom)
+        except ValueError:
+            zoom = -1
+        if zoom < 0:
+            return bad_request('zoom must be a whole number, from 0.')
+    geom = track.geometry(zoom)
+
+    feature = {
+        'type': 'Feature',
+        'id': track.id,
+        'properties': {
+            'name': track.name,
+            'url': track.url,
+        },
+        'geometry': json.loads(geom.geojson) if geom else None,
+    }
+
+    return JsonResponse(feature)
+
+
+def track_points(request, identifier):
+    """Return a page of a track's points as JSON.
+
+    Pass the next cursor of one page as the after parameter to get
+    the following page.
+    """
+
+    track = get_object_or_404(models.Track, id=identifier)
+    try:
+        limit = min(
+            positive(request, 'limit', settings.POINT_PAGE_SIZE),
+            settings.POINT_PAGE_SIZE * 10)
+    except ValueError as e:
+        return bad_request('%s' % e)
+
+    after = cursor(request.GET.get('after'))
+    if request.GET.get('after') and after is None:
+        return bad_request('after must be a segment:ordinal cursor.')
+    (points, after) = track.point_page(after, limit)
+
+    return JsonResponse({
+        'fields': models.TrackPoint.PAGE_FIELDS,
+        'points': points,
+        'next': '%d:%d' % after if after else None,
+    })
+
+
+SEARCH_KINDS = {
+    'track': models.Track,
+    'segment': models.TrackSegment,
+    'waypoint': models.Waypoint,
+    'poi': models.PointsOfInterest,
+}
+
+
+def search(request):
+    """Find tracks, segments, waypoints, points of interest or trips.
+
+    Parameters are kind, one of SEARCH_KINDS or 'trip'; and either
+    bbox, as west,south,east,north; or near, as latitude,longitude,
+    with radius in metres or k, the number of nearest to return.
+    Results are returned as JSON, nearest first for near searches.
+    See trips.spatial.
+    """
+
+    kind = request.GET.get('kind', 'track')
+    if kind == 'trip':
+        kinds = ('track', 'waypoint', 'poi')
+    elif kind in SEARCH_KINDS:
+        kinds = (kind,)
+    else:
+        raise Http404('No such kind.')
+
+    try:
+        limit = positive(request, 'limit', settings.SPATIAL_LIMIT)
+        if 'bbox' in request.GET:
+            bbox = numbers(request, 'bbox', 4)
+        elif 'near' in request.GET:
+            (latitude, longitude) = numbers(request, 'near', 2)
+            if 'radius' in request.GET:
+                (radius,) = numbers(request, 'radius', 1)
+            else:
+                k = positive(request, 'k', 10)
+    except ValueError as e:
+        return bad_request('%s' % e)
+
+    found = []
+
+    for name in kinds:
+        queryset = SEARCH_KINDS[name].objects.all()
+        if 'bbox' in request.GET:
+            found.extend(
+                (None, record)
+                for record in spatial.in_bbox(queryset, bbox)[:limit])
+
+        elif 'near' in request.GET:
+            if 'radius' in request.GET:
+                found.extend(spatial.within(
+                    queryset, longitude, latitude, radius)[:limit])
+            else:
+                found.extend(spatial.nearest(
+                    queryset, longitude, latitude, k))
+
+    if kind == 'trip':
+        result = trip_results(found, limit)
+    else:
+        result = [
+            {
+                'kind': kind,
+                'id': record.id,
+                'name': '%s' % record,
+                'url': getattr(record, 'url', None),
+                'metres': metres,
+            }
+            for (metres, record) in found
+        ]
+
+    return JsonResponse({'results': result})
+
+
+def trip_results(found, limit):
+    """Trips of search results, each at the distance of its nearest."""
+
+    nearest = {}
+    for (metres, record) in found:
+        if isinstance(record, models.PointsOfInterest):
+            trip_ids = record.trips.values_list('id', flat=True)
+        else:
+            trip_ids = [record.trip_id]
+        for trip_id in trip_ids:
+            if trip_id not in nearest or (
+                    metres is not None and metres < nearest[trip_id]):
+                nearest[trip_id] = metres
+
+    trips = models.Trip.objects.in_bulk(list(nearest))
+    ordered = sorted(nearest, key=lambda trip_id: (
+        nearest[trip_id] is None, nearest[trip_id], trips[trip_id].name))
+
+    return [
+        {
+            'kind': 'trip',
+            'id': trips[trip_id].identifier(),
+            'name': trips[trip_id].name,
+            'url': trips[trip_id].url,
+            'metres': nearest[trip_id],
+        }
+        for trip_id in ordered[:limit]
+    ]
+
+
+def tile(request, identifier, z, x, y):
+    """Serve a GeoJSON map tile of a trip's data.
+
+    See trips.tiles.
+    """
+
+    (z, x, y) = (int(z), int(x), int(y))
+    if z > settings.TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        raise Http404('No such tile.')
+
+    trip = get_object_or_404(models.Trip, id__startswith=identifier)
+
+    return HttpResponse(
+        tiles.cached_tile(trip, z, x, y), content_type='application/json')
+
+
+def job(request, identifier):
+    """Report the status of an injection job, as JSON."""
+
+    job = get_object_or_404(models.Job, id=identifier)
+
+    return JsonResponse(job.as_dict())
+
+